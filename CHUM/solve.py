@@ -153,11 +153,13 @@ def write_to_excel(model):
 
     wb.save(filename)
 
-print()
-model = compute_schedule()
-print(model)
-#write_to_excel(model)
-print()
+if __name__ == '__main__':
+    # only when run as a script, so that compute_schedule can be imported, e.g. by the benchmarks
+    print()
+    model = compute_schedule()
+    print(model)
+    #write_to_excel(model)
+    print()
 
 
 
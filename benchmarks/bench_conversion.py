@@ -0,0 +1,80 @@
+"""
+Compares the list-based model conversions that utilities used to run with the
+vectorised ones, and with bit-packed ScheduleModels, on a roster of 500 staff x 200
+shifts (10^5 variables).
+
+    python benchmarks/bench_conversion.py [n_staff] [n_shifts]
+"""
+import pathlib
+import random
+import sys
+import timeit
+
+sys.path.insert(1, str(pathlib.Path(__file__).parent.parent / 'standalone_scheduling'))
+from roster import Roster
+from model import ScheduleModel
+from utilities import binary_variable_decoding, date_and_time_as_string
+from utilities import compute_distance, changed_variables, model_as_schedule, model_as_array, variables_as_schedule
+
+
+def list_distance(model_A, model_B):
+    d = 0
+    for v, w in zip(model_A, model_B):
+        if v * w < 0:
+            d += 1
+    return d
+
+def list_diff(old_model, new_model, roster):
+    to_add, to_remove = [], []
+    for old_v, new_v in zip(old_model, new_model):
+        shift_index, staff_index = binary_variable_decoding(abs(old_v), roster.n_staff)
+        calendar_date, time = date_and_time_as_string(shift_index)
+        item = {"id": str(abs(old_v)), "staff_name": roster.staff_inverted_dict[str(staff_index)],
+                "date": calendar_date, "time": time, "validated": False}
+        if old_v * new_v < 0:
+            (to_add if new_v > 0 else to_remove).append(item)
+    return to_add, to_remove
+
+def list_model_as_schedule(model, roster):
+    schedule = []
+    for v in model:
+        shift_index, staff_index = binary_variable_decoding(abs(v), roster.n_staff)
+        if v > 0:
+            calendar_date, time = date_and_time_as_string(shift_index)
+            schedule.append({"id": str(abs(v)), "staff_name": roster.staff_inverted_dict[str(staff_index)], "date": calendar_date, "time": time})
+    return schedule
+
+def vectorised_diff(old_model, new_model, roster):
+    variables, new_values = changed_variables(old_model, new_model)
+    return (variables_as_schedule(variables[new_values], roster, validated=False),
+            variables_as_schedule(variables[~new_values], roster, validated=False))
+
+def random_model(n_variables, density, rng):
+    return [v if rng.random() < density else -v for v in range(1, n_variables+1)]
+
+def main(n_staff=500, n_shifts=200, repeat=5):
+    rng = random.Random(0)
+    roster = Roster(['staff{0}'.format(i) for i in range(n_staff)], n_shifts)
+    old_model = random_model(roster.top_id, 0.2, rng)
+    new_model = [-v if rng.random() < 0.01 else v for v in old_model]
+    old_values, new_values = model_as_array(old_model), model_as_array(new_model)
+    old_bits, new_bits = ScheduleModel.from_model(old_model, n_staff), ScheduleModel.from_model(new_model, n_staff)
+
+    # the numpy side of 'distance' converts the lists first, 'distance (arrays)' works on
+    # models already held as bool arrays
+    cases = [('distance', lambda: list_distance(old_model, new_model), lambda: compute_distance(old_model, new_model)),
+             ('distance (arrays)', lambda: list_distance(old_model, new_model), lambda: compute_distance(old_values, new_values)),
+             ('distance (bits)', lambda: list_distance(old_model, new_model), lambda: compute_distance(old_bits, new_bits)),
+             ('diff', lambda: list_diff(old_model, new_model, roster), lambda: vectorised_diff(old_model, new_model, roster)),
+             ('diff (bits)', lambda: list_diff(old_model, new_model, roster), lambda: vectorised_diff(old_bits, new_bits, roster)),
+             ('model_as_schedule', lambda: list_model_as_schedule(old_model, roster), lambda: model_as_schedule(old_model, roster)),
+             ('model_as_schedule (bits)', lambda: list_model_as_schedule(old_model, roster), lambda: model_as_schedule(old_bits, roster))]
+    print('{0} variables, a model takes {1:.0f} kB as a list of ints and {2:.1f} kB bit-packed'.format(
+        roster.top_id, (sys.getsizeof(old_model) + sum(sys.getsizeof(v) for v in old_model)) / 1e3, sys.getsizeof(old_bits.bits) / 1e3))
+    for name, baseline, vectorised in cases:
+        baseline_time = min(timeit.repeat(baseline, number=1, repeat=repeat))
+        vectorised_time = min(timeit.repeat(vectorised, number=1, repeat=repeat))
+        print('{0:<26} lists {1:8.2f} ms   numpy {2:8.2f} ms   x{3:.1f}'.format(name, baseline_time * 1e3, vectorised_time * 1e3, baseline_time / vectorised_time))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
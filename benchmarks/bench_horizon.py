@@ -0,0 +1,57 @@
+"""
+Compares the per-item strptime/date.today() conversions that utilities used to run
+with a Horizon built once per request, on a schedule of a 500 staff x 200 shifts roster.
+
+    python benchmarks/bench_horizon.py [n_staff] [n_shifts]
+"""
+from datetime import date
+import pathlib
+import random
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(1, str(pathlib.Path(__file__).parent.parent / 'standalone_scheduling'))
+from roster import Roster
+from utilities import days_between, date_and_time_as_string, binary_variable_encoding
+from utilities import model_as_schedule, schedule_as_model, variables_as_schedule
+
+
+def strptime_schedule_as_model(schedule, roster):
+    values = np.zeros(roster.top_id, dtype=bool)
+    for item in schedule:
+        staff_index = roster.staff_dict[item["staff_name"]]
+        shift_index = days_between(item["date"], str(date.today())) * 2
+        if item["time"] == "night":
+            shift_index += 1
+        values[binary_variable_encoding(shift_index, staff_index, roster.n_staff) - 1] = True
+    return values
+
+def strptime_model_as_schedule(model, roster):
+    schedule = []
+    for v in (np.flatnonzero(model) + 1).tolist():
+        shift_index, staff_index = divmod(v - 1, roster.n_staff)
+        calendar_date, time = date_and_time_as_string(shift_index)
+        schedule.append({"id": str(v), "staff_name": roster.staff_inverted_dict[str(staff_index + 1)], "date": calendar_date, "time": time})
+    return schedule
+
+def main(n_staff=500, n_shifts=200, repeat=5):
+    rng = random.Random(0)
+    roster = Roster(['staff{0}'.format(i) for i in range(n_staff)], n_shifts)
+    model = [v if rng.random() < 0.2 else -v for v in range(1, roster.top_id+1)]
+    values = np.array(model) > 0
+    schedule = model_as_schedule(model, roster)
+
+    cases = [('schedule_as_model', lambda: strptime_schedule_as_model(schedule, roster), lambda: schedule_as_model(schedule, roster, roster.horizon())),
+             ('model_as_schedule', lambda: strptime_model_as_schedule(values, roster), lambda: model_as_schedule(values, roster, roster.horizon()))]
+    print('{0} schedule items'.format(len(schedule)))
+    for name, baseline, horizon in cases:
+        baseline_time = min(timeit.repeat(baseline, number=1, repeat=repeat))
+        horizon_time = min(timeit.repeat(horizon, number=1, repeat=repeat))
+        print('{0:<20} strptime {1:8.2f} ms   horizon {2:8.2f} ms   x{3:.1f}'.format(name, baseline_time * 1e3, horizon_time * 1e3, baseline_time / horizon_time))
+    # included in the horizon times above
+    print('{0:<20} {1:8.2f} ms'.format('building the horizon', min(timeit.repeat(roster.horizon, number=1, repeat=repeat)) * 1e3))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
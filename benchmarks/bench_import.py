@@ -0,0 +1,80 @@
+"""
+Import time of the API, the part of a cold start (scale from zero) spent before uvicorn
+can serve. Runs `python -X importtime -c "import main"` in fresh interpreters, without
+the Cosmos credentials so that an import needing them or the network fails, and reports
+the best total and the slowest direct imports. Exits with 1 when the best total is over
+the budget or a module that must stay lazy was imported, so it can gate CI.
+
+    python benchmarks/bench_import.py [--budget 1500] [--repeat 5] [--top 15]
+        [--module main] [--lazy openpyxl] [--out results.json]
+"""
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+
+root = pathlib.Path(__file__).parent.parent
+
+# loaded on first use only, the API never needs them to start: the solver modules are
+# imported by the requests that solve, the .env file is read at startup
+lazy_modules = ['openpyxl', 'pyinstrument', 'openai', 'pysat', 'numpy', 'dotenv']
+
+
+def import_times(module):
+    # (self, cumulative, depth, name) of every module imported, in microseconds
+    env = {name: value for name, value in os.environ.items() if not name.startswith('AZURE_COSMOS_')}
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=root, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError('import {0} failed:\n{1}'.format(module, result.stderr[-2000:]))
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return times
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--budget', type=float, default=float(os.environ.get('IMPORT_BUDGET_MS', 1500)),
+                        help='milliseconds, best of --repeat')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--lazy', nargs='*', default=lazy_modules, help='modules that must not be imported')
+    parser.add_argument('--out', help='also write the results as JSON there')
+    args = parser.parse_args(argv)
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    totals = [sum(self_us for self_us, _, _, _ in times) / 1000 for times in runs]
+    best = runs[totals.index(min(totals))]
+    imported = set(name for _, _, _, name in best)
+    eager = sorted(name for name in imported if name.split('.')[0] in args.lazy)
+
+    print('import {0}: best {1:.1f} ms, worst {2:.1f} ms over {3} runs, budget {4:.0f} ms'.format(
+        args.module, min(totals), max(totals), args.repeat, args.budget))
+    # the direct imports of the module and of site, by cumulative time
+    top_level = sorted((entry for entry in best if entry[2] <= 1), key=lambda entry: -entry[1])
+    for self_us, cumulative_us, depth, name in top_level[:args.top]:
+        print('{0:>10.1f} ms {1:>10.1f} ms  {2}'.format(cumulative_us / 1000, self_us / 1000, '  ' * depth + name))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'module': args.module, 'totals_ms': totals, 'budget_ms': args.budget, 'eager': eager,
+                       'imports': [dict(zip(['self_us', 'cumulative_us', 'depth', 'name'], entry)) for entry in best]}, f, indent=2)
+
+    failed = False
+    if min(totals) > args.budget:
+        print('over budget by {0:.1f} ms'.format(min(totals) - args.budget))
+        failed = True
+    if eager:
+        print('imported at startup but meant to be lazy:', ', '.join(eager))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+Benchmark suite of the solver on synthetic rosters (see synthetic.py). For every roster
+of the grid, encoding and solver backend, the phases are timed separately:
+- encode: get_permanent_constraints
+- load: a cold SolverSession loaded with the permanent constraints
+- closest: find_closest_model with the requests as hard assumptions, then explain when
+  they conflict
+- preferred: find_preferred_model with the requests as weighted soft clauses
+- conversions between models and schedules, and the diff, once per roster
+and optionally CHUM's compute_schedule and the API end to end on a local Cosmos
+stand-in (see local_cosmos.py). Every timing is the best of --repeat runs. Results are
+written as JSON and CSV, one row per phase, to track regressions over time.
+
+    python benchmarks/bench_solver.py [--staff 20 40] [--shifts 28 56] [--teams 1]
+        [--density 0.05] [--infeasibility 0.1] [--encodings native totalizer]
+        [--budget 5] [--repeat 3] [--chum] [--api] [--out benchmarks/results]
+"""
+from datetime import datetime
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import time
+
+root = pathlib.Path(__file__).parent.parent
+sys.path.insert(1, str(root / 'standalone_scheduling'))
+sys.path.insert(1, str(root / 'benchmarks'))
+import local_cosmos
+local_cosmos.install() # before the app modules bind azure.cosmos.CosmosClient
+
+import pysat
+from cardinality import encodings, formula_size
+from session import SolverSession
+from solve import get_permanent_constraints, negotiable_constraints_as_clauses, negotiable_constraints_as_soft_clauses
+from solve import model_diff
+from utilities import model_as_schedule, schedule_as_model
+from synthetic import synthetic_roster, synthetic_model, synthetic_requests
+
+
+# backends benchmarked for each encoding, only solvers with native cardinality constraints take 'native'
+solvers = {'native' : ['minicard', 'gluecard4'],
+           'seqcounter' : ['cadical153', 'glucose4'],
+           'totalizer' : ['cadical153', 'glucose4'],
+           'shared' : ['cadical153', 'glucose4']}
+
+def best_time(fn, repeat):
+    # best of repeat runs and the value of the last one, the solvers print their stats
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            value = fn()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, value
+
+def cold_session(solver_name, formula, roster, method, *args):
+    # a new session every run, so that nothing learned by the previous run is reused
+    session = SolverSession(solver_name, formula, roster.top_id)
+    try:
+        start = time.perf_counter()
+        value = getattr(session, method)(*args)
+        return time.perf_counter() - start, value
+    finally:
+        session.delete()
+
+def solve_phase(solver_name, formula, roster, repeat, method, *args):
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, value = cold_session(solver_name, formula, roster, method, *args)
+        best = elapsed if best is None else min(best, elapsed)
+    return best, value
+
+def bench_roster(roster, old_model, requests, encodings, budget, repeat):
+    records = []
+    horizon = roster.horizon()
+    hard = negotiable_constraints_as_clauses(requests, roster, horizon)
+    soft = negotiable_constraints_as_soft_clauses(requests, roster, horizon)
+    assumptions = [clause[0] for clause in hard]
+    soft_literals = [clause[0] for clause in soft.soft]
+    for encoding in encodings:
+        seconds, formula = best_time(lambda: get_permanent_constraints(roster, encoding), repeat)
+        records.append(dict(phase='encode', encoding=encoding, seconds=seconds, **formula_size(formula)))
+        for solver_name in solvers[encoding]:
+            case = {'encoding': encoding, 'solver': solver_name}
+            seconds, _ = best_time(lambda: SolverSession(solver_name, formula, roster.top_id).delete(), repeat)
+            records.append(dict(case, phase='load', seconds=seconds))
+
+            seconds, (new_model, distance, stats) = solve_phase(solver_name, formula, roster, repeat,
+                                                                'find_closest_model', old_model, assumptions)
+            records.append(dict(case, phase='closest', seconds=seconds, feasible=new_model is not None,
+                                distance=distance, optimal=stats['optimal'], solver_calls=stats['solver_calls']))
+            if new_model is None:
+                seconds, (mus, mcs, stats) = solve_phase(solver_name, formula, roster, repeat, 'explain', assumptions)
+                records.append(dict(case, phase='explain', seconds=seconds, conflicts=len(mus or []),
+                                    relax=len(mcs or []), solver_calls=stats['solver_calls']))
+
+            seconds, (new_model, distance, stats) = solve_phase(solver_name, formula, roster, repeat, 'find_preferred_model',
+                                                                old_model, soft_literals, soft.wght, budget)
+            records.append(dict(case, phase='preferred', seconds=seconds, feasible=new_model is not None, distance=distance,
+                                optimal=stats.get('optimal'), cost=stats['cost'], lower_bound=stats['lower_bound'],
+                                violated=stats['violated'], solver_calls=stats.get('solver_calls', 0) + stats['cost_calls']))
+    return records, new_model
+
+def bench_conversion(roster, old_model, new_model, repeat):
+    horizon = roster.horizon()
+    schedule = model_as_schedule(old_model, roster, horizon)
+    cases = [('model_as_schedule', lambda: model_as_schedule(old_model, roster, horizon)),
+             ('schedule_as_model', lambda: schedule_as_model(schedule, roster, horizon)),
+             ('model_diff', lambda: model_diff(old_model, new_model, roster, horizon))]
+    return [{'phase': phase, 'seconds': best_time(fn, repeat)[0], 'items': len(schedule)} for phase, fn in cases]
+
+def bench_chum(repeat):
+    # the prototype of CHUM/solve.py, 7 staff x 28 shifts
+    sys.path.insert(1, str(root))
+    from CHUM.solve import compute_schedule
+    seconds, model = best_time(compute_schedule, repeat)
+    return [{'phase': 'compute_schedule', 'encoding': 'native', 'solver': 'minicard', 'seconds': seconds,
+             'n_staff': 7, 'n_shifts': 28}]
+
+def bench_api(roster, old_model, requests, repeat):
+    # /addConstraint, /getScheduleChanges and /getSchedule through the app, on the local Cosmos stand-in
+    os.chdir(root) # main reads .env and .well-known from the working directory
+    sys.path.insert(1, str(root))
+    from fastapi.testclient import TestClient
+    import cosmos
+    import main
+    from roster import register_roster
+    register_roster(roster)
+    for container_name in ['schedule', 'negotiable_constraints', 'schedule_diff_to_add', 'schedule_diff_to_remove']:
+        cosmos.create_container(roster.database_name, container_name)
+    cosmos.write_generation(model_as_schedule(old_model, roster), 'schedule', roster.database_name)
+    cosmos.write_many(requests[1:], 'negotiable_constraints', roster.database_name)
+    records = []
+    with TestClient(main.app, raise_server_exceptions=False) as client, contextlib.redirect_stdout(io.StringIO()):
+        def timed(phase, method, path, **kwargs):
+            start = time.perf_counter()
+            response = getattr(client, method)(path, params={'ward': roster.name}, **kwargs)
+            records.append({'phase': phase, 'seconds': time.perf_counter() - start, 'status': response.status_code})
+        if requests:
+            request = requests[0]
+            timed('api_add_constraint', 'post', '/addConstraint',
+                  json={'id': '', 'staff_name': request['staff_name'], 'calendar_or_relative': 'calendar',
+                        'date': request['date'], 'time': request['time'], 'priority': request['priority']})
+        for _ in range(repeat): # before the diffs are written, /getSchedule refuses unvalidated changes
+            timed('api_get_schedule', 'get', '/getSchedule')
+        timed('api_get_schedule_changes', 'get', '/getScheduleChanges')
+        for _ in range(repeat): # answered from the result cache of the solve workers
+            timed('api_get_schedule_changes_again', 'get', '/getScheduleChanges')
+    best = {}
+    for record in records:
+        if record['phase'] not in best or record['seconds'] < best[record['phase']]['seconds']:
+            best[record['phase']] = record
+    return list(best.values())
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def write_results(records, metadata, out):
+    out = pathlib.Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    stem = out / 'solver-{0}'.format(metadata['timestamp'].replace(':', '-'))
+    with open(stem.with_suffix('.json'), 'w') as f:
+        json.dump({'metadata': metadata, 'records': records}, f, indent=2)
+    columns = list(dict.fromkeys(column for record in records for column in record))
+    with open(stem.with_suffix('.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(records)
+    return stem
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--staff', type=int, nargs='+', default=[20, 40])
+    parser.add_argument('--shifts', type=int, nargs='+', default=[28, 56])
+    parser.add_argument('--teams', type=int, default=1)
+    parser.add_argument('--density', type=float, default=0.05, help='fraction of (staff, shift) pairs requested off')
+    parser.add_argument('--infeasibility', type=float, default=0.1, help='fraction of day shifts left short of staff')
+    parser.add_argument('--encodings', nargs='+', default=encodings, choices=encodings)
+    parser.add_argument('--budget', type=float, default=5.0, help='seconds of MaxSAT search per solve')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chum', action='store_true', help='also time CHUM/solve.py compute_schedule')
+    parser.add_argument('--api', action='store_true', help='also time the API end to end on a local Cosmos stand-in')
+    parser.add_argument('--out', default=str(root / 'benchmarks' / 'results'))
+    args = parser.parse_args(argv)
+
+    metadata = {'timestamp': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+                'python': platform.python_version(), 'pysat': pysat.__version__, 'machine': platform.machine(),
+                'args': vars(args)}
+    records = []
+    for n_staff in args.staff:
+        for n_shifts in args.shifts:
+            roster = synthetic_roster(n_staff, n_shifts, args.teams)
+            old_model = synthetic_model(roster, get_permanent_constraints(roster), args.seed)
+            requests = synthetic_requests(roster, roster.horizon(), args.density, args.infeasibility, args.seed)
+            case = {'n_staff': n_staff, 'n_shifts': n_shifts, 'requests': len(requests)}
+            roster_records, new_model = bench_roster(roster, old_model, requests, args.encodings, args.budget, args.repeat)
+            roster_records += bench_conversion(roster, old_model, new_model, args.repeat)
+            if args.api:
+                roster_records += bench_api(roster, old_model, requests, args.repeat)
+            for record in roster_records:
+                records.append(dict(case, **record))
+                print('{n_staff:>4} x {n_shifts:<4} {phase:<32} {encoding:<10} {solver:<10} {seconds:9.4f}s'.format(
+                    **dict({'encoding': '', 'solver': ''}, **records[-1])))
+    if args.chum:
+        records += bench_chum(args.repeat)
+        print('CHUM compute_schedule {0:.4f}s'.format(records[-1]['seconds']))
+    print('results written to', write_results(records, metadata, args.out))
+
+
+if __name__ == '__main__':
+    main()
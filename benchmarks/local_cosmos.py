@@ -0,0 +1,235 @@
+"""
+In-memory stand-in for the Cosmos DB clients, so the API path can be benchmarked
+without an Azure account. It answers the queries the app sends (filters on item
+fields, ARRAY_CONTAINS, IS_DEFINED and paging) and the etag conditions of its
+replaces, and nothing more.
+
+    import local_cosmos
+    local_cosmos.install() # before cosmos, cosmos_aio or main are imported
+"""
+import itertools
+import os
+import re
+
+from azure.core import MatchConditions
+import azure.cosmos
+import azure.cosmos.aio
+from azure.cosmos import exceptions
+
+
+databases = {} # database name -> container name -> item id -> item
+counters = {'reads': 0, 'queries': 0, 'upserts': 0, 'deletes': 0}
+etags = itertools.count(1)
+
+comparisons = {'=': lambda a, b: a == b, '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+               '<': lambda a, b: a < b, '<=': lambda a, b: a <= b}
+condition_pattern = re.compile(r'(NOT )?(?:ARRAY_CONTAINS\((@\w+), c\.(\w+)\)|IS_DEFINED\(c\.(\w+)\)|c\.(\w+) (>=|<=|=|>|<) (@\w+))')
+
+def matches(item, query, parameters):
+    # the WHERE clause is a conjunction, or a disjunction of negations for the cleanup queries
+    where = query.split(' WHERE ', 1)[1] if ' WHERE ' in query else ''
+    conditions = []
+    for negated, array, array_field, defined_field, field, operator, value in condition_pattern.findall(where):
+        if array:
+            result = item.get(array_field) in parameters[array]
+        elif defined_field:
+            result = defined_field in item
+        else:
+            result = field in item and comparisons[operator](item[field], parameters[value])
+        conditions.append(result != bool(negated))
+    return any(conditions) if ' OR ' in where else all(conditions)
+
+def select(item, query):
+    return {'id': item['id']} if query.startswith('SELECT c.id ') else dict(item)
+
+
+class Pages():
+    # by_page iterator, the continuation token is the offset of the next page
+    def __init__(self, items, page_size, token):
+        self.items = items
+        self.page_size = page_size or 100
+        self.offset = int(token or 0)
+        self.continuation_token = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.offset >= len(self.items):
+            raise StopIteration
+        page = self.items[self.offset:self.offset + self.page_size]
+        self.offset += self.page_size
+        self.continuation_token = str(self.offset) if self.offset < len(self.items) else None
+        return iter(page)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return AsyncItems(list(next(self)))
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class Items(list):
+
+    def __init__(self, items, page_size=None):
+        super().__init__(items)
+        self.page_size = page_size
+
+    def by_page(self, continuation_token=None):
+        return Pages(list(self), self.page_size, continuation_token)
+
+
+class ContainerProxy():
+
+    def __init__(self, database_name, container_name):
+        self.database_name = database_name
+        self.id = container_name
+
+    @property
+    def items(self):
+        try:
+            return databases[self.database_name][self.id]
+        except KeyError:
+            raise exceptions.CosmosResourceNotFoundError(message='container {0} not found'.format(self.id))
+
+    def query_items(self, query, parameters=None, max_item_count=None, **kwargs):
+        counters['queries'] += 1
+        parameters = {parameter['name'] : parameter['value'] for parameter in parameters or []}
+        return Items([select(item, query) for item in self.items.values() if matches(item, query, parameters)], max_item_count)
+
+    def read_item(self, item, partition_key, **kwargs):
+        counters['reads'] += 1
+        try:
+            return dict(self.items[item])
+        except KeyError:
+            raise exceptions.CosmosResourceNotFoundError(message='item {0} not found'.format(item))
+
+    def upsert_item(self, body, response_hook=None, **kwargs):
+        counters['upserts'] += 1
+        body = self.items[body['id']] = dict(body, _etag=str(next(etags)))
+        if response_hook is not None:
+            response_hook({'x-ms-request-charge': '0.0'}, body)
+        return dict(body)
+
+    def create_item(self, body, **kwargs):
+        if body['id'] in self.items:
+            raise exceptions.CosmosResourceExistsError(message='item {0} already exists'.format(body['id']))
+        return self.upsert_item(body)
+
+    def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        current = self.read_item(item, item)
+        if match_condition == MatchConditions.IfNotModified and current['_etag'] != etag:
+            raise exceptions.CosmosAccessConditionFailedError(message='item {0} was modified'.format(item))
+        return self.upsert_item(body)
+
+    def delete_item(self, item, partition_key, **kwargs):
+        counters['deletes'] += 1
+        if self.items.pop(item if isinstance(item, str) else item['id'], None) is None:
+            raise exceptions.CosmosResourceNotFoundError(message='item not found')
+
+
+class DatabaseProxy():
+
+    def __init__(self, database_name):
+        self.id = database_name
+        databases.setdefault(database_name, {})
+
+    def get_container_client(self, container_name):
+        return ContainerProxy(self.id, container_name)
+
+    def create_container(self, id, partition_key, **kwargs):
+        if id in databases[self.id]:
+            raise exceptions.CosmosResourceExistsError(message='container {0} already exists'.format(id))
+        databases[self.id][id] = {}
+        return self.get_container_client(id)
+
+    def create_container_if_not_exists(self, id, partition_key, **kwargs):
+        databases[self.id].setdefault(id, {})
+        return self.get_container_client(id)
+
+    def delete_container(self, container_name):
+        if databases[self.id].pop(container_name, None) is None:
+            raise exceptions.CosmosResourceNotFoundError(message='container {0} not found'.format(container_name))
+
+
+class CosmosClient():
+
+    def __init__(self, url=None, credential=None, **kwargs):
+        pass
+
+    def get_database_client(self, database_name):
+        return DatabaseProxy(database_name)
+
+
+class AsyncItems():
+    # async iterable of query results, with by_page
+    def __init__(self, items):
+        self.items = items
+
+    def by_page(self, continuation_token=None):
+        return self.items.by_page(continuation_token)
+
+    async def __aiter__(self):
+        for item in self.items:
+            yield item
+
+
+class AsyncContainerProxy(ContainerProxy):
+
+    def query_items(self, query, parameters=None, max_item_count=None, **kwargs):
+        return AsyncItems(super().query_items(query, parameters, max_item_count))
+
+    def query_items_change_feed(self, response_hook=None, **kwargs):
+        # writes of other processes never happen here, the cache is invalidated by the writers
+        if response_hook is not None:
+            response_hook({'etag': str(next(etags))}, [])
+        return AsyncItems([])
+
+    async def read_item(self, item, partition_key, **kwargs):
+        return super().read_item(item, partition_key)
+
+    async def upsert_item(self, body, response_hook=None, **kwargs):
+        return super().upsert_item(body, response_hook)
+
+    async def create_item(self, body, **kwargs):
+        return super().create_item(body)
+
+    async def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        return super().replace_item(item, body, etag, match_condition)
+
+    async def delete_item(self, item, partition_key, **kwargs):
+        return super().delete_item(item, partition_key)
+
+
+class AsyncDatabaseProxy(DatabaseProxy):
+
+    def get_container_client(self, container_name):
+        return AsyncContainerProxy(self.id, container_name)
+
+    async def create_container_if_not_exists(self, id, partition_key, **kwargs):
+        return super().create_container_if_not_exists(id, partition_key)
+
+
+class AsyncCosmosClient(CosmosClient):
+
+    def get_database_client(self, database_name):
+        return AsyncDatabaseProxy(database_name)
+
+    async def close(self):
+        pass
+
+
+def install():
+    # the app modules create their clients on first use, from the classes they imported
+    os.environ.setdefault('AZURE_COSMOS_ENDPOINT', 'https://localhost:8081/')
+    os.environ.setdefault('AZURE_COSMOS_API_KEY', 'bG9jYWw=')
+    azure.cosmos.CosmosClient = CosmosClient
+    azure.cosmos.aio.CosmosClient = AsyncCosmosClient
+
+def reset():
+    databases.clear()
+    for counter in counters:
+        counters[counter] = 0
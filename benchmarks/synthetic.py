@@ -0,0 +1,61 @@
+"""
+Synthetic rosters for the benchmarks: staff split into teams, a feasible schedule to
+start from, and staff requests of a given density, some shifts made infeasible on
+purpose by requests that leave a team short of staff.
+"""
+from datetime import timedelta
+import pathlib
+import random
+import sys
+
+sys.path.insert(1, str(pathlib.Path(__file__).parent.parent / 'standalone_scheduling'))
+from pysat.solvers import Solver
+from roster import Roster
+from constraints import normalised_constraint
+
+
+min_team_size = 8 # 4 staff per day and at most 4 shifts in 7 days: 7 is the least that can work
+
+def synthetic_roster(n_staff, n_shifts, n_teams=1, rolling=False, name=None):
+    if n_staff < n_teams * min_team_size:
+        raise ValueError('{0} staff cannot make {1} teams of {2}'.format(n_staff, n_teams, min_team_size))
+    staff_names = ['staff{0}'.format(i) for i in range(n_staff)]
+    teams = {'team{0}'.format(t) : staff_names[t::n_teams] for t in range(n_teams)}
+    name = name or 'synthetic-{0}x{1}'.format(n_staff, n_shifts)
+    return Roster(staff_names, n_shifts, name=name, database_name=name, rolling=rolling, teams=teams,
+                  seniority={staff_name : i % 12 for i, staff_name in enumerate(staff_names)})
+
+def synthetic_model(roster, formula, seed=0):
+    # a feasible schedule, random phases so that successive seeds give different ones
+    rng = random.Random(seed)
+    with Solver(name='minicard', bootstrap_with=formula) as solver:
+        solver.set_phases([v if rng.random() < 0.3 else -v for v in range(1, roster.top_id+1)])
+        if not solver.solve():
+            raise ValueError('the permanent constraints of {0!r} are unsatisfiable'.format(roster))
+        return solver.get_model()[:roster.top_id]
+
+def synthetic_requests(roster, horizon, density=0.05, infeasibility_rate=0.0, seed=0):
+    """
+    Staff requests as /addConstraint stores them: density is the fraction of the
+    (staff member, shift) pairs of the horizon requested off, and infeasibility_rate
+    the fraction of day shifts where all but 2 staff members of a team ask to be off,
+    so that they cannot all be granted. Today is never requested.
+    """
+    rng = random.Random(seed)
+    pairs = set()
+    for shift_index in range(2, horizon.n_shifts):
+        for staff_name in roster.staff_names:
+            if rng.random() < density:
+                pairs.add((staff_name, shift_index))
+    for shift_index in range(2, horizon.n_shifts, 2):
+        if rng.random() < infeasibility_rate:
+            staff_indices = rng.choice(list(roster.teams.values()))
+            for staff_index in rng.sample(staff_indices, len(staff_indices) - 2):
+                pairs.add((roster.staff_names[staff_index-1], shift_index))
+    requests = []
+    for staff_name, shift_index in sorted(pairs):
+        date, time = horizon.date_and_time(shift_index)
+        request = normalised_constraint(staff_name, 'calendar', date, time, roster, horizon, priority=rng.randint(1, 3))
+        request['added'] = str(horizon.start - timedelta(days=rng.randint(0, 60)))
+        requests.append(request)
+    return requests
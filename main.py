@@ -1,30 +1,60 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from routers.wellknown import wellknown
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import json
+import os
+import time
 
 # module imports
-from pysat.solvers import Solver
-from pysat.card import *
 import pathlib
 from datetime import date
 import json
 
 
-from pydantic import BaseModel
-from azure.cosmos import CosmosClient, PartitionKey, exceptions
+from pydantic import BaseModel, Field
 
 import sys
 sys.path.insert(1, './standalone_scheduling')
-from standalone_scheduling.solve import *
-from standalone_scheduling.cosmos import *
-from standalone_scheduling.utilities import *
-from standalone_scheduling import utilities
+# the solver modules (pysat, numpy) are imported by the requests that encode or solve, not at
+# startup: a cold start only pays for the web framework and the Cosmos client
+import cosmos_aio
+import schedule_log_aio
+from jobs import SolveJobs, JobQueueFull
+from roster import rosters, get_roster
+from cache import container_cache
+from constraints import ConstraintIndex, normalised_constraint, max_priority
+import metrics
 
 app = FastAPI()
 app.include_router(wellknown)
 app.add_middleware(CORSMiddleware, allow_origins=["https://chat.openai.com"])
 
+@app.middleware("http")
+async def time_request(request: Request, call_next):
+    # per-phase timings in the Server-Timing header, the Cosmos round trips and solver calls of the
+    # request in X- headers, and a profile of the request with ?profile=cprofile (see metrics.profiling)
+    profiler = request.headers.get('X-Profile') or request.query_params.get('profile')
+    timings = metrics.start_request(profiler)
+    start = time.perf_counter()
+    with metrics.profiling(profiler) as profile:
+        response = await call_next(request)
+    seconds = time.perf_counter() - start
+    route = request.scope.get('route')
+    path = route.path if route is not None else 'unmatched' # job ids would make one series per job
+    metrics.registry.observe('request_seconds', seconds, method=request.method, path=path)
+    metrics.registry.inc('requests_total', method=request.method, path=path, status=response.status_code)
+    timings['spans']['total'] = seconds
+    response.headers['Server-Timing'] = metrics.server_timing(timings)
+    for name, header in [('cosmos_requests', 'X-Cosmos-Requests'), ('cosmos_request_charge', 'X-Cosmos-Request-Charge'),
+                         ('solver_calls', 'X-Solver-Calls'), ('models', 'X-Solver-Models')]:
+        if name in timings['counters']:
+            response.headers[header] = '{0:g}'.format(timings['counters'][name])
+    if profile['path'] or timings.get('profile'):
+        response.headers['X-Profile'] = ', '.join(path for path in [profile['path'], timings.get('profile')] if path)
+    return response
+
 
 # Define the data model
 class Availability(BaseModel):
@@ -34,15 +64,37 @@ class Availability(BaseModel):
 
 
 
-# Initialize Cosmos Client
+# The Cosmos clients are created on first use (see cosmos.get_client and cosmos_aio.get_client),
+# the async one at startup, so that importing the app is not slowed down by a network round trip
+
+# SAT solving holds the GIL, it runs as jobs in worker processes (each one keeps its own
+# warm solver sessions) so that it never blocks the event loop, the pool is started on first use
+solve_jobs = SolveJobs()
+# races several solver configurations on every solve instead of the warm session, see portfolio.py
+solver_portfolio = False
 
-from dotenv import load_dotenv
-load_dotenv()
+def load_settings():
+    # at startup rather than import, like cosmos.settings, the .env file is read once
+    global solver_portfolio
+    from dotenv import load_dotenv
+    load_dotenv()
+    solve_jobs.max_workers = int(os.environ.get("SOLVER_WORKERS", 2))
+    solve_jobs.max_queued = int(os.environ.get("SOLVER_QUEUE_DEPTH", 16))
+    solver_portfolio = os.environ.get("SOLVER_PORTFOLIO", "false").lower() in ['1', 'true', 'yes']
 
-url = os.environ["AZURE_COSMOS_ENDPOINT"]
-key = os.environ["AZURE_COSMOS_API_KEY"]
+@app.on_event("startup")
+async def startup():
+    load_settings()
+    cosmos_aio.get_client()
+    # keeps the container cache consistent with the writes of the other API instances
+    cached_containers = ['schedule', 'negotiable_constraints', 'schedule_diff_to_add', 'schedule_diff_to_remove']
+    cosmos_aio.start_change_feed({roster.database_name for roster in rosters.values()}, cached_containers)
 
-client = CosmosClient(url, credential=key)
+@app.on_event("shutdown")
+async def shutdown():
+    cosmos_aio.stop_change_feed()
+    await cosmos_aio.close_client()
+    solve_jobs.shutdown()
 
 # @app.post("/setEmployeeTimeAvailabilities", summary="Set Employee Time constraints and availabilities", operation_id="setEmployeeTimeAvailabilities")
 # async def set_employee_time_availabilities(body: Availability):
@@ -128,6 +180,7 @@ class Constraint(BaseModel):
     date: str
     time: str
     id: str
+    priority: int = Field(1, ge=1, le=max_priority)
 
 class ScheduleChange(BaseModel):
     # def __init__(self,
@@ -152,46 +205,184 @@ class ScheduleChange(BaseModel):
 
 
 
+constraint_indices = {} # database name -> ConstraintIndex
+
+async def read_constraint_index(database_name):
+    # rebuilt when the container cache is invalidated or expires
+    version = container_cache.version(database_name, 'negotiable_constraints')
+    index = constraint_indices.get(database_name)
+    if index is None or not index.fresh(version):
+        constraints = await cosmos_aio.read('negotiable_constraints', database_name)
+        index = constraint_indices[database_name] = ConstraintIndex(constraints, version, container_cache.ttl)
+    return index
+
+async def prune_constraints(index, horizon, database_name):
+    # past constraints can never be negotiated again, duplicates are left from random ids
+    item_ids = index.prunable_ids(horizon)
+    if item_ids:
+        print('constraints pruned:', await cosmos_aio.delete_many(item_ids, 'negotiable_constraints', database_name))
+
+def ward_roster(ward: str = 'default'):
+    # the roster of the ward query parameter of every endpoint, an unknown ward is not found
+    try:
+        return get_roster(ward)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+async def submit_schedule_changes(roster, strict=False):
+    # reads the Cosmos containers, then queues the solve, the diffs are written when it is done
+    # strict: the staff requests are hard constraints, conflicting ones fail the job with an explanation
+    from solve import (cached_model, solve_model, negotiable_constraints_as_clauses, negotiable_constraints_as_soft_clauses,
+                       model_diff, unmet_constraints)
+    from utilities import schedule_as_model, compute_distance
+    from rolling import worked_shifts
+    from results import fingerprint, result_cache
+    horizon = roster.horizon() # the diffs are dated against the day the request was made
+    with metrics.span('cosmos_read'):
+        view, index = await asyncio.gather(schedule_log_aio.read_schedule(roster.database_name),
+                                           read_constraint_index(roster.database_name))
+    with metrics.span('encode_requests'):
+        old_model = schedule_as_model(view.schedule(), roster, horizon)
+        worked = worked_shifts(view.schedule(), roster, horizon) if roster.rolling else () # frozen by the solver
+        # only the constraints of the horizon are encoded, the past ones are deleted, and unless strict they
+        # are weighted soft clauses so that an unlucky request cannot make the roster unsatisfiable
+        if strict:
+            negotiable_constraints = negotiable_constraints_as_clauses(index.in_horizon(horizon), roster, horizon)
+        else:
+            negotiable_constraints = negotiable_constraints_as_soft_clauses(index.in_horizon(horizon), roster, horizon)
+    with metrics.span('prune_constraints'):
+        await prune_constraints(index, horizon, roster.database_name)
+    # looked up here rather than in the workers, so that a request is answered from the cache whatever
+    # worker solved it first, and /metrics reports the cache that is used
+    key = fingerprint(roster, 'native', old_model, negotiable_constraints, worked)
+    cached = cached_model(key)
+
+    async def write_diffs(new_model):
+        if cached is None:
+            result_cache.put(key, new_model, compute_distance(old_model, new_model))
+        to_add, to_remove = model_diff(old_model, new_model, roster, horizon)
+        with metrics.span('cosmos_write'):
+            await asyncio.gather(cosmos_aio.write_generation(to_add, 'schedule_diff_to_add', roster.database_name),
+                                 cosmos_aio.write_generation(to_remove, 'schedule_diff_to_remove', roster.database_name))
+        return {'to_add': to_add, 'to_remove': to_remove,
+                'unmet': unmet_constraints(negotiable_constraints, new_model, roster, horizon)}
+
+    if cached is not None:
+        return solve_jobs.resolve(cached[0], on_result=write_diffs)
+    try:
+        return solve_jobs.submit(solve_model, old_model, negotiable_constraints, roster, 'native', solver_portfolio, horizon, worked,
+                                 on_result=write_diffs, profiler=(metrics.request_timings.get() or {}).get('profiler'))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
 @app.get("/getScheduleChanges", summary="Propose schedule updates to satisfy constraints", operation_id="getScheduleChanges")
-def write_schedule_diffs(query: str = None):
+async def write_schedule_diffs(query: str = None, roster=Depends(ward_roster), strict: bool = False):
     """
     Constraints are read from the Cosmos DB container 'negotiable_constraints'.
     The schedule is read from the Cosmos DB container 'schedule'.
     A new schedule is proposed by adding and removing items from the schedule.
     The items to add are written to the Cosmos DB container 'schedule_diff_to_add'.
     The items to remove are written to the Cosmos DB container 'schedule_diff_to_remove'.
+    With strict=true, conflicting requests are not weighed against each other: the call fails
+    with 409, the conflicting requests and the smallest set to relax.
     """
 
-    old_schedule = cosmos.read('schedule')
-    old_model = schedule_as_model(old_schedule, n_staff, n_shifts, staff_dict)
-    to_add, to_remove = write_model_diff_to_cosmos(old_model)
+    job = await submit_schedule_changes(roster, strict)
+    job = await solve_jobs.wait(job.id)
+    metrics.add_to_request(job.timings) # the phases of the solve, in the worker process
+    if job.timings and job.timings.get('profile'):
+        metrics.request_timings.get()['profile'] = job.timings['profile']
+    if job.status == 'failed' and job.detail is not None:
+        # conflicting requests, and the smallest set to relax
+        raise HTTPException(status_code=409, detail=job.detail)
+    if job.status == 'failed':
+        raise HTTPException(status_code=500, detail=job.error)
+
+    return job.result['to_add'], job.result['to_remove']
+
+@app.post("/scheduleChangesJobs", summary="Start proposing schedule updates, without waiting for them", operation_id="submitScheduleChanges")
+async def submit_schedule_changes_job(roster=Depends(ward_roster), strict: bool = False):
+    """
+    Same as getScheduleChanges, but returns a job id immediately.
+    Poll /scheduleChangesJobs/{job_id} until its status is 'done' (or 'failed'),
+    the proposed changes are then in its 'result'.
+    """
+    job = await submit_schedule_changes(roster, strict)
+    return job.as_dict()
 
-    return to_add, to_remove
+@app.get("/scheduleChangesJobs/{job_id}", summary="Get the status of a schedule update job", operation_id="getScheduleChangesJob")
+async def get_schedule_changes_job(job_id: str):
+    """
+    Status of a job started by submitScheduleChanges: queued, running, done or failed.
+    'progress' holds the best distance found so far and the number of models explored, with the
+    weight of the staff requests violated ('cost') and its 'lower_bound'. The requests that
+    cannot be granted are listed in 'unmet' of the result.
+    """
+    job = solve_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='unknown job')
+    return job.as_dict()
+
+@app.get("/cacheStats", include_in_schema=False)
+async def cache_stats():
+    return container_cache.stats()
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    # Prometheus text format, the solves of the worker processes are merged when their job completes
+    from results import result_cache
+    metrics.registry.set('solve_jobs_pending', solve_jobs.pending())
+    for cache_name, stats in [('container', container_cache.stats()), ('result', result_cache.stats())]:
+        for name in ['hits', 'misses', 'evictions', 'entries']:
+            metrics.registry.set('cache_' + name, stats.get(name, 0), cache=cache_name)
+    return PlainTextResponse(metrics.registry.render(), media_type='text/plain; version=0.0.4')
+
+@app.get("/scheduleChangesJobs/{job_id}/events", include_in_schema=False)
+async def stream_schedule_changes_job(job_id: str):
+    # one JSON line per status or progress change, until the job is finished
+    if solve_jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail='unknown job')
+    async def lines():
+        async for job in solve_jobs.events(job_id):
+            yield json.dumps(job) + '\n'
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @app.post("/addConstraint", summary="Add a constraint", operation_id="addConstraint")
-def update_constaints(body: Constraint):
+async def update_constaints(body: Constraint, roster=Depends(ward_roster)):
     """
     Add a constraint to the Cosmos DB container 'negotiable_constraints'.
+    Adding the same constraint twice has no effect unless its priority changed, then the priority is updated.
+    Relative dates are resolved when the constraint is added.
     Use the following json for request :
       {
-        "id" : "12321", #random string
+        "id" : "12321", #ignored, the constraint is identified by its staff_name, date and time
         "staff_name": "Bob",
         "calendar_or_relative": "calendrier",
         "date": "2023-11-15",
-        "time": "day"  # day or night
+        "time": "day",  # day or night
+        "priority": 1  # optional, from 1 to 5, higher priorities are granted first when requests conflict
     }
 
     """
-    constraint = {'staff_name': body.staff_name, 'calendar_or_relative': body.calendar_or_relative, 'date': body.date, 'time': body.time, 'id': cosmos.randomword(10)}    
-    cosmos.write(constraint, 'negotiable_constraints')
-    # TODO: check if constraint is already in the container and if so, do not add it again.
-    return "schedule updated"
+    try:
+        constraint = normalised_constraint(body.staff_name, body.calendar_or_relative, body.date, body.time, roster, roster.horizon(),
+                                           body.priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    index = await read_constraint_index(roster.database_name)
+    stored = index.get(constraint['id'])
+    if stored is not None:
+        if int(stored.get('priority', 1)) == constraint['priority']:
+            return "constraint already added"
+        constraint['added'] = stored.get('added', constraint['added']) # a new priority, the request keeps its age
+    await cosmos_aio.write(constraint, 'negotiable_constraints', roster.database_name) # an upsert, the id is the (staff, shift)
+    return "schedule updated" if stored is None else "constraint updated"
 
 # body = Constraint(staff_name='Alice', calendar_or_relative='calendar', date='2021-05-01', time='day')
 # update_constaints(body)
 
 @app.post("/validateChange", summary="Validate a change", operation_id="validateChange")
-def validate_change(body: ScheduleChange):
+async def validate_change(body: ScheduleChange, roster=Depends(ward_roster)):
     """
     Validate a change by updating one of the Cosmos DB containers 'schedule_diff_to_add' or 'schedule_diff_to_remove'.
 
@@ -206,7 +397,7 @@ def validate_change(body: ScheduleChange):
     """
     if body.to_add:
         change = {'id': body.id, 'staff_name': body.staff_name, 'date': body.date, 'time': body.time, 'validated': True}
-        cosmos.write(change, 'schedule_diff_to_add')
+        await cosmos_aio.write(change, 'schedule_diff_to_add', roster.database_name)
         return "Change validated"
     else:
         return "nothing to add."
@@ -215,32 +406,49 @@ def validate_change(body: ScheduleChange):
 # validate_change(body)
 
 @app.get("/getSchedule", summary="Get the schedule", operation_id="getSchedule")
-def get_schedule(query: str = None):
+async def get_schedule(query: str = None, roster=Depends(ward_roster), date_from: str = None, date_to: str = None,
+                       staff_name: list[str] = Query(None), time: str = None,
+                       page_size: int = None, continuation: str = None, stream: bool = False):
     """
     Get the schedule from the Cosmos DB container 'schedule'.
     If all diffs are validated, update the schedule first.
+    Optional filters: date_from and date_to (YYYY-MM-DD, inclusive), staff_name (repeatable) and time (day or night).
+    With page_size, returns {"items": [...], "continuation": "..."}: pass continuation back
+    to get the next page, until it is null.
+    With stream=true, returns one JSON item per line (application/x-ndjson).
     """
-    to_add = cosmos.read('schedule_diff_to_add')
-    to_remove = cosmos.read('schedule_diff_to_remove')
-    old_schedule = cosmos.read('schedule')
-
-    if len(to_add) == 0 and len(to_remove) == 0:
-        return old_schedule
-    
-    else:
-        model = schedule_as_model(old_schedule, n_staff, n_shifts, staff_dict)
-        for change_to_add in to_add:
-            if not change_to_add.validated:
-                raise Exception('not all changes are validated')
-            else:
-                binary_variable_index = compute_binary_variable_index(change_to_add.staff_name, change_to_add.date, change_to_add.time)
-                model[binary_variable_index-1] = binary_variable_index
-        for change_to_remove in to_remove:
-            if not change_to_remove.validated:
+    horizon = roster.horizon()
+    to_add, to_remove = await asyncio.gather(cosmos_aio.read('schedule_diff_to_add', roster.database_name),
+                                             cosmos_aio.read('schedule_diff_to_remove', roster.database_name))
+
+    if len(to_add) > 0 or len(to_remove) > 0:
+        from utilities import compute_binary_variable_index
+        for change in to_add + to_remove:
+            if not change["validated"]:
                 raise Exception('not all changes are validated')
-            else:
-                binary_variable_index = compute_binary_variable_index(change_to_remove.staff_name, change_to_remove.date, change_to_remove.time)
-                model[binary_variable_index-1] = -binary_variable_index
-
-        new_schedule = model_as_schedule(model, n_staff, staff_inverted_dict)
-        return new_schedule
+            compute_binary_variable_index(change["staff_name"], change["date"], change["time"], roster, horizon) # unknown staff or shift
+        # the changes are appended to the schedule log, then consumed
+        await schedule_log_aio.append_changes(to_add, to_remove, roster.database_name)
+        await asyncio.gather(cosmos_aio.write_generation([], 'schedule_diff_to_add', roster.database_name),
+                             cosmos_aio.write_generation([], 'schedule_diff_to_remove', roster.database_name))
+
+    # the filters are pushed down into the Cosmos query, pages are read one at a time
+    filters = {'date_from': date_from, 'date_to': date_to, 'staff_names': staff_name, 'time': time}
+    if stream:
+        async def lines():
+            async for items, _ in schedule_log_aio.schedule_pages(roster.database_name, filters, page_size or schedule_log_aio.page_size):
+                for item in items:
+                    yield json.dumps(item) + '\n'
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+    if page_size is not None or continuation is not None:
+        pages = schedule_log_aio.schedule_pages(roster.database_name, filters, page_size or schedule_log_aio.page_size, continuation)
+        try:
+            items, continuation = await anext(pages)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            await pages.aclose()
+        return {'items': items, 'continuation': continuation}
+
+    view = await schedule_log_aio.read_schedule(roster.database_name)
+    return [item for item in view.schedule() if schedule_log_aio.matches(item, **filters)]
@@ -1,11 +1,25 @@
 import yaml
 import json
+import copy
+import hashlib
+import os
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
 from string import Template
 from fastapi import APIRouter, Request
 from fastapi.responses import FileResponse, Response
 
 wellknown = APIRouter(prefix="/.well-known", tags=["well-known"])
 
+ai_plugin_path = ".well-known/ai-plugin.json"
+# libyaml's emitter when PyYAML was built with it, the output is the same
+Dumper = getattr(yaml, "CDumper", yaml.Dumper)
+started = time.time() # the routes, hence the OpenAPI schema, do not change after startup
+max_documents = 64 # hosts come from request headers, bound what they can make us keep
+documents = {} # (path, host) -> (content, etag, last modified), oldest first
+documents_lock = threading.Lock()
+
 
 def get_host(request: Request):
     host_header = request.headers.get("X-Forwarded-Host") or request.headers.get("Host")
@@ -14,21 +28,67 @@ def get_host(request: Request):
 
 
 def get_ai_plugin():
-    with open(".well-known/ai-plugin.json", encoding="utf-8") as file:
+    with open(ai_plugin_path, encoding="utf-8") as file:
         return json.loads(file.read())
 
 
-@wellknown.get("/openapi.yaml", include_in_schema=False)
-async def openapi_yaml(request: Request):
-    openapi = request.app.openapi()
-    openapi["servers"] = [{"url": get_host(request)}]
+def render_openapi_yaml(request: Request, host):
+    openapi = copy.deepcopy(request.app.openapi()) # the app keeps that schema for /openapi.json
+    openapi["servers"] = [{"url": host}]
     ai_plugin = get_ai_plugin()
     openapi["info"]["title"] = ai_plugin["name_for_human"]
     openapi["info"]["description"] = ai_plugin["description_for_human"]
-    return Response(
-        content=yaml.dump(openapi),
-        media_type="text/vnd.yaml",
-    )
+    return yaml.dump(openapi, Dumper=Dumper)
+
+
+def render_manifest(request: Request, host):
+    return Template(json.dumps(get_ai_plugin())).substitute(host=host)
+
+
+def get_document(request: Request, render):
+    # rendered once per host and again only when ai-plugin.json changes
+    host = get_host(request)
+    modified = max(os.path.getmtime(ai_plugin_path), started)
+    key = (request.url.path, host)
+    with documents_lock:
+        document = documents.get(key)
+    if document is None or document[2] != modified:
+        content = render(request, host).encode("utf-8")
+        document = (content, '"{0}"'.format(hashlib.sha1(content).hexdigest()), modified)
+        with documents_lock:
+            documents.pop(key, None)
+            documents[key] = document
+            while len(documents) > max_documents:
+                del documents[next(iter(documents))]
+    return document
+
+
+def not_modified(request: Request, etag, modified):
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None: # takes precedence over If-Modified-Since
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since is not None:
+        try:
+            return int(modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cached_response(request: Request, render, media_type):
+    content, etag, modified = get_document(request, render)
+    headers = {"ETag": etag, "Last-Modified": formatdate(modified, usegmt=True),
+               "Vary": "Host, X-Forwarded-Host, X-Forwarded-Proto"}
+    if not_modified(request, etag, modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+@wellknown.get("/openapi.yaml", include_in_schema=False)
+async def openapi_yaml(request: Request):
+    return cached_response(request, render_openapi_yaml, "text/vnd.yaml")
 
 
 @wellknown.get("/logo.png", include_in_schema=False)
@@ -38,8 +98,4 @@ async def logo():
 
 @wellknown.get("/ai-plugin.json", include_in_schema=False)
 async def manifest(request: Request):
-    ai_plugin = get_ai_plugin()
-    return Response(
-        content=Template(json.dumps(ai_plugin)).substitute(host=get_host(request)),
-        media_type="application/json",
-    )
+    return cached_response(request, render_manifest, "application/json")
@@ -0,0 +1,70 @@
+# module imports
+from collections import OrderedDict
+import os
+import threading
+import time
+
+
+class ContainerCache():
+    """
+    Read-through cache of whole Cosmos containers, keyed by (database_name, container_name).
+    Entries expire after ttl seconds and the least recently used one is evicted beyond
+    max_entries. Writers call invalidate, and so does the change feed watcher of
+    cosmos_aio for the writes made by other processes.
+    """
+
+    def __init__(self, ttl=30.0, max_entries=64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key -> (expiry, items)
+        self.versions = {} # key -> number of invalidations, to drop reads that raced a write
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, database_name, container_name):
+        key = (database_name, container_name)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.counters['misses'] += 1
+                return None
+            self.counters['hits'] += 1
+            self.entries.move_to_end(key)
+            return list(entry[1])
+
+    def version(self, database_name, container_name):
+        # to be read before querying Cosmos and passed back to put
+        with self.lock:
+            return self.versions.get((database_name, container_name), 0)
+
+    def put(self, database_name, container_name, items, version):
+        key = (database_name, container_name)
+        with self.lock:
+            if self.versions.get(key, 0) != version:
+                return # invalidated while the items were read
+            self.entries[key] = (time.monotonic() + self.ttl, list(items))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def invalidate(self, database_name, container_name):
+        key = (database_name, container_name)
+        with self.lock:
+            self.versions[key] = self.versions.get(key, 0) + 1
+            if self.entries.pop(key, None) is not None:
+                self.counters['invalidations'] += 1
+
+    def clear(self):
+        with self.lock:
+            for key in self.entries:
+                self.versions[key] = self.versions.get(key, 0) + 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), ttl=self.ttl, max_entries=self.max_entries)
+
+
+container_cache = ContainerCache(ttl=float(os.environ.get("COSMOS_CACHE_TTL", 30)),
+                                 max_entries=int(os.environ.get("COSMOS_CACHE_MAX_ENTRIES", 64)))
@@ -0,0 +1,77 @@
+# module imports
+from pysat.card import EncType
+
+# 'native' keeps the cardinality constraints as is_atmost constraints, which only minicard supports.
+# The other encodings produce plain clauses that any CDCL solver accepts:
+# - 'seqcounter' and 'totalizer' encode every sliding window position separately,
+# - 'shared' encodes the sliding windows of a staff member with counters shared by
+#   all the overlapping windows (see sliding_window_atmost).
+encodings = ['native', 'seqcounter', 'totalizer', 'shared']
+
+card_encoding_types = {'seqcounter' : EncType.seqcounter,
+                       'totalizer' : EncType.totalizer,
+                       'shared' : EncType.totalizer} # for the service constraints, which do not overlap
+
+default_solvers = {'native' : 'minicard',
+                   'seqcounter' : 'cadical153',
+                   'totalizer' : 'cadical153',
+                   'shared' : 'cadical153'}
+
+
+def unary_counter(literals, max_count, vpool, clauses):
+    # counts[j][c-1] is true if at least c of literals[:j+1] are true, for c <= max_count.
+    # Only the "count >= c implies counts[j][c-1]" direction is encoded, which is all an
+    # at most constraint needs.
+    counts = []
+    for j, literal in enumerate(literals):
+        previous = counts[-1] if counts else []
+        current = [vpool.id() for c in range(min(j+1, max_count))]
+        for c, count in enumerate(current, start=1):
+            if c <= len(previous):
+                clauses.append([-previous[c-1], count])
+            if c == 1:
+                clauses.append([-literal, count])
+            else:
+                clauses.append([-literal, -previous[c-2], count])
+        counts.append(current)
+    return counts
+
+def sliding_window_atmost(literals, sliding_window_size, bound, vpool):
+    # At most bound true literals in every sliding_window_size consecutive literals.
+    # The literals are cut in blocks of sliding_window_size: every window is a suffix of
+    # one block followed by a prefix of the next one. Prefix and suffix counters are built
+    # once per block and shared by all the windows that cross it, so the encoding has
+    # O(len(literals) * bound) clauses instead of O(len(literals) * sliding_window_size * bound).
+    clauses = []
+    n = len(literals)
+    if sliding_window_size <= bound or n < sliding_window_size:
+        return clauses
+    max_count = bound + 1
+    blocks = [literals[first:first + sliding_window_size] for first in range(0, n, sliding_window_size)]
+    prefix_counts = [unary_counter(block, max_count, vpool, clauses) for block in blocks[1:]]
+    for b, block in enumerate(blocks):
+        if b * sliding_window_size + sliding_window_size > n:
+            break
+        suffix_counts = unary_counter(block[::-1], max_count, vpool, clauses)
+        for j in range(sliding_window_size):
+            if b * sliding_window_size + j + sliding_window_size > n:
+                break
+            suffix = suffix_counts[sliding_window_size-j-1] # counts of block[j:]
+            prefix = prefix_counts[b][j-1] if j > 0 else [] # counts of blocks[b+1][:j]
+            # forbid a true literals in the suffix together with max_count-a in the prefix
+            for a in range(max_count + 1):
+                c = max_count - a
+                if a <= len(suffix) and c <= len(prefix):
+                    clause = []
+                    if a > 0:
+                        clause.append(-suffix[a-1])
+                    if c > 0:
+                        clause.append(-prefix[c-1])
+                    clauses.append(clause)
+    return clauses
+
+def formula_size(formula):
+    return {'variables': formula.nv,
+            'clauses': len(formula.clauses),
+            'atmosts': len(getattr(formula, 'atmosts', [])),
+            'literals': sum(len(clause) for clause in formula.clauses) + sum(len(atmost[0]) for atmost in getattr(formula, 'atmosts', []))}
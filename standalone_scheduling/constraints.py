@@ -0,0 +1,120 @@
+# module imports
+from collections import defaultdict
+from datetime import date as calendar_date
+import time as clock
+
+
+relative_dates = {'demain' : 1, 'tomorrow' : 1, 'après-demain' : 2, 'day after tomorrow' : 2, 'la semaine prochaine' : 7, 'next week' : 7, 'le mois prochain' : 30, 'next month' : 30}
+calendar_kinds = ['calendar', 'calendrier']
+relative_kinds = ['relative', 'relatif']
+times = {'day' : 'day', 'jour' : 'day', 'night' : 'night', 'nuit' : 'night'}
+
+# weight of a staff request when negotiable constraints are soft, see constraint_weight
+priority_weight = 10 # per priority level, 1 by default
+max_priority = 5
+seniority_weight = 1 # per year of seniority, up to max_seniority
+max_seniority = 10
+age_weight = 1 # per week since the request was added, up to max_age
+max_age = 8
+
+def constraint_id(staff_name, date, time):
+    # one constraint per staff member and shift, so adding it twice upserts the same item
+    return '{0}_{1}_{2}'.format(date, times.get(time, time), staff_name)
+
+def constraint_weight(constraint, roster, today):
+    # higher priority, more senior staff and older requests are granted first
+    priority = min(max(int(constraint.get('priority', 1)), 1), max_priority) # items stored before the cap
+    seniority = min(roster.seniority.get(constraint['staff_name'], 0), max_seniority)
+    added = constraint.get('added')
+    age = min((today - calendar_date.fromisoformat(added)).days // 7, max_age) if added else 0
+    return priority * priority_weight + int(seniority * seniority_weight) + max(age, 0) * age_weight
+
+def normalised_constraint(staff_name, calendar_or_relative, date, time, roster, horizon, priority=1):
+    # relative dates are resolved against the day the constraint is added, so that
+    # 'tomorrow' keeps meaning the same shift afterwards
+    if staff_name not in roster.staff_dict:
+        raise ValueError('unknown staff member \'{0}\''.format(staff_name))
+    if time not in times:
+        raise ValueError('time should be either day or night')
+    if calendar_or_relative in relative_kinds:
+        if date not in relative_dates:
+            raise ValueError('unknown relative date \'{0}\''.format(date))
+        date = horizon.date_and_time(relative_dates[date] * 2)[0]
+    elif calendar_or_relative in calendar_kinds:
+        date = horizon.date_and_time(horizon.day_index(date) * 2)[0] # also checks the format
+    else:
+        raise ValueError('calendar_or_relative should be either calendar or relative')
+    if not 1 <= priority <= max_priority:
+        raise ValueError('priority should be between 1 and {0}'.format(max_priority))
+    return {'id': constraint_id(staff_name, date, time), 'staff_name': staff_name,
+            'calendar_or_relative': 'calendar', 'date': date, 'time': times[time],
+            'priority': priority, 'added': str(horizon.start)}
+
+
+class ConstraintIndex():
+    """
+    Negotiable constraints of a database indexed by staff member and by date, each
+    (staff, shift) once whatever the number of items stored for it. Constraints
+    stored with a relative date, before ids were deterministic, are kept aside and
+    resolved on every solve.
+    """
+
+    def __init__(self, constraints=(), version=None, ttl=None):
+        self.version = version # of the container cache when the constraints were read
+        self.expiry = clock.monotonic() + ttl if ttl is not None else None
+        self.constraints = {} # constraint_id -> constraint
+        self.by_staff = defaultdict(dict) # staff_name -> {constraint_id: constraint}
+        self.by_date = defaultdict(dict) # date -> {constraint_id: constraint}
+        self.relative = []
+        self.stored_ids = defaultdict(list) # constraint_id -> ids of the items stored for it
+        for constraint in constraints:
+            self.add(constraint)
+
+    def add(self, constraint):
+        if constraint['calendar_or_relative'] in relative_kinds:
+            self.relative.append(constraint)
+            return
+        key = constraint_id(constraint['staff_name'], constraint['date'], constraint['time'])
+        self.stored_ids[key].append(constraint['id'])
+        if key in self.constraints and constraint['id'] != key:
+            return # the item stored under the deterministic id is the one updated, see prunable_ids
+        self.constraints[key] = constraint
+        self.by_staff[constraint['staff_name']][key] = constraint
+        self.by_date[constraint['date']][key] = constraint
+
+    def __contains__(self, key):
+        return key in self.constraints
+
+    def get(self, key):
+        return self.constraints.get(key)
+
+    def __len__(self):
+        return len(self.constraints) + len(self.relative)
+
+    def fresh(self, version):
+        return self.version == version and (self.expiry is None or clock.monotonic() < self.expiry)
+
+    def for_staff(self, staff_name):
+        return list(self.by_staff.get(staff_name, {}).values())
+
+    def on_date(self, date):
+        return list(self.by_date.get(date, {}).values())
+
+    def in_horizon(self, horizon):
+        # only the days of the horizon are looked up, whatever the number of constraints stored
+        constraints = list(self.relative)
+        for date in horizon.dates:
+            constraints.extend(self.on_date(date))
+        return constraints
+
+    def prunable_ids(self, horizon):
+        # items of past shifts, and the duplicates of a (staff, shift) stored under random ids
+        start = str(horizon.start)
+        ids = []
+        for key, stored_ids in self.stored_ids.items():
+            if self.constraints[key]['date'] < start:
+                ids.extend(stored_ids)
+            else:
+                kept = key if key in stored_ids else stored_ids[0]
+                ids.extend(stored_id for stored_id in stored_ids if stored_id != kept)
+        return ids
@@ -1,28 +1,75 @@
 from azure.cosmos import CosmosClient, PartitionKey, exceptions
-from dotenv import load_dotenv
+from azure.core import MatchConditions
+from concurrent.futures import ThreadPoolExecutor
 import os
 import json
 import random, string
-
-load_dotenv()
-
-url = os.environ["AZURE_COSMOS_ENDPOINT"]
-key = os.environ["AZURE_COSMOS_API_KEY"]
-
-client = CosmosClient(url, credential=key)
+import threading
+import time
+
+# local imports
+from cache import container_cache
+from metrics import cosmos_response_hook
+
+client = None
+client_lock = threading.Lock()
+
+def settings():
+    # read on first use, so importing the app needs neither the .env file nor the credentials
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.environ["AZURE_COSMOS_ENDPOINT"], os.environ["AZURE_COSMOS_API_KEY"]
+
+def get_client():
+    # the sync client reads the database account when it is created, a round trip that
+    # used to be paid by every process importing this module
+    global client
+    with client_lock:
+        if client is None:
+            url, key = settings()
+            client = CosmosClient(url, credential=key, raw_response_hook=cosmos_response_hook) # counts round trips and RUs
+    return client
+
+bulk_max_workers = 16 # concurrent upserts in write_many
+
+# Containers written as a whole are versioned: every write_generation stores its items under
+# a new generation id, then moves the pointer of the container (one document of the
+# 'generations' container) to it. Readers follow the pointer, so they never see a missing
+# container or a half-written generation, and old generations are deleted in the background.
+# Generation ids start with time_ns, of fixed width, so they sort by time as strings: the
+# pointer only moves to newer generations, and the cleanup only deletes the generations older
+# than the ones the pointer keeps, never one that a concurrent writer has yet to publish.
+versioned_containers = ['schedule', 'schedule_diff_to_add', 'schedule_diff_to_remove']
+generations_container = 'generations'
+kept_generations = 2 # the previous generation is kept for the readers that already hold its id
+generation_query = "SELECT * FROM c WHERE c.generation = @generation"
+old_generations_query = "SELECT c.id FROM c WHERE NOT IS_DEFINED(c.generation) OR c.generation < @oldest"
+generations_databases = set() # databases where the generations container is known to exist
 
 def randomword(length):
    letters = string.ascii_lowercase
    return ''.join(random.choice(letters) for i in range(length))
 
-def read(container_name):
-
-    database_name = 'healthplanner'
-    container = client.get_database_client(database_name).get_container_client(container_name)
-    items = list(container.query_items(
-        query="SELECT * FROM c",
-        enable_cross_partition_query=True
-    ))
+def read(container_name, database_name='healthplanner'):
+
+    items = container_cache.get(database_name, container_name)
+    if items is not None:
+        return items
+    version = container_cache.version(database_name, container_name)
+    container = get_client().get_database_client(database_name).get_container_client(container_name)
+    generation = current_generation(container_name, database_name) if container_name in versioned_containers else None
+    if generation is None:
+        items = list(container.query_items(
+            query="SELECT * FROM c",
+            enable_cross_partition_query=True
+        ))
+    else:
+        items = [unversioned(item) for item in container.query_items(
+            query=generation_query,
+            parameters=[{'name': '@generation', 'value': generation}],
+            enable_cross_partition_query=True
+        )]
+    container_cache.put(database_name, container_name, items, version)
     
     return items
 
@@ -30,13 +77,122 @@ def read(container_name):
 # for constraint in constraints:
     # print(constraint["staff_name"])
 
-def write(json_object, container_name):
+def write(json_object, container_name, database_name='healthplanner'):
 
-    database_name = 'healthplanner'
-    container = client.get_database_client(database_name).get_container_client(container_name)
+    container = get_client().get_database_client(database_name).get_container_client(container_name)
+    generation = current_generation(container_name, database_name) if container_name in versioned_containers else None
+    if generation is not None:
+        json_object = versioned(json_object, generation)
     container.upsert_item(json_object)
+    container_cache.invalidate(database_name, container_name)
     # print("Wrote to Cosmos DB")
 
+def write_many(json_objects, container_name, database_name='healthplanner', max_workers=None):
+    # Every container is partitioned on /id, so each item is alone in its partition and
+    # transactional batches do not apply: items are upserted concurrently instead, with at
+    # most max_workers requests in flight.
+    container = get_client().get_database_client(database_name).get_container_client(container_name)
+    request_charge = [0.0]
+    lock = threading.Lock()
+
+    def add_request_charge(headers, item):
+        with lock:
+            request_charge[0] += float(headers.get('x-ms-request-charge', 0))
+
+    def upsert(json_object):
+        container.upsert_item(json_object, response_hook=add_request_charge)
+
+    json_objects = list(json_objects)
+    start = time.perf_counter()
+    if json_objects:
+        with ThreadPoolExecutor(max_workers=min(max_workers or bulk_max_workers, len(json_objects))) as executor:
+            list(executor.map(upsert, json_objects)) # re-raises the first failed upsert
+        container_cache.invalidate(database_name, container_name)
+    seconds = time.perf_counter() - start
+    return {'items': len(json_objects),
+            'seconds': seconds,
+            'items_per_second': len(json_objects) / seconds if seconds > 0 else 0.0,
+            'request_charge': request_charge[0]}
+
+def versioned(json_object, generation):
+    # item ids are only unique within a generation, the stored id is prefixed with it
+    return dict(json_object, id='{0}.{1}'.format(generation, json_object['id']), generation=generation)
+
+def unversioned(item):
+    item = dict(item, id=item['id'].split('.', 1)[-1])
+    del item['generation']
+    return item
+
+def new_generation():
+    return '{0}-{1}'.format(time.time_ns(), randomword(4))
+
+def get_generations_container(database_name):
+    database = get_client().get_database_client(database_name)
+    if database_name not in generations_databases:
+        database.create_container_if_not_exists(id=generations_container, partition_key=PartitionKey(path='/id', kind='Hash'))
+        generations_databases.add(database_name)
+    return database.get_container_client(generations_container)
+
+def current_generation(container_name, database_name='healthplanner'):
+    try:
+        pointer = get_generations_container(database_name).read_item(item=container_name, partition_key=container_name)
+    except exceptions.CosmosResourceNotFoundError:
+        return None # not versioned yet
+    return pointer['generation']
+
+def next_pointer(pointer, container_name, generation):
+    # pointer moved to generation, None if a newer generation replaced the container while
+    # this one was written, it is then never published and a later cleanup deletes it
+    previous = pointer['generations'] if pointer is not None else []
+    if previous and previous[0] > generation:
+        return None
+    return {'id': container_name, 'generation': generation, 'generations': ([generation] + previous)[:kept_generations]}
+
+def publish_generation(container_name, generation, database_name='healthplanner'):
+    # the pointer is replaced on the condition that its etag did not change since it was read,
+    # so that concurrent writers never lose each other's generations, and read again on 412
+    generations = get_generations_container(database_name)
+    while True:
+        try:
+            pointer = generations.read_item(item=container_name, partition_key=container_name)
+        except exceptions.CosmosResourceNotFoundError:
+            pointer = None
+        body = next_pointer(pointer, container_name, generation)
+        if body is None:
+            return pointer['generations']
+        try:
+            if pointer is None:
+                generations.create_item(body)
+            else:
+                generations.replace_item(item=container_name, body=body, etag=pointer['_etag'],
+                                         match_condition=MatchConditions.IfNotModified)
+            return body['generations'] # atomic switch
+        except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceExistsError):
+            continue # moved by another writer in between
+
+def write_generation(json_objects, container_name, database_name='healthplanner'):
+    # replaces the whole content of a versioned container without deleting it
+    generation = new_generation()
+    stats = write_many([versioned(json_object, generation) for json_object in json_objects], container_name, database_name)
+    kept = publish_generation(container_name, generation, database_name)
+    container_cache.invalidate(database_name, container_name)
+    threading.Thread(target=delete_old_generations, args=(container_name, database_name, min(kept)), daemon=True).start()
+    return dict(stats, generation=generation, published=generation in kept)
+
+def delete_old_generations(container_name, database_name, oldest):
+    # also deletes the items written before the container was versioned
+    container = get_client().get_database_client(database_name).get_container_client(container_name)
+    old_ids = container.query_items(
+        query=old_generations_query,
+        parameters=[{'name': '@oldest', 'value': oldest}],
+        enable_cross_partition_query=True
+    )
+    for item in old_ids:
+        try:
+            container.delete_item(item=item['id'], partition_key=item['id'])
+        except exceptions.CosmosResourceNotFoundError:
+            pass # deleted by a concurrent cleanup
+
 # with open('data/negotiable_constraints.json') as f:
 #     constraints = json.load(f)
 # for constraint in constraints:
@@ -46,7 +202,7 @@ def write(json_object, container_name):
 
 def create_container(database_name, container_name):
 
-    database = client.get_database_client(database_name)
+    database = get_client().get_database_client(database_name)
     partition_key = PartitionKey(path='/id', kind='Hash')
 
     try:
@@ -60,7 +216,7 @@ def create_container(database_name, container_name):
 
 def delete_container(database_name, container_name):
 
-    database = client.get_database_client(database_name)
+    database = get_client().get_database_client(database_name)
     try:
         database.delete_container(container_name)
         # print('Container \'{0}\' was deleted.'.format(container_name))
@@ -71,6 +227,7 @@ def delete_container(database_name, container_name):
 # delete_container('healthplanner', 'schedule_diff_to_add')
 
 def empty_container(database_name, container_name):
+    # slow and racy with concurrent readers, versioned containers use write_generation instead
 
     delete_container(database_name, container_name)
     create_container(database_name, container_name)
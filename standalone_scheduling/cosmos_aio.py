@@ -0,0 +1,205 @@
+# Async counterpart of cosmos.py for the API: one azure.cosmos.aio client is created on
+# first use and reused by every request, so connections are pooled instead of reopened.
+from azure.cosmos.aio import CosmosClient
+from azure.cosmos import PartitionKey, exceptions
+from azure.core import MatchConditions
+import asyncio
+import time
+
+# local imports
+from cosmos import settings, bulk_max_workers, versioned_containers, generations_container, kept_generations
+from cosmos import generation_query, old_generations_query, versioned, unversioned, new_generation, next_pointer
+from cache import container_cache
+from metrics import cosmos_response_hook
+
+client = None
+generations_databases = set() # databases where the generations container is known to exist
+cleanup_tasks = set() # keeps a reference to the running background cleanups
+change_feed_tasks = [] # one watcher per database
+
+def get_client():
+    global client
+    if client is None:
+        url, key = settings()
+        client = CosmosClient(url, credential=key, raw_response_hook=cosmos_response_hook)
+    return client
+
+async def close_client():
+    global client
+    if client is not None:
+        await client.close()
+        client = None
+
+def get_container(container_name, database_name):
+    return get_client().get_database_client(database_name).get_container_client(container_name)
+
+async def read(container_name, database_name='healthplanner'):
+
+    items = container_cache.get(database_name, container_name)
+    if items is not None:
+        return items
+    version = container_cache.version(database_name, container_name)
+    container = get_container(container_name, database_name)
+    generation = await current_generation(container_name, database_name) if container_name in versioned_containers else None
+    if generation is None:
+        items = [item async for item in container.query_items(query="SELECT * FROM c")]
+    else:
+        items = [unversioned(item) async for item in container.query_items(
+            query=generation_query,
+            parameters=[{'name': '@generation', 'value': generation}]
+        )]
+    container_cache.put(database_name, container_name, items, version)
+
+    return items
+
+async def write(json_object, container_name, database_name='healthplanner'):
+
+    container = get_container(container_name, database_name)
+    generation = await current_generation(container_name, database_name) if container_name in versioned_containers else None
+    if generation is not None:
+        json_object = versioned(json_object, generation)
+    await container.upsert_item(json_object)
+    container_cache.invalidate(database_name, container_name)
+
+async def write_many(json_objects, container_name, database_name='healthplanner', max_workers=None):
+    # same as cosmos.write_many, with a semaphore bounding the upserts in flight
+    container = get_container(container_name, database_name)
+    semaphore = asyncio.Semaphore(max_workers or bulk_max_workers)
+    request_charge = [0.0]
+
+    def add_request_charge(headers, item):
+        request_charge[0] += float(headers.get('x-ms-request-charge', 0))
+
+    async def upsert(json_object):
+        async with semaphore:
+            await container.upsert_item(json_object, response_hook=add_request_charge)
+
+    json_objects = list(json_objects)
+    start = time.perf_counter()
+    await asyncio.gather(*[upsert(json_object) for json_object in json_objects])
+    if json_objects:
+        container_cache.invalidate(database_name, container_name)
+    seconds = time.perf_counter() - start
+    return {'items': len(json_objects),
+            'seconds': seconds,
+            'items_per_second': len(json_objects) / seconds if seconds > 0 else 0.0,
+            'request_charge': request_charge[0]}
+
+async def delete_many(item_ids, container_name, database_name='healthplanner', max_workers=None):
+    container = get_container(container_name, database_name)
+    semaphore = asyncio.Semaphore(max_workers or bulk_max_workers)
+
+    async def delete(item_id):
+        async with semaphore:
+            try:
+                await container.delete_item(item=item_id, partition_key=item_id)
+            except exceptions.CosmosResourceNotFoundError:
+                pass # already deleted
+
+    item_ids = list(item_ids)
+    await asyncio.gather(*[delete(item_id) for item_id in item_ids])
+    if item_ids:
+        container_cache.invalidate(database_name, container_name)
+    return len(item_ids)
+
+async def get_generations_container(database_name):
+    database = get_client().get_database_client(database_name)
+    if database_name not in generations_databases:
+        await database.create_container_if_not_exists(id=generations_container, partition_key=PartitionKey(path='/id', kind='Hash'))
+        generations_databases.add(database_name)
+    return database.get_container_client(generations_container)
+
+async def current_generation(container_name, database_name='healthplanner'):
+    generations = await get_generations_container(database_name)
+    try:
+        pointer = await generations.read_item(item=container_name, partition_key=container_name)
+    except exceptions.CosmosResourceNotFoundError:
+        return None # not versioned yet
+    return pointer['generation']
+
+async def publish_generation(container_name, generation, database_name='healthplanner'):
+    # see cosmos.publish_generation
+    generations = await get_generations_container(database_name)
+    while True:
+        try:
+            pointer = await generations.read_item(item=container_name, partition_key=container_name)
+        except exceptions.CosmosResourceNotFoundError:
+            pointer = None
+        body = next_pointer(pointer, container_name, generation)
+        if body is None:
+            return pointer['generations']
+        try:
+            if pointer is None:
+                await generations.create_item(body)
+            else:
+                await generations.replace_item(item=container_name, body=body, etag=pointer['_etag'],
+                                               match_condition=MatchConditions.IfNotModified)
+            return body['generations'] # atomic switch
+        except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceExistsError):
+            continue # moved by another writer in between
+
+async def write_generation(json_objects, container_name, database_name='healthplanner'):
+    # see cosmos.write_generation
+    generation = new_generation()
+    stats = await write_many([versioned(json_object, generation) for json_object in json_objects], container_name, database_name)
+    kept = await publish_generation(container_name, generation, database_name)
+    container_cache.invalidate(database_name, container_name)
+    task = asyncio.create_task(delete_old_generations(container_name, database_name, min(kept)))
+    cleanup_tasks.add(task)
+    task.add_done_callback(cleanup_tasks.discard)
+    return dict(stats, generation=generation, published=generation in kept)
+
+async def delete_old_generations(container_name, database_name, oldest):
+    container = get_container(container_name, database_name)
+    old_ids = [item async for item in container.query_items(
+        query=old_generations_query,
+        parameters=[{'name': '@oldest', 'value': oldest}]
+    )]
+    for item in old_ids:
+        try:
+            await container.delete_item(item=item['id'], partition_key=item['id'])
+        except exceptions.CosmosResourceNotFoundError:
+            pass # deleted by a concurrent cleanup
+
+async def watch_change_feed(database_name, container_names, interval=5.0):
+    # invalidates the cache for the writes made by other processes: a container is
+    # invalidated when its change feed has new items, a versioned container also when its
+    # pointer in the generations container moves
+    continuations = {}
+    watched = list(container_names) + [generations_container]
+    while True:
+        for container_name in watched:
+            container = get_container(container_name, database_name)
+            # the continuation is the etag of the change feed response itself: the last response
+            # headers of the client belong to whatever request of the app completed last
+            headers = {}
+            def keep_headers(response_headers, items):
+                headers.update(response_headers)
+            try:
+                if container_name in continuations:
+                    changes = container.query_items_change_feed(continuation=continuations[container_name], response_hook=keep_headers)
+                else:
+                    changes = container.query_items_change_feed(start_time="Now", response_hook=keep_headers)
+                changed = [item async for item in changes]
+                if headers.get('etag'):
+                    continuations[container_name] = headers['etag']
+            except exceptions.CosmosHttpResponseError:
+                continue # e.g. container not created yet, retried at the next poll
+            if not changed:
+                continue
+            if container_name == generations_container:
+                for pointer in changed:
+                    container_cache.invalidate(database_name, pointer['id'])
+            else:
+                container_cache.invalidate(database_name, container_name)
+        await asyncio.sleep(interval)
+
+def start_change_feed(database_names, container_names, interval=5.0):
+    if not change_feed_tasks:
+        for database_name in database_names:
+            change_feed_tasks.append(asyncio.create_task(watch_change_feed(database_name, container_names, interval)))
+
+def stop_change_feed():
+    for task in change_feed_tasks:
+        task.cancel()
+    change_feed_tasks.clear()
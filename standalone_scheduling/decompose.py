@@ -0,0 +1,94 @@
+# module imports
+from pysat.formula import CNFPlus
+import numpy as np
+import time
+
+
+def find(parent, v):
+    while parent[v] != v:
+        parent[v] = parent[parent[v]]
+        v = parent[v]
+    return v
+
+def split(formula, n_variables, fixed=()):
+    """
+    Splits formula into the connected components of its constraint graph: two variables
+    are connected when they appear in the same clause or atmost constraint. Variables
+    fixed by assumptions connect nothing, so shifts fixed for every staff member cut the
+    horizon into time blocks. Returns a list of (sub-formula, problem variables) and the
+    problem variables left out of every component: unconstrained or fixed.
+    """
+    fixed = set(fixed)
+    parent = list(range(max(formula.nv, n_variables) + 1))
+    constraints = [(clause, False) for clause in formula.clauses] + [(atmost, True) for atmost in getattr(formula, 'atmosts', [])]
+    for constraint, is_atmost in constraints:
+        free = [abs(l) for l in (constraint[0] if is_atmost else constraint) if abs(l) not in fixed]
+        if len(free) > 1:
+            root = find(parent, free[0])
+            for v in free[1:]:
+                other = find(parent, v)
+                if other != root:
+                    parent[other] = root
+
+    sub_formulas = {} # root -> CNFPlus
+    fully_fixed = [] # satisfied or not by the assumptions alone, checked with the first component
+    for constraint, is_atmost in constraints:
+        literals = constraint[0] if is_atmost else constraint
+        free = [abs(l) for l in literals if abs(l) not in fixed]
+        if not free:
+            fully_fixed.append((constraint, is_atmost))
+            continue
+        sub_formula = sub_formulas.setdefault(find(parent, free[0]), CNFPlus())
+        sub_formula.append(constraint, is_atmost=is_atmost)
+    if fully_fixed:
+        sub_formula = next(iter(sub_formulas.values()), None) or sub_formulas.setdefault(0, CNFPlus())
+        for constraint, is_atmost in fully_fixed:
+            sub_formula.append(constraint, is_atmost=is_atmost)
+
+    roots = np.array([find(parent, v) for v in range(1, n_variables+1)], dtype=np.int64)
+    components = []
+    constrained = np.zeros(n_variables, dtype=bool)
+    for root, sub_formula in sub_formulas.items():
+        sub_formula.nv = formula.nv
+        variables = np.flatnonzero(roots == root) + 1 # empty for root 0
+        constrained[variables - 1] = True
+        components.append((sub_formula, variables))
+    return components, np.flatnonzero(~constrained) + 1
+
+def solve_components(session, components, free_variables, old_model, assumptions=[], progress=None):
+    """
+    Solves the components one after the other on session, the warm session of the whole
+    roster, and merges the closest models: the distance of the merged model is the sum of
+    the distances of the components, each one minimal, so it is minimal too. Each search
+    only counts the changes of its component and only gets the assumptions of its own
+    variables and of the fixed ones, which belong to no component. Free variables keep
+    their old value unless an assumption sets them.
+    """
+    start = time.perf_counter()
+    old_model = np.asarray(old_model)
+    new_model = old_model.copy()
+    owner = np.full(len(old_model) + 1, -1, dtype=np.int64) # variable -> index of its component
+    for i, (formula, variables) in enumerate(components):
+        owner[variables] = i
+    free = set(free_variables.tolist())
+    for l in assumptions:
+        if abs(l) in free:
+            new_model[abs(l)-1] = l
+    shared = [l for l in assumptions if abs(l) >= len(owner) or owner[abs(l)] == -1]
+    stats = {'distance': int((new_model != old_model).sum()), 'optimal': True, 'solver_calls': 0, 'models': 0,
+             'solve_time': 0.0, 'components': len(components)}
+
+    for i, (formula, variables) in enumerate(components):
+        component_assumptions = [l for l in assumptions if abs(l) < len(owner) and owner[abs(l)] == i] + shared
+        component_model, distance, component_stats = session.find_closest_model(old_model[variables - 1].tolist(), component_assumptions)
+        if component_model is None:
+            return None, None, dict(stats, optimal=False, solve_time=time.perf_counter() - start)
+        new_model[variables - 1] = component_model
+        stats['distance'] += distance
+        stats['optimal'] = stats['optimal'] and component_stats['optimal']
+        stats['solver_calls'] += component_stats['solver_calls']
+        stats['models'] += component_stats['models']
+        if progress is not None:
+            progress(dict(stats, solve_time=time.perf_counter() - start))
+    stats['solve_time'] = time.perf_counter() - start
+    return new_model.tolist(), stats['distance'], stats
@@ -0,0 +1,42 @@
+# module imports
+from datetime import date, timedelta
+
+
+class Horizon():
+    """
+    Calendar of a solving horizon, built once per request so that every conversion of
+    the request agrees on what today is. Shift index 2*d is the day shift of the d-th
+    day after start (today by default), 2*d+1 its night shift.
+    """
+
+    times = ('day', 'night')
+
+    def __init__(self, n_shifts, start=None):
+        self.start = start or date.today()
+        self.n_shifts = n_shifts
+        self.dates = [str(self.start + timedelta(days=day)) for day in range((n_shifts + 1) // 2)]
+        self.day_indices = {calendar_date : day for day, calendar_date in enumerate(self.dates)}
+
+    def day_index(self, calendar_date):
+        # number of days from start to calendar_date (ISO format), negative in the past
+        day = self.day_indices.get(calendar_date)
+        if day is None: # outside the horizon
+            day = (date.fromisoformat(calendar_date) - self.start).days
+        return day
+
+    def shift_index(self, calendar_date, time):
+        h12_index = self.day_index(calendar_date) * 2
+        if time in ['night', 'nuit']:
+            h12_index += 1
+        return h12_index
+
+    def contains(self, shift_index):
+        return 0 <= shift_index < self.n_shifts
+
+    def date_and_time(self, shift_index):
+        day, night = divmod(shift_index, 2)
+        if 0 <= day < len(self.dates):
+            calendar_date = self.dates[day]
+        else:
+            calendar_date = str(self.start + timedelta(days=day))
+        return calendar_date, self.times[night]
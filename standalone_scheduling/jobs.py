@@ -0,0 +1,174 @@
+# module imports
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+import asyncio
+import multiprocessing
+import time
+import uuid
+
+# local imports
+import metrics
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job():
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = 'queued' # queued -> running -> done | failed
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.progress = {} # last stats reported by the solver, e.g. best distance so far
+        self.result = None
+        self.error = None
+        self.detail = None # e.g. the conflicting requests of an infeasible solve
+        self.timings = None # phases and counters of the solve in the worker, see metrics.start_request
+        self.task = None
+        self.updated = asyncio.Event()
+
+    def as_dict(self):
+        job = {'id': self.id, 'status': self.status, 'submitted': self.submitted,
+               'started': self.started, 'finished': self.finished, 'progress': self.progress}
+        if self.status == 'done':
+            job['result'] = self.result
+        if self.timings is not None:
+            job['timings'] = self.timings
+        if self.status == 'failed':
+            job['error'] = self.error
+            if self.detail is not None:
+                job['detail'] = self.detail
+        return job
+
+
+def run_job(job_id, progress, fn, args, profiler=None):
+    # runs in a worker process, progress is a manager dict shared with the API process,
+    # the metrics recorded by the worker go back with the value returned by fn
+    progress[job_id] = {'status': 'running', 'started': time.time()}
+    def report(stats):
+        progress[job_id] = dict(stats, status='running', started=progress[job_id]['started'])
+    timings = metrics.start_request(profiler)
+    with metrics.profiling(profiler, 'solve') as profile:
+        value = fn(*args, progress=report)
+    timings = {'spans': dict(timings['spans']), 'counters': dict(timings['counters']), 'profile': profile['path']}
+    return value, timings, metrics.registry.drain()
+
+
+class SolveJobs():
+    """
+    Runs solves on a process pool and tracks them by job id.
+    At most max_workers solves run at once and at most max_queued wait for a worker,
+    further submissions raise JobQueueFull.
+    fn is called in a worker as fn(*args, progress=callback), callback receiving the
+    stats of the solve so far.
+    """
+
+    max_finished_jobs = 1000 # finished jobs kept for polling
+
+    def __init__(self, max_workers=2, max_queued=16):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.executor = None
+        self.manager = None
+        self.progress = None
+        self.jobs = OrderedDict() # job id -> Job
+
+    def start(self):
+        if self.executor is None:
+            self.manager = multiprocessing.Manager()
+            self.progress = self.manager.dict()
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.manager.shutdown()
+            self.executor = None
+
+    def pending(self):
+        return sum(1 for job in self.jobs.values() if job.status in ['queued', 'running'])
+
+    def submit(self, fn, *args, on_result=None, profiler=None):
+        # on_result: optional coroutine function turning the value returned by fn into the job result
+        # profiler: name of a profiler of metrics.profilers to run the job under
+        self.start()
+        if self.pending() >= self.max_workers + self.max_queued:
+            raise JobQueueFull('{0} solves are already queued or running'.format(self.pending()))
+        job = Job(uuid.uuid4().hex)
+        self.jobs[job.id] = job
+        future = self.executor.submit(run_job, job.id, self.progress, fn, args, profiler)
+        job.task = asyncio.create_task(self._complete(job, asyncio.wrap_future(future), on_result))
+        self._evict()
+        return job
+
+    def resolve(self, value, on_result=None):
+        # a job whose value is already known, e.g. from a cache, only on_result runs
+        job = Job(uuid.uuid4().hex)
+        self.jobs[job.id] = job
+        future = asyncio.get_running_loop().create_future()
+        future.set_result((value, None, None))
+        job.task = asyncio.create_task(self._complete(job, future, on_result))
+        self._evict()
+        return job
+
+    async def _complete(self, job, future, on_result):
+        try:
+            value, job.timings, worker_metrics = await future
+            if worker_metrics is not None:
+                metrics.registry.merge(worker_metrics)
+            self.refresh(job)
+            job.result = await on_result(value) if on_result is not None else value
+            job.status = 'done'
+        except Exception as e:
+            job.error = repr(e)
+            job.detail = getattr(e, 'detail', None)
+            job.status = 'failed'
+        metrics.count('solve_jobs', status=job.status)
+        job.finished = time.time()
+        if self.progress is not None:
+            self.progress.pop(job.id, None)
+        job.updated.set()
+
+    def refresh(self, job):
+        # pulls the progress reported by the worker
+        progress = self.progress.get(job.id) if job.finished is None and self.progress is not None else None
+        if progress:
+            job.status = 'running' if job.status == 'queued' else job.status
+            job.started = progress.pop('started', job.started)
+            progress.pop('status', None)
+            job.progress = progress
+        return job
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        return self.refresh(job) if job is not None else None
+
+    async def wait(self, job_id, timeout=None):
+        job = self.jobs[job_id]
+        await asyncio.wait_for(asyncio.shield(job.task), timeout)
+        return job
+
+    async def events(self, job_id, interval=0.5):
+        # yields the job every time its progress changes, until it is finished
+        job = self.jobs[job_id]
+        last = None
+        while True:
+            self.refresh(job)
+            current = job.as_dict()
+            if current != last:
+                yield current
+                last = current
+            if job.finished is not None:
+                return
+            try:
+                await asyncio.wait_for(job.updated.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
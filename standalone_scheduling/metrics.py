@@ -0,0 +1,207 @@
+# Process-wide counters, gauges and latency histograms, rendered in the Prometheus text
+# format by /metrics, and the timings of the request being served, for its Server-Timing
+# header. Solves run in worker processes: each job drains the registry of its worker and
+# the API process merges it back, see jobs.run_job.
+from collections import defaultdict
+from contextlib import contextmanager
+import contextvars
+import cProfile
+import importlib.util
+import os
+import pstats
+import threading
+import time
+import uuid
+
+
+buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0) # seconds
+prefix = 'healthplanner_'
+profiling_enabled = os.environ.get("PROFILING_ENABLED", "") not in ['', '0', 'false']
+profile_directory = os.environ.get("PROFILE_DIR", "/tmp/healthplanner-profiles")
+
+
+class Registry():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float) # (name, labels) -> value
+        self.gauges = {} # (name, labels) -> value
+        self.histograms = {} # (name, labels) -> bucket counts + [sum, count]
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, [0] * len(buckets) + [0.0, 0])
+            for i, bound in enumerate(buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def drain(self):
+        # what was recorded since the last drain, to be merged into another registry
+        with self.lock:
+            snapshot = {'counters': list(self.counters.items()), 'gauges': list(self.gauges.items()),
+                        'histograms': list(self.histograms.items())}
+            self.counters.clear()
+            self.histograms.clear()
+        return snapshot
+
+    def merge(self, snapshot):
+        with self.lock:
+            for key, value in snapshot['counters']:
+                self.counters[tuple(key)] += value
+            for key, value in snapshot['gauges']:
+                self.gauges[tuple(key)] = value
+            for key, values in snapshot['histograms']:
+                histogram = self.histograms.setdefault(tuple(key), [0] * len(buckets) + [0.0, 0])
+                for i, value in enumerate(values):
+                    histogram[i] += value
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for kind, metrics in [('counter', self.counters), ('gauge', self.gauges)]:
+                for name in sorted(set(name for name, _ in metrics)):
+                    lines.append('# TYPE {0}{1} {2}'.format(prefix, name, kind))
+                    for (metric, labels), value in sorted(metrics.items()):
+                        if metric == name:
+                            lines.append('{0}{1}{2} {3}'.format(prefix, name, format_labels(labels), value))
+            for name in sorted(set(name for name, _ in self.histograms)):
+                lines.append('# TYPE {0}{1} histogram'.format(prefix, name))
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(buckets, histogram):
+                        lines.append('{0}{1}_bucket{2} {3}'.format(prefix, name, format_labels(labels + (('le', bound),)), count))
+                    lines.append('{0}{1}_bucket{2} {3}'.format(prefix, name, format_labels(labels + (('le', '+Inf'),)), histogram[-1]))
+                    lines.append('{0}{1}_sum{2} {3}'.format(prefix, name, format_labels(labels), histogram[-2]))
+                    lines.append('{0}{1}_count{2} {3}'.format(prefix, name, format_labels(labels), histogram[-1]))
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('"', '\\"')) for name, value in labels) + '}'
+
+registry = Registry()
+
+
+# phase -> seconds and counter -> value of the request being served, None outside requests
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+def start_request(profiler=None):
+    # the same dict is shared with the tasks the request spawns
+    timings = {'spans': defaultdict(float), 'counters': defaultdict(float), 'profiler': profiler}
+    request_timings.set(timings)
+    return timings
+
+def add_to_request(timings):
+    # timings of a job solved for the current request in a worker process
+    current = request_timings.get()
+    if current is None or not timings:
+        return
+    for phase, seconds in timings['spans'].items():
+        current['spans'][phase] += seconds
+    for name, value in timings['counters'].items():
+        current['counters'][name] += value
+
+@contextmanager
+def span(phase, **labels):
+    # times a phase, in the phase_seconds histogram and in the timings of the request
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe('phase_seconds', seconds, phase=phase, **labels)
+        timings = request_timings.get()
+        if timings is not None:
+            timings['spans'][phase] += seconds
+
+def count(name, value=1, **labels):
+    registry.inc(name + '_total', value, **labels)
+    timings = request_timings.get()
+    if timings is not None:
+        timings['counters'][name] += value
+
+def server_timing(timings):
+    # Server-Timing header, durations in milliseconds
+    return ', '.join('{0};dur={1:.1f}'.format(phase, seconds * 1000) for phase, seconds in timings['spans'].items())
+
+
+def cosmos_response_hook(response):
+    # raw_response_hook of the Cosmos clients, called on every HTTP round trip
+    request = response.http_request
+    segments = request.url.split('?')[0].split('/')
+    container = segments[segments.index('colls') + 1] if 'colls' in segments[:-1] else ''
+    operation = 'query' if request.headers.get('x-ms-documentdb-isquery') else request.method.lower()
+    count('cosmos_requests', operation=operation, container=container)
+    try:
+        count('cosmos_request_charge', float(response.http_response.headers.get('x-ms-request-charge', 0)), container=container)
+    except ValueError:
+        pass
+
+
+class CProfiler():
+    # deterministic profile of everything the process runs meanwhile, e.g. the other requests of the event loop
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self, path):
+        self.profile.disable()
+        with open(path + '.txt', 'w') as f:
+            pstats.Stats(self.profile, stream=f).sort_stats('cumulative').print_stats(50)
+        self.profile.dump_stats(path + '.prof')
+        return path + '.prof'
+
+
+profilers = {'cprofile': CProfiler} # name -> factory, see register_profiler
+
+def register_profiler(name, factory):
+    # factory() must return an object with start() and stop(path) -> path of the file written
+    profilers[name] = factory
+
+class PyinstrumentProfiler():
+    # sampling profile, light enough for the solves
+    def __init__(self):
+        from pyinstrument import Profiler # only imported when a profile is asked for
+        self.profiler = Profiler(async_mode='disabled')
+
+    def start(self):
+        self.profiler.start()
+
+    def stop(self, path):
+        self.profiler.stop()
+        with open(path + '.html', 'w') as f:
+            f.write(self.profiler.output_html())
+        return path + '.html'
+
+if importlib.util.find_spec('pyinstrument') is not None:
+    register_profiler('pyinstrument', PyinstrumentProfiler)
+
+@contextmanager
+def profiling(name, label='request'):
+    # yields a dict whose 'path' is the profile written, nothing is profiled unless enabled and name is known
+    result = {'path': None}
+    if not profiling_enabled or name not in profilers:
+        yield result
+        return
+    os.makedirs(profile_directory, exist_ok=True)
+    profiler = profilers[name]()
+    profiler.start()
+    try:
+        yield result
+    finally:
+        result['path'] = profiler.stop(os.path.join(profile_directory, '{0}-{1}'.format(label, uuid.uuid4().hex[:8])))
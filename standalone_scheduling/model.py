@@ -0,0 +1,144 @@
+# module imports
+import numpy as np
+import pickle
+
+
+class ScheduleModel():
+    """
+    Truth values of the variables of a roster, one bit each: variable
+    shift_index * n_staff + staff_index (see utilities.binary_variable_encoding) is
+    true when the staff member works the shift. It reads like the list of signed
+    literals returned by the solvers (len, iteration, model[i] is i+1 or -(i+1)),
+    at one bit per variable instead of a boxed int, and its bits are shared
+    without copies through buffer and from_buffer.
+    """
+
+    __slots__ = ('n_variables', 'n_staff', 'bits')
+
+    def __init__(self, n_variables, n_staff, bits=None):
+        self.n_variables = n_variables
+        self.n_staff = n_staff
+        # variable v is bit (v-1) % 8 of byte (v-1) // 8, the unused bits of the last byte stay 0
+        self.bits = bytearray((n_variables + 7) // 8) if bits is None else bits
+
+    @classmethod
+    def from_values(cls, values, n_staff):
+        # from a bool array, index i is variable i+1
+        values = np.asarray(values, dtype=bool)
+        return cls(len(values), n_staff, bytearray(np.packbits(values, bitorder='little')))
+
+    @classmethod
+    def from_model(cls, model, n_staff):
+        # from a list of signed literals, e.g. a solver model, a ScheduleModel is returned as is
+        if isinstance(model, ScheduleModel):
+            return model
+        return cls.from_values(np.fromiter(model, dtype=np.int64, count=len(model)) > 0, n_staff)
+
+    @classmethod
+    def from_buffer(cls, buffer, n_variables, n_staff):
+        # the bits of buffer() are used in place, a read-only buffer gives a read-only model
+        return cls(n_variables, n_staff, memoryview(buffer).cast('B'))
+
+    def buffer(self):
+        return memoryview(self.bits)
+
+    def __reduce_ex__(self, protocol):
+        # pickle protocol 5 takes the bits out of band when the pickler is given a buffer_callback
+        bits = pickle.PickleBuffer(self.bits) if protocol >= 5 else bytearray(self.bits)
+        return (ScheduleModel, (self.n_variables, self.n_staff, bits))
+
+    def copy(self):
+        return ScheduleModel(self.n_variables, self.n_staff, bytearray(self.bits))
+
+    def variable(self, staff_index, shift_index):
+        # 1 <= staff_index <= n_staff
+        if not 1 <= staff_index <= self.n_staff:
+            raise IndexError('staff index {0} out of range'.format(staff_index))
+        return shift_index * self.n_staff + staff_index
+
+    def get_variable(self, variable):
+        i = variable - 1
+        if not 0 <= i < self.n_variables:
+            raise IndexError('variable {0} out of range'.format(variable))
+        return bool(self.bits[i >> 3] >> (i & 7) & 1)
+
+    def set_variable(self, variable, value=True):
+        i = variable - 1
+        if not 0 <= i < self.n_variables:
+            raise IndexError('variable {0} out of range'.format(variable))
+        if value:
+            self.bits[i >> 3] |= 1 << (i & 7)
+        else:
+            self.bits[i >> 3] &= ~(1 << (i & 7)) & 0xff
+
+    def get(self, staff_index, shift_index):
+        return self.get_variable(self.variable(staff_index, shift_index))
+
+    def set(self, staff_index, shift_index, value=True):
+        self.set_variable(self.variable(staff_index, shift_index), value)
+
+    def __len__(self):
+        return self.n_variables
+
+    def __getitem__(self, index):
+        # signed literal of variable index+1, as in a solver model
+        if index < 0:
+            index += self.n_variables
+        return index + 1 if self.get_variable(index + 1) else -(index + 1)
+
+    def __iter__(self):
+        return iter(self.literals())
+
+    def __eq__(self, other):
+        if not isinstance(other, ScheduleModel):
+            return NotImplemented
+        return self.n_variables == other.n_variables and self.n_staff == other.n_staff and self.bits == other.bits
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'ScheduleModel({0} variables, {1} true)'.format(self.n_variables, self.count())
+
+    def packed(self):
+        # uint8 view of the bits, nothing is copied
+        return np.frombuffer(self.bits, dtype=np.uint8)
+
+    def values(self):
+        # bool array, index i is variable i+1
+        return np.unpackbits(self.packed(), count=self.n_variables, bitorder='little').view(bool)
+
+    def literals(self):
+        # list of signed literals, for the solvers
+        variables = np.arange(1, self.n_variables+1)
+        return np.where(self.values(), variables, -variables).tolist()
+
+    def true_variables(self):
+        # variables assigned true, in increasing order, only the non-zero bytes are unpacked
+        return self.nonzero_bits(self.packed())[0]
+
+    def count(self):
+        return int.from_bytes(self.bits, 'little').bit_count()
+
+    def distance(self, other):
+        # number of variables with different truth values (XOR + popcount)
+        self.check_compatible(other)
+        return int.from_bytes(np.bitwise_xor(self.packed(), other.packed()), 'little').bit_count()
+
+    def changed(self, other):
+        # variables whose truth value differs in other, and their values in other
+        self.check_compatible(other)
+        variables, changed_bytes, bit_indices = self.nonzero_bits(np.bitwise_xor(self.packed(), other.packed()))
+        new_values = other.packed()[changed_bytes] >> bit_indices.astype(np.uint8) & 1
+        return variables, new_values.astype(bool)
+
+    def check_compatible(self, other):
+        if len(self) != len(other):
+            raise ValueError('models of {0} and {1} variables cannot be compared'.format(len(self), len(other)))
+
+    @staticmethod
+    def nonzero_bits(packed):
+        # (variables, byte indices, bit indices) of the bits set in packed, in increasing order
+        nonzero_bytes = np.flatnonzero(packed)
+        rows, bit_indices = np.nonzero(np.unpackbits(packed[nonzero_bytes, None], axis=1, bitorder='little'))
+        byte_indices = nonzero_bytes[rows]
+        return byte_indices * 8 + bit_indices + 1, byte_indices, bit_indices
@@ -0,0 +1,95 @@
+# module imports
+from pysat.formula import CNFPlus
+import multiprocessing
+import queue
+import random
+import time
+
+# local imports
+from session import SolverSession
+from metrics import count, registry
+
+# (solver_name, seed) pairs: seed 0 keeps the formula as is, other seeds shuffle the
+# order of its clauses, which changes the search of the solver
+native_configurations = [('minicard', 0), ('minicard', 1), ('minicard', 2), ('minicard', 3)]
+clause_configurations = [('cadical153', 0), ('glucose4', 0), ('maplechrono', 0), ('cadical153', 1)]
+
+
+def default_configurations(formula):
+    if getattr(formula, 'atmosts', None):
+        return native_configurations # only minicard supports is_atmost constraints
+    return clause_configurations
+
+def shuffled_formula(formula, seed):
+    if seed == 0:
+        return formula
+    rng = random.Random(seed)
+    shuffled = CNFPlus()
+    shuffled.nv = formula.nv
+    shuffled.clauses = rng.sample(formula.clauses, len(formula.clauses))
+    shuffled.atmosts = rng.sample(getattr(formula, 'atmosts', []), len(getattr(formula, 'atmosts', [])))
+    return shuffled
+
+def portfolio_worker(configuration, formula, old_model, assumptions, results):
+    solver_name, seed = configuration
+    try:
+        session = SolverSession(solver_name, shuffled_formula(formula, seed), len(old_model))
+        try:
+            new_model, distance, stats = session.find_closest_model(old_model, assumptions)
+        finally:
+            session.delete()
+        results.put((configuration, new_model, distance, stats))
+    except Exception as e:
+        results.put((configuration, None, None, {'error': repr(e)}))
+
+def solve_portfolio(formula, old_model, assumptions=[], configurations=None, mode='first', timeout=None):
+    """
+    Runs find_closest_model with several (solver_name, seed) configurations in parallel
+    processes on the same formula.
+    mode='first' returns the first result and terminates the other processes,
+    mode='best' waits for every process (or for timeout seconds) and returns the smallest distance.
+    The races won and the solve time of the winners are recorded in the metrics, which the solve
+    workers send back to the API, to tune the default configurations from real traffic.
+    """
+    if mode not in ['first', 'best']:
+        raise ValueError('mode should be either first or best')
+    configurations = configurations or default_configurations(formula)
+    start = time.perf_counter()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=portfolio_worker, args=(configuration, formula, old_model, assumptions, results), daemon=True)
+                 for configuration in configurations]
+    for process in processes:
+        process.start()
+
+    best = None
+    errors = {}
+    try:
+        for _ in processes:
+            remaining = None if timeout is None else max(0, timeout - (time.perf_counter() - start))
+            try:
+                configuration, new_model, distance, stats = results.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if 'error' in stats:
+                errors[configuration] = stats['error']
+                continue
+            if best is None or (new_model is not None and (best[1] is None or distance < best[2])):
+                best = (configuration, new_model, distance, stats)
+            if mode == 'first':
+                break
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+        results.close()
+
+    if best is None:
+        raise RuntimeError('no portfolio configuration finished: {0}'.format(errors or 'timeout'))
+    configuration, new_model, distance, stats = best
+    stats = dict(stats, configuration=configuration, mode=mode, wall_time=time.perf_counter() - start)
+    solver_name, seed = configuration
+    count('portfolio_wins', solver=solver_name, seed=seed)
+    registry.observe('portfolio_solve_seconds', stats['solve_time'], solver=solver_name, seed=seed)
+    return new_model, distance, stats
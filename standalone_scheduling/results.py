@@ -0,0 +1,114 @@
+# module imports
+from pysat.formula import WCNF
+from collections import OrderedDict
+import base64
+import hashlib
+import json
+import numpy as np
+import os
+import threading
+
+# local imports
+from utilities import model_as_array
+from model import ScheduleModel
+
+
+def fingerprint(roster, encoding, old_model, formula_negotiable_constraints, worked=(), budget=None):
+    """
+    Content hash of a solve: the permanent rules of the roster, the negotiable constraints
+    in any order and the old model. Shifts are numbered from today, so the date only
+    matters for rolling rosters, through the shifts already worked.
+    """
+    digest = hashlib.sha256()
+    rules = roster.key()[1:] # the name of the roster changes nothing to the formula
+    if isinstance(formula_negotiable_constraints, WCNF):
+        negotiable = sorted(zip((clause[0] for clause in formula_negotiable_constraints.soft), formula_negotiable_constraints.wght))
+    else:
+        negotiable = sorted(set(clause[0] for clause in formula_negotiable_constraints))
+        budget = None # hard constraints are always solved to the end
+    if roster.rolling:
+        worked = sorted((item['staff_name'], item['date'], item['time']) for item in worked)
+    else:
+        worked = []
+    digest.update(json.dumps([rules, encoding, roster.rolling, negotiable, worked, budget]).encode())
+    values = model_as_array(old_model)
+    digest.update(len(values).to_bytes(8, 'little'))
+    digest.update(np.packbits(values).tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache():
+    """
+    LRU cache of solved models, (new model, distance) keyed by fingerprint. The bits of
+    the ScheduleModels are kept as bytes and handed out as read-only models over them.
+    With a directory, every result is also written there, so results survive restarts
+    and are shared by the worker processes of the API.
+    """
+
+    def __init__(self, max_entries=256, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict() # key -> (bits, number of variables, number of staff, distance)
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.counters['hits'] += 1
+                self.entries.move_to_end(key)
+        if entry is None and self.directory:
+            try:
+                with open(self.path(key)) as f:
+                    stored = json.load(f)
+                entry = (base64.b64decode(stored['model']), stored['n_variables'], stored['n_staff'], stored['distance'])
+            except (OSError, ValueError, KeyError):
+                entry = None
+            if entry is not None:
+                self._store(key, entry)
+                with self.lock:
+                    self.counters['disk_hits'] += 1
+        if entry is None:
+            with self.lock:
+                self.counters['misses'] += 1
+            return None
+        bits, n_variables, n_staff, distance = entry
+        return ScheduleModel.from_buffer(bits, n_variables, n_staff), distance
+
+    def put(self, key, new_model, distance):
+        # new_model: a ScheduleModel
+        entry = (bytes(new_model.buffer()), new_model.n_variables, new_model.n_staff, distance)
+        self._store(key, entry)
+        if self.directory:
+            # written then renamed, so readers never see half a file
+            temporary = self.path(key) + '.{0}.tmp'.format(os.getpid())
+            with open(temporary, 'w') as f:
+                json.dump({'model': base64.b64encode(entry[0]).decode(), 'n_variables': entry[1], 'n_staff': entry[2],
+                           'distance': distance}, f)
+            os.replace(temporary, self.path(key))
+
+    def _store(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), max_entries=self.max_entries, directory=self.directory)
+
+
+result_cache = ResultCache(max_entries=int(os.environ.get("SOLVER_RESULT_CACHE_SIZE", 256)),
+                           directory=os.environ.get("SOLVER_RESULT_CACHE_DIR"))
@@ -0,0 +1,178 @@
+# module imports
+from pysat.solvers import Solver
+from pysat.card import CardEnc
+from pysat.formula import IDPool
+from collections import OrderedDict
+from datetime import timedelta
+import numpy as np
+import threading
+
+# local imports
+from session import SolverSession, minimise_distance, minimise_violations, explain_infeasibility
+from cardinality import card_encoding_types
+from utilities import model_as_array, array_as_model
+
+
+def frozen_shifts(roster):
+    # worked shifts that can still take part in a sliding window with the horizon
+    return max([size for size, _ in roster.sliding_windows], default=1) - 1
+
+def worked_shifts(schedule, roster, horizon):
+    # the items of the schedule that rolling sessions freeze
+    n_frozen = frozen_shifts(roster)
+    return [item for item in schedule if -n_frozen <= horizon.shift_index(item['date'], item['time']) < 0]
+
+
+class RollingSession(SolverSession):
+    """
+    Solver session of a roster in rolling-horizon mode. Shifts are numbered from a fixed
+    anchor date instead of today, so the solver state stays valid from one day to the
+    next: the shifts entering the horizon are appended with their service constraint
+    and the sliding windows ending on them, and the shifts already worked are frozen
+    by assumptions, so the windows that cross today count them. Service constraints
+    are guarded by a selector literal per shift, assumed while the shift is in the
+    horizon only: a worked shift is a fact, even if it was understaffed. Models passed
+    in and returned are numbered from today, as everywhere else.
+    """
+
+    max_past_days = 56 # then the session is rebuilt from a new anchor, see solve.get_rolling_session
+
+    def __init__(self, solver_name, roster, encoding, start):
+        self.solver_name = solver_name
+        self.roster = roster
+        self.encoding = encoding
+        self.n_frozen = frozen_shifts(roster)
+        self.anchor = start - timedelta(days=(self.n_frozen + 1) // 2) # the first windows already reach back
+        self.oracle = Solver(name=solver_name)
+        self.vpool = IDPool() # problem and auxiliary variables are interleaved, day after day
+        self.variables = np.zeros((0, roster.n_staff), dtype=np.int64) # absolute shift index -> variable of each staff member
+        self.selectors = [] # absolute shift index -> selector of its service constraint
+        self.top_id = 0
+        self.totalizers = OrderedDict()
+        self.evictions = 0 # the session is rebuilt by solve.get_rolling_session after max_evictions
+        self.lock = threading.Lock()
+        self.nb_requests = 0
+
+    def offset(self, horizon):
+        # absolute index of the first shift of the horizon
+        return (horizon.start - self.anchor).days * 2
+
+    def _atmost(self, literals, bound, selector=None):
+        # enforced when selector is true, or always without selector
+        if self.encoding != 'native':
+            clauses = CardEnc.atmost(lits=literals, bound=bound, vpool=self.vpool, encoding=card_encoding_types[self.encoding]).clauses
+            self.oracle.append_formula([clause + [-selector] for clause in clauses] if selector else clauses)
+        elif selector is None:
+            self.oracle.add_atmost(literals, bound)
+        else:
+            # len(literals)-bound copies of the selector: at most bound of literals when they are all true
+            copies = [self.vpool.id() for _ in range(len(literals) - bound)]
+            for copy in copies:
+                self.oracle.append_formula([[-copy, selector], [copy, -selector]])
+            self.oracle.add_atmost(literals + copies, len(literals))
+
+    def _encode_shift(self, shift_index):
+        # same constraints as solve.get_permanent_constraints, the 'shared' sliding window
+        # counters span the whole horizon so windows are encoded one by one instead
+        nb_staff_required = self.roster.staff_required(shift_index) # the anchor shift is a day shift
+        selector = self.selectors[shift_index]
+        for staff_indices in self.roster.teams.values():
+            literals = [int(self.variables[shift_index, staff_index-1]) for staff_index in staff_indices]
+            self._atmost(literals, nb_staff_required, selector)
+            self._atmost([-l for l in literals], len(literals) - nb_staff_required, selector)
+        for sliding_window_size, bound in self.roster.sliding_windows:
+            first_shift_index = shift_index - sliding_window_size + 1
+            if first_shift_index < 0:
+                continue
+            for staff_literals in self.variables[first_shift_index:shift_index+1].T.tolist():
+                self._atmost(staff_literals, bound)
+
+    def extend(self, n_shifts):
+        # appends the shifts up to absolute index n_shifts-1, returns how many were appended
+        first_shift_index = len(self.variables)
+        if n_shifts <= first_shift_index:
+            return 0
+        self.vpool.top = max(self.vpool.top, self.top_id) # above the totalizers
+        start = self.vpool.top + 1
+        new_variables = np.arange(start, start + (n_shifts - first_shift_index) * self.roster.n_staff).reshape(-1, self.roster.n_staff)
+        self.vpool.top = int(new_variables[-1, -1])
+        self.variables = np.vstack([self.variables, new_variables])
+        self.selectors.extend(self.vpool.id() for _ in range(first_shift_index, n_shifts))
+        for shift_index in range(first_shift_index, n_shifts):
+            self._encode_shift(shift_index)
+        self.top_id = self.vpool.top
+        return n_shifts - first_shift_index
+
+    def frozen_literals(self, worked, horizon):
+        # the n_frozen shifts before the horizon as assumptions, true for the items of worked
+        offset = self.offset(horizon)
+        worked_variables = set()
+        for item in worked:
+            shift_index = horizon.shift_index(item['date'], item['time'])
+            staff_index = self.roster.staff_dict.get(item['staff_name'])
+            if -self.n_frozen <= shift_index < 0 and staff_index is not None:
+                worked_variables.add(int(self.variables[offset + shift_index, staff_index - 1]))
+        past_variables = self.variables[max(0, offset - self.n_frozen):offset].ravel().tolist()
+        return [v if v in worked_variables else -v for v in past_variables]
+
+    def _frozen(self, selectors, worked, horizon):
+        # frozen_literals, unless the worked shifts break a sliding window on their own, e.g. a
+        # schedule edited by hand: conflicting staff requests never unfreeze the past
+        frozen = self.frozen_literals(worked, horizon)
+        if frozen and not self.oracle.solve(assumptions=selectors + frozen):
+            print('worked shifts break a sliding window, solving without freezing them')
+            return []
+        return frozen
+
+    def find_preferred_model(self, old_model, horizon, worked=(), soft=[], weights=[], budget=None, progress=None):
+        # weighted requests instead of assumptions, see session.minimise_violations
+        with self.lock:
+            self.nb_requests += 1
+            offset = self.offset(horizon)
+            appended = self.extend(offset + horizon.n_shifts)
+            window = self.variables[offset:offset + horizon.n_shifts].ravel()
+            old_literals = np.where(model_as_array(old_model), window, -window).tolist()
+            soft = [int(window[abs(l)-1]) if l > 0 else -int(window[abs(l)-1]) for l in soft]
+            selectors = self.selectors[offset:offset + horizon.n_shifts]
+            frozen = self._frozen(selectors, worked, horizon)
+            get_totalizer = lambda literals, ubound: self._totalizer(literals, ubound)
+            new_model, distance, stats = minimise_violations(self.oracle, old_literals, soft, weights, selectors + frozen,
+                                                             get_totalizer, progress, budget)
+            if new_model is not None:
+                new_model = array_as_model(model_as_array(new_model))
+            stats = dict(stats, appended_shifts=appended, frozen_literals=len(frozen))
+            return new_model, distance, stats
+
+    def explain(self, assumptions, horizon, worked=()):
+        # same as SolverSession.explain, the selectors and the worked shifts are never dropped
+        with self.lock:
+            offset = self.offset(horizon)
+            self.extend(offset + horizon.n_shifts)
+            window = self.variables[offset:offset + horizon.n_shifts].ravel()
+            absolute = {(int(window[abs(l)-1]) if l > 0 else -int(window[abs(l)-1])) : l for l in assumptions}
+            selectors = self.selectors[offset:offset + horizon.n_shifts]
+            mus, mcs, stats = explain_infeasibility(self.oracle, list(absolute), selectors + self.frozen_literals(worked, horizon))
+            if mus is None and worked:
+                mus, mcs, stats = explain_infeasibility(self.oracle, list(absolute), selectors) # as find_closest_model
+            if mus is None:
+                return mus, mcs, stats
+            return [absolute[l] for l in mus], [absolute[l] for l in mcs], stats
+
+    def find_closest_model(self, old_model, horizon, worked=(), assumptions=[], progress=None):
+        with self.lock:
+            self.nb_requests += 1
+            offset = self.offset(horizon)
+            appended = self.extend(offset + horizon.n_shifts)
+            window = self.variables[offset:offset + horizon.n_shifts].ravel() # variable v of the request -> window[v-1]
+            old_literals = np.where(model_as_array(old_model), window, -window).tolist()
+            assumptions = [int(window[abs(l)-1]) if l > 0 else -int(window[abs(l)-1]) for l in assumptions]
+            selectors = self.selectors[offset:offset + horizon.n_shifts]
+            frozen = self._frozen(selectors, worked, horizon)
+            get_totalizer = lambda ubound: self._totalizer(old_literals, ubound)
+            # None when the requests conflict, with the past frozen, see explain
+            new_model, distance, stats = minimise_distance(self.oracle, old_literals, frozen + selectors + assumptions,
+                                                           get_totalizer, progress)
+            if new_model is not None:
+                new_model = array_as_model(model_as_array(new_model)) # numbered from today again
+            stats = dict(stats, appended_shifts=appended, frozen_literals=len(frozen))
+            return new_model, distance, stats
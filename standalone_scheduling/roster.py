@@ -0,0 +1,76 @@
+# local imports
+from horizon import Horizon
+
+
+class Roster():
+    """
+    Staff, horizon and rules of one ward. Every encoding function takes a roster
+    instead of reading module-level globals, so rosters of different sizes can be
+    solved side by side in the same process.
+    """
+
+    def __init__(self,
+                 staff_names,
+                 n_shifts,
+                 day_staff_required=3,
+                 night_staff_required=1,
+                 sliding_windows=((14, 4), (7, 3), (2, 1)),
+                 name='default',
+                 database_name='healthplanner',
+                 rolling=False,
+                 teams=None,
+                 seniority=None):
+        self.name = name
+        self.database_name = database_name # each ward reads and writes its own Cosmos database
+        self.staff_names = list(staff_names)
+        self.staff_dict = {staff_name : staff_index for staff_index, staff_name in enumerate(self.staff_names, start=1)}
+        self.staff_inverted_dict = {str(value) : key for key, value in self.staff_dict.items()}
+        self.n_staff = len(self.staff_names) # 1 <= staff_index <= n_staff
+        self.n_shifts = n_shifts # 0 <= shift_index <= n_shifts-1
+        self.top_id = self.n_staff * self.n_shifts
+        self.day_staff_required = day_staff_required
+        self.night_staff_required = night_staff_required
+        # (sliding_window_size, bound): no more than bound shifts in any sliding_window_size consecutive shifts
+        self.sliding_windows = tuple(tuple(sliding_window) for sliding_window in sliding_windows)
+        # rolling horizon: the solver state is extended day after day and the worked shifts are frozen, see rolling.py
+        self.rolling = rolling
+        # team name -> staff names, each team has its own staff requirements on every shift, and
+        # teams that share no staff member are solved as independent sub-problems (see decompose.py)
+        teams = teams or {'all': self.staff_names}
+        self.teams = {team : [self.staff_dict[staff_name] for staff_name in staff_names] for team, staff_names in teams.items()}
+        # staff name -> years of seniority, weighs their requests, see constraints.constraint_weight
+        self.seniority = dict(seniority or {})
+
+    def staff_required(self, shift_index):
+        if shift_index % 2 == 0: # day shift
+            return self.day_staff_required
+        else: # night shift
+            return self.night_staff_required
+
+    def horizon(self, start=None):
+        # calendar of the shifts of the roster, starting today by default
+        return Horizon(self.n_shifts, start)
+
+    def key(self):
+        # identifies the permanent constraints of the roster, e.g. to share a solver session
+        return (self.name, tuple(self.staff_names), self.n_shifts,
+                self.day_staff_required, self.night_staff_required, self.sliding_windows,
+                tuple((team, tuple(staff_indices)) for team, staff_indices in self.teams.items()))
+
+    def __repr__(self):
+        return 'Roster({0!r}, n_staff={1}, n_shifts={2})'.format(self.name, self.n_staff, self.n_shifts)
+
+
+rosters = {} # roster name -> Roster
+
+def register_roster(roster):
+    rosters[roster.name] = roster
+    return roster
+
+def get_roster(name='default'):
+    try:
+        return rosters[name]
+    except KeyError:
+        raise KeyError('unknown roster \'{0}\''.format(name))
+
+register_roster(Roster(['Alice', 'Bob', 'Charlie', 'David', 'Eve'], n_shifts=4))
@@ -0,0 +1,230 @@
+# The schedule is stored as a base snapshot, one generation of the versioned 'schedule'
+# container, plus an append-only log of the diffs applied since, in the 'schedule_log'
+# container. Applying validated changes appends one entry, O(changes) instead of rewriting
+# the schedule, and readers keep a materialised view that only fetches the entries they
+# have not applied yet. Once the log of a base holds compact_after entries, the view is
+# written as a new base and the entries of the dropped bases are deleted.
+# The seq of an entry is the clock of its writer, so an entry can become visible after one
+# of a higher seq (clock skew between instances, a slow write): views remember the ids of
+# the entries they applied and read the log again from reread_window before their highest
+# seq, and compaction carries over every entry of the old base that the view did not apply.
+from azure.cosmos import PartitionKey, exceptions
+import base64
+import json
+import threading
+import time
+
+# local imports
+import cosmos
+from cosmos import kept_generations, new_generation, unversioned
+
+
+log_container = 'schedule_log'
+compact_after = 32 # log entries applied on top of a base before it is compacted
+reread_window = 300 * 10**9 # nanoseconds of the log read again by the views
+log_query = "SELECT * FROM c WHERE c.base = @base AND c.seq > @seq"
+old_log_query = "SELECT c.id FROM c WHERE NOT ARRAY_CONTAINS(@kept, c.base)"
+log_databases = set() # databases where the log container is known to exist
+
+page_size = 500 # items per page when streaming the schedule
+
+schedule_views = {} # database name -> ScheduleView
+schedule_views_lock = threading.Lock()
+
+def item_key(item):
+    # a shift of a staff member, whatever the variable index it had when it was written
+    return (item['staff_name'], item['date'], item['time'])
+
+def log_item(item):
+    return {'id': item['id'], 'staff_name': item['staff_name'], 'date': item['date'], 'time': item['time']}
+
+def log_entry(base, to_add, to_remove):
+    # seq orders the entries of a base by the clock of their writer, ids tell them apart
+    return {'id': new_generation(), 'base': base, 'seq': time.time_ns(),
+            'to_add': [log_item(item) for item in to_add],
+            'to_remove': [log_item(item) for item in to_remove]}
+
+
+def log_changes(entries):
+    # net effect of log entries: item_key -> item added, or None if removed
+    changes = {}
+    for entry in sorted(entries, key=lambda entry: entry['seq']):
+        for item in entry['to_remove']:
+            changes[item_key(item)] = None
+        for item in entry['to_add']:
+            changes[item_key(item)] = item
+    return changes
+
+def schedule_query(base, date_from=None, date_to=None, staff_names=None, time=None):
+    # the filters of /getSchedule pushed down into a query on the items of base,
+    # dates are ISO strings so they compare in calendar order
+    conditions, parameters = [], []
+    for condition, name, value in [('c.generation = @generation', '@generation', base),
+                                   ('c.date >= @date_from', '@date_from', date_from),
+                                   ('c.date <= @date_to', '@date_to', date_to),
+                                   ('ARRAY_CONTAINS(@staff_names, c.staff_name)', '@staff_names', staff_names or None),
+                                   ('c.time = @time', '@time', time)]:
+        if value is not None:
+            conditions.append(condition)
+            parameters.append({'name': name, 'value': value})
+    query = "SELECT * FROM c" + (" WHERE " + " AND ".join(conditions) if conditions else "")
+    return query, parameters
+
+def matches(item, date_from=None, date_to=None, staff_names=None, time=None):
+    # same filters as schedule_query, for the items of the log
+    return ((date_from is None or item['date'] >= date_from) and
+            (date_to is None or item['date'] <= date_to) and
+            (not staff_names or item['staff_name'] in staff_names) and
+            (time is None or item['time'] == time))
+
+def encode_continuation(base, token):
+    # a page is always read from the base of the first one, kept until the next compaction but one
+    return base64.urlsafe_b64encode(json.dumps([base, token]).encode()).decode()
+
+def decode_continuation(continuation):
+    try:
+        base, token = json.loads(base64.urlsafe_b64decode(continuation.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('invalid continuation token')
+    return base, token
+
+def page_items(page, base, changes, filters, first):
+    # base items overridden by the log are dropped, the items it added come with the first page
+    items = [unversioned(item) if base is not None else item for item in page]
+    items = [item for item in items if item_key(item) not in changes]
+    if first:
+        items = [item for item in changes.values() if item is not None and matches(item, **filters)] + items
+    return items
+
+
+class ScheduleView():
+    """
+    Current schedule of a database: the items of base with the log entries of base
+    applied in seq order, keyed by item_key.
+    """
+
+    def __init__(self, base, items):
+        self.base = base
+        self.seq = 0 # highest seq applied
+        self.applied = set() # ids of the entries applied
+        self.n_entries = 0
+        self.items = {item_key(item) : item for item in items}
+
+    def apply(self, entry):
+        # an entry seen late is applied on top of the ones of higher seq
+        if entry['id'] in self.applied:
+            return
+        for item in entry['to_remove']:
+            self.items.pop(item_key(item), None)
+        for item in entry['to_add']:
+            self.items[item_key(item)] = item
+        self.applied.add(entry['id'])
+        self.seq = max(self.seq, entry['seq'])
+        self.n_entries += 1
+
+    def unapplied(self, entries):
+        return [entry for entry in entries if entry['id'] not in self.applied]
+
+    def apply_all(self, entries):
+        for entry in sorted(entries, key=lambda entry: entry['seq']):
+            self.apply(entry)
+
+    def schedule(self):
+        return list(self.items.values())
+
+
+def get_log_container(database_name):
+    database = cosmos.get_client().get_database_client(database_name)
+    if database_name not in log_databases:
+        database.create_container_if_not_exists(id=log_container, partition_key=PartitionKey(path='/id', kind='Hash'))
+        log_databases.add(database_name)
+    return database.get_container_client(log_container)
+
+def read_log(base, seq, database_name):
+    return list(get_log_container(database_name).query_items(
+        query=log_query,
+        parameters=[{'name': '@base', 'value': base}, {'name': '@seq', 'value': seq}],
+        enable_cross_partition_query=True
+    ))
+
+def read_schedule(database_name='healthplanner'):
+    base = cosmos.current_generation('schedule', database_name)
+    with schedule_views_lock:
+        view = schedule_views.get(database_name)
+    if view is None or view.base != base:
+        view = ScheduleView(base, cosmos.read('schedule', database_name))
+    if base is not None:
+        view.apply_all(read_log(base, view.seq - reread_window, database_name))
+    with schedule_views_lock:
+        schedule_views[database_name] = view
+    return view
+
+def schedule_pages(database_name='healthplanner', filters=None, page_size=page_size, continuation=None):
+    # yields the current schedule as (items, continuation) pages read straight from Cosmos,
+    # continuation is None on the last page
+    filters = filters or {}
+    if continuation is None:
+        base, token = cosmos.current_generation('schedule', database_name), None
+    else:
+        base, token = decode_continuation(continuation)
+    changes = log_changes(read_log(base, 0, database_name)) if base is not None else {}
+    query, parameters = schedule_query(base, **filters)
+    container = cosmos.get_client().get_database_client(database_name).get_container_client('schedule')
+    pages = container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True,
+                                  max_item_count=page_size).by_page(token)
+    first = token is None
+    n_pages = 0
+    for page in pages:
+        items = page_items(page, base, changes, filters, first)
+        first = False
+        n_pages += 1
+        token = pages.continuation_token
+        yield items, encode_continuation(base, token) if token else None
+    if n_pages == 0: # no base item matched
+        yield page_items([], base, changes, filters, first), None
+
+def append_changes(to_add, to_remove, database_name='healthplanner'):
+    # the schedule is never versioned before its first base is written, the changes then go
+    # straight into a new base
+    view = read_schedule(database_name)
+    if view.base is None:
+        view.apply(log_entry(None, to_add, to_remove))
+        return compact(database_name, view)
+    entry = log_entry(view.base, to_add, to_remove)
+    get_log_container(database_name).upsert_item(entry)
+    view.apply(entry)
+    if view.n_entries >= compact_after:
+        view = compact(database_name, view)
+    return view
+
+def compact(database_name='healthplanner', view=None):
+    view = view or read_schedule(database_name)
+    stats = cosmos.write_generation(view.schedule(), 'schedule', database_name)
+    if not stats['published']:
+        return read_schedule(database_name) # a concurrent compaction published a newer base
+    compacted = ScheduleView(stats['generation'], view.schedule())
+    if view.base is not None:
+        # entries of the old base not in the view, appended while it was written or seen late, are carried over
+        for entry in sorted(view.unapplied(read_log(view.base, 0, database_name)), key=lambda entry: entry['seq']):
+            entry = log_entry(compacted.base, entry['to_add'], entry['to_remove'])
+            get_log_container(database_name).upsert_item(entry)
+            compacted.apply(entry)
+    with schedule_views_lock:
+        schedule_views[database_name] = compacted
+    kept = [compacted.base] + ([view.base] if view.base is not None else [])
+    threading.Thread(target=delete_old_log, args=(database_name, kept[:kept_generations]), daemon=True).start()
+    print('schedule compacted:', dict(stats, entries=view.n_entries))
+    return compacted
+
+def delete_old_log(database_name, kept):
+    container = get_log_container(database_name)
+    old_ids = container.query_items(
+        query=old_log_query,
+        parameters=[{'name': '@kept', 'value': kept}],
+        enable_cross_partition_query=True
+    )
+    for item in old_ids:
+        try:
+            container.delete_item(item=item['id'], partition_key=item['id'])
+        except exceptions.CosmosResourceNotFoundError:
+            pass # deleted by a concurrent cleanup
@@ -0,0 +1,105 @@
+# Async counterpart of schedule_log.py for the API, sharing its materialised views
+from azure.cosmos import PartitionKey, exceptions
+import asyncio
+
+# local imports
+import cosmos_aio
+from cosmos import kept_generations
+from schedule_log import log_container, compact_after, reread_window, log_query, old_log_query
+from schedule_log import ScheduleView, log_entry, schedule_views, log_changes, schedule_query
+from schedule_log import page_size, page_items, matches, encode_continuation, decode_continuation
+
+log_databases = set() # databases where the log container is known to exist
+cleanup_tasks = set() # keeps a reference to the running background cleanups
+
+async def get_log_container(database_name):
+    database = cosmos_aio.get_client().get_database_client(database_name)
+    if database_name not in log_databases:
+        await database.create_container_if_not_exists(id=log_container, partition_key=PartitionKey(path='/id', kind='Hash'))
+        log_databases.add(database_name)
+    return database.get_container_client(log_container)
+
+async def read_log(base, seq, database_name):
+    container = await get_log_container(database_name)
+    return [entry async for entry in container.query_items(
+        query=log_query,
+        parameters=[{'name': '@base', 'value': base}, {'name': '@seq', 'value': seq}]
+    )]
+
+async def read_schedule(database_name='healthplanner'):
+    # see schedule_log.read_schedule
+    base = await cosmos_aio.current_generation('schedule', database_name)
+    view = schedule_views.get(database_name)
+    if view is None or view.base != base:
+        view = ScheduleView(base, await cosmos_aio.read('schedule', database_name))
+    if base is not None:
+        view.apply_all(await read_log(base, view.seq - reread_window, database_name))
+    schedule_views[database_name] = view
+    return view
+
+async def schedule_pages(database_name='healthplanner', filters=None, page_size=page_size, continuation=None):
+    # see schedule_log.schedule_pages
+    filters = filters or {}
+    if continuation is None:
+        base, token = await cosmos_aio.current_generation('schedule', database_name), None
+    else:
+        base, token = decode_continuation(continuation)
+    changes = log_changes(await read_log(base, 0, database_name)) if base is not None else {}
+    query, parameters = schedule_query(base, **filters)
+    container = cosmos_aio.get_container('schedule', database_name)
+    pages = container.query_items(query=query, parameters=parameters, max_item_count=page_size).by_page(token)
+    first = token is None
+    n_pages = 0
+    async for page in pages:
+        items = page_items([item async for item in page], base, changes, filters, first)
+        first = False
+        n_pages += 1
+        token = pages.continuation_token
+        yield items, encode_continuation(base, token) if token else None
+    if n_pages == 0: # no base item matched
+        yield page_items([], base, changes, filters, first), None
+
+async def append_changes(to_add, to_remove, database_name='healthplanner'):
+    view = await read_schedule(database_name)
+    if view.base is None:
+        view.apply(log_entry(None, to_add, to_remove))
+        return await compact(database_name, view)
+    entry = log_entry(view.base, to_add, to_remove)
+    await (await get_log_container(database_name)).upsert_item(entry)
+    view.apply(entry)
+    if view.n_entries >= compact_after:
+        view = await compact(database_name, view)
+    return view
+
+async def compact(database_name='healthplanner', view=None):
+    view = view or await read_schedule(database_name)
+    stats = await cosmos_aio.write_generation(view.schedule(), 'schedule', database_name)
+    if not stats['published']:
+        return await read_schedule(database_name) # a concurrent compaction published a newer base
+    compacted = ScheduleView(stats['generation'], view.schedule())
+    if view.base is not None:
+        # entries of the old base not in the view, appended while it was written or seen late, are carried over
+        container = await get_log_container(database_name)
+        for entry in sorted(view.unapplied(await read_log(view.base, 0, database_name)), key=lambda entry: entry['seq']):
+            entry = log_entry(compacted.base, entry['to_add'], entry['to_remove'])
+            await container.upsert_item(entry)
+            compacted.apply(entry)
+    schedule_views[database_name] = compacted
+    kept = [compacted.base] + ([view.base] if view.base is not None else [])
+    task = asyncio.create_task(delete_old_log(database_name, kept[:kept_generations]))
+    cleanup_tasks.add(task)
+    task.add_done_callback(cleanup_tasks.discard)
+    print('schedule compacted:', dict(stats, entries=view.n_entries))
+    return compacted
+
+async def delete_old_log(database_name, kept):
+    container = await get_log_container(database_name)
+    old_ids = [item async for item in container.query_items(
+        query=old_log_query,
+        parameters=[{'name': '@kept', 'value': kept}]
+    )]
+    for item in old_ids:
+        try:
+            await container.delete_item(item=item['id'], partition_key=item['id'])
+        except exceptions.CosmosResourceNotFoundError:
+            pass # deleted by a concurrent cleanup
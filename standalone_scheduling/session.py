@@ -0,0 +1,352 @@
+# module imports
+from pysat.solvers import Solver
+from pysat.card import ITotalizer
+from pysat.formula import WCNFPlus
+from pysat.examples.rc2 import RC2Stratified
+from collections import OrderedDict
+import numpy as np
+import threading
+import time
+
+# local imports
+from utilities import model_as_array
+
+
+def interrupt(oracle):
+    try:
+        oracle.interrupt()
+    except NotImplementedError:
+        pass # e.g. CaDiCaL, the solve runs to the end
+
+def solve_until(oracle, assumptions, deadline=None):
+    # oracle.solve, or None if deadline (time.perf_counter) passes first
+    if deadline is None:
+        return oracle.solve(assumptions=assumptions)
+    if time.perf_counter() >= deadline:
+        return None
+    timer = threading.Timer(deadline - time.perf_counter(), interrupt, [oracle])
+    timer.start()
+    try:
+        return oracle.solve_limited(assumptions=assumptions, expect_interrupt=True)
+    finally:
+        timer.cancel()
+        timer.join()
+        try:
+            oracle.clear_interrupt()
+        except NotImplementedError:
+            pass
+
+
+def minimise_distance(oracle, old_model, assumptions=[], get_totalizer=None, progress=None, deadline=None):
+    # Linear search (SAT-UNSAT) on the Hamming distance to old_model: every model found
+    # tightens a totalizer bound over the "changed" literals, so the last model found
+    # before the solver answers UNSAT has the proven minimal distance.
+    # get_totalizer(ubound) must return an ITotalizer over [-l for l in old_model]
+    # whose clauses are already in the oracle.
+    # progress, if given, is called with the stats after every model found.
+    # Once a model is found, the search stops with the best one at deadline (time.perf_counter).
+    # The model returned gives the values of the variables of old_model, in the same order.
+    variables = np.abs(np.asarray(old_model))
+    contiguous = bool(len(variables) == 0 or (variables[0] == 1 and (np.diff(variables) == 1).all()))
+    old_values = model_as_array(old_model)
+    new_model = None
+    smallest_distance = None
+    stats = {'distance': None, 'optimal': False, 'solver_calls': 0, 'models': 0, 'solve_time': 0.0}
+    start = time.perf_counter()
+    oracle.set_phases(old_model) # start the search from the old schedule
+    bound_assumptions = []
+    while True:
+        stats['solver_calls'] += 1
+        status = solve_until(oracle, assumptions + bound_assumptions, deadline if new_model is not None else None)
+        if status is None:
+            break # out of time, the distance is not proven minimal
+        if not status:
+            stats['optimal'] = new_model is not None
+            break
+        new_model = oracle.get_model()
+        if contiguous:
+            new_model = new_model[:len(variables)] # drop auxiliary variables
+        else:
+            new_model = np.asarray(new_model)[variables - 1].tolist()
+        smallest_distance = int((model_as_array(new_model) != old_values).sum())
+        # print('new smallest distance:', smallest_distance)
+        stats['models'] += 1
+        if progress is not None:
+            progress(dict(stats, distance=smallest_distance, solve_time=time.perf_counter() - start))
+        if smallest_distance == 0:
+            stats['optimal'] = True
+            break
+        # the first distance found is an upper bound, no need to count any higher
+        totalizer = get_totalizer(smallest_distance)
+        bound_assumptions = [-totalizer.rhs[smallest_distance-1]] # at most smallest_distance-1 changes
+    stats['distance'] = smallest_distance
+    stats['solve_time'] = time.perf_counter() - start
+    return new_model, smallest_distance, stats
+
+
+def minimise_violations(oracle, old_model, soft, weights, fixed=[], get_totalizer=None, progress=None, budget=None,
+                        maxsat=None):
+    # Weighted staff requests: soft literals, violated when false, of positive integer weights.
+    # Disjoint cores of the requests give a lower bound on the weight of the violated ones.
+    # The weights are then stratified, heaviest first: within each weight, a linear search
+    # (SAT-UNSAT) with a totalizer over the requests of that weight minimises how many are
+    # violated, and that number is kept as a bound while the lighter ones are searched. Every
+    # totalizer counts requests, not units of weight, so its size does not depend on the
+    # weights. This is lexicographic, optimal only when each weight outweighs all the lighter
+    # requests together, so with the budget (seconds) left, maxsat(soft, weights, fixed,
+    # deadline), e.g. maximise_granted, computes the optimum and returns its model, or None
+    # at deadline. Otherwise the cost is an upper bound, reported with the lower bound. The
+    # closest model to old_model granting the requests of the best model found is then
+    # returned, with the same deadline.
+    # get_totalizer(literals, ubound) must return an ITotalizer over [-l for l in literals]
+    # whose clauses are already in the oracle, for old_model and for the requests of a weight.
+    # fixed are assumptions never violated, returns None if they cannot hold.
+    start = time.perf_counter()
+    deadline = start + budget if budget is not None else None
+    weight = dict(zip(soft, weights))
+    stats = {'cost': None, 'lower_bound': 0, 'cost_optimal': False, 'violated': None, 'cost_calls': 0, 'strata': 0, 'maxsat_calls': 0}
+    cost_of = lambda model: sum(w for l, w in weight.items() if l not in model)
+
+    def report():
+        stats['solve_time'] = time.perf_counter() - start
+        if progress is not None:
+            progress(dict(stats))
+
+    oracle.set_phases(old_model) # start the search from the old schedule
+    # lower bound: every core of the requests costs at least its lightest request
+    active = list(soft)
+    best = None
+    while best is None:
+        stats['cost_calls'] += 1
+        status = solve_until(oracle, fixed + active, deadline)
+        if status is None: # out of time before any model, the requests are dropped
+            stats['cost_calls'] += 1
+            if not oracle.solve(assumptions=fixed):
+                return None, None, stats
+            best = set(oracle.get_model())
+        elif status:
+            best = set(oracle.get_model())
+        else:
+            core = set(oracle.get_core() or []).intersection(active)
+            if not core:
+                return None, None, stats
+            stats['lower_bound'] += min(weight[l] for l in core)
+            active = [l for l in active if l not in core]
+    stats['cost'] = cost_of(best)
+    report()
+    # upper bound: one stratum per weight, the heavier strata keep their number of violated requests
+    bounds = []
+    optimal = True
+    for stratum_weight in sorted(set(weights), reverse=True):
+        if stats['cost'] <= stats['lower_bound']:
+            break
+        literals = [l for l in soft if weight[l] == stratum_weight]
+        violated = sum(1 for l in literals if l not in best)
+        stats['strata'] += 1
+        status = True
+        while violated > 0:
+            totalizer = get_totalizer(literals, violated)
+            stats['cost_calls'] += 1
+            status = solve_until(oracle, fixed + bounds + [-totalizer.rhs[violated-1]], deadline)
+            if not status:
+                break
+            best = set(oracle.get_model())
+            violated = sum(1 for l in literals if l not in best)
+            stats['cost'] = cost_of(best)
+            report()
+        if status is None:
+            optimal = False
+            break
+        if violated < len(literals):
+            bounds.append(-get_totalizer(literals, violated).rhs[violated]) # at most violated
+    if optimal and stats['cost'] > stats['lower_bound'] and len(set(weights)) == 1:
+        stats['lower_bound'] = stats['cost'] # a single stratum is proved
+    if stats['cost'] > stats['lower_bound'] and maxsat is not None and (deadline is None or time.perf_counter() < deadline):
+        stats['maxsat_calls'] += 1
+        model = maxsat(soft, weights, fixed, deadline)
+        if model is not None:
+            best = set(model)
+            stats['cost'] = stats['lower_bound'] = cost_of(best)
+            report()
+    stats['cost_optimal'] = stats['cost'] == stats['lower_bound']
+    granted = [l for l in soft if l in best]
+    stats['violated'] = len(soft) - len(granted)
+    new_model, distance, distance_stats = minimise_distance(oracle, old_model, fixed + granted,
+                                                            lambda ubound: get_totalizer(old_model, ubound), None, deadline)
+    stats = dict(distance_stats, **stats)
+    stats['solve_time'] = time.perf_counter() - start
+    if progress is not None:
+        progress(stats)
+    return new_model, distance, stats
+
+
+def maximise_granted(formula, solver_name, soft, weights, fixed=[], deadline=None):
+    # Optimal model of the weighted requests with RC2, a core-guided MaxSAT solver, its weights
+    # stratified by the diversity-based heuristic (blo='div'): the permanent constraints of
+    # formula and fixed are hard. It runs on its own oracle, interrupted at deadline
+    # (time.perf_counter), in which case None is returned.
+    wcnf = WCNFPlus()
+    wcnf.extend(formula.clauses)
+    for atmost in getattr(formula, 'atmosts', []):
+        wcnf.append(atmost, is_atmost=True)
+    wcnf.extend([l] for l in fixed)
+    for l, weight in zip(soft, weights):
+        wcnf.append([l], weight=weight)
+    wcnf.nv = max(wcnf.nv, formula.nv)
+    with RC2Stratified(wcnf, solver=solver_name, adapt=True, exhaust=True, minz=True, blo='div') as rc2:
+        if deadline is None:
+            return rc2.compute()
+        timer = threading.Timer(max(0.0, deadline - time.perf_counter()), rc2.interrupt)
+        timer.start()
+        try:
+            model = rc2.compute(expect_interrupt=True)
+        finally:
+            timer.cancel()
+            timer.join()
+        return None if rc2.interrupted else model
+
+
+def explain_infeasibility(oracle, assumptions, fixed=[]):
+    # Explains why the permanent constraints and assumptions (the negotiable constraints)
+    # are unsatisfiable together, on the oracle that just failed: returns a minimal subset
+    # of assumptions that conflicts (MUS) and a minimal subset to drop so that all the
+    # others hold (MCS). fixed are assumptions never dropped. Returns None, None if the
+    # permanent constraints and fixed are already unsatisfiable on their own.
+    stats = {'solver_calls': 0}
+    def satisfiable(subset):
+        stats['solver_calls'] += 1
+        return oracle.solve(assumptions=fixed + subset)
+
+    if not satisfiable([]):
+        return None, None, stats
+    if satisfiable(assumptions):
+        return [], [], stats
+    # deletion-based minimisation of the core, each unsatisfiable subset shrinks it to its own core
+    core = list(dict.fromkeys(l for l in oracle.get_core() or [] if l in set(assumptions)))
+    mus = []
+    while core:
+        literal = core.pop()
+        if satisfiable(mus + core):
+            mus.append(literal) # necessary for the conflict
+        else:
+            smaller_core = set(oracle.get_core() or [])
+            core = [l for l in core if l in smaller_core]
+    # grows a maximal satisfiable subset, the requests of the conflict last so that they are the
+    # ones dropped, and every model found adds all the assumptions it satisfies at once
+    in_mus = set(mus)
+    remaining = [l for l in assumptions if l not in in_mus] + mus
+    satisfied, mcs = [], []
+    while remaining:
+        literal = remaining.pop(0)
+        if satisfiable(satisfied + [literal]):
+            model = set(oracle.get_model())
+            satisfied.append(literal)
+            satisfied.extend(l for l in remaining if l in model)
+            remaining = [l for l in remaining if l not in model]
+        else:
+            mcs.append(literal)
+    return mus, mcs, stats
+
+
+class InfeasibleConstraints(Exception):
+    # raised where the solve runs, conflicts and relax are schedule items of the negotiable constraints
+    def __init__(self, message, conflicts=(), relax=()):
+        super().__init__(message, list(conflicts), list(relax))
+        self.message = message
+        self.conflicts = list(conflicts)
+        self.relax = list(relax)
+
+    @property
+    def detail(self):
+        return {'error': self.message, 'conflicts': self.conflicts, 'relax': self.relax}
+
+
+class SolverSession():
+    """
+    Long-lived solver loaded once with the permanent constraints of a roster.
+    Negotiable constraints are passed as assumptions on every call, so the
+    clauses learned while solving one request are reused by the next ones.
+    """
+
+    max_totalizers = 8 # totalizers kept for the most recent old models
+    max_evictions = 64 # totalizers evicted before the oracle is rebuilt
+
+    def __init__(self, solver_name, formula, n_variables):
+        self.solver_name = solver_name
+        self.n_variables = n_variables
+        self.formula = formula
+        self.oracle = Solver(name=solver_name, bootstrap_with=formula)
+        self.top_id = max(formula.nv, n_variables)
+        self.totalizers = OrderedDict()
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.nb_requests = 0
+
+    def _totalizer(self, old_model, ubound):
+        # totalizer clauses only define their output literals, so they can stay in the
+        # oracle once the old model is evicted from the cache, until _renew drops them
+        key = tuple(old_model)
+        totalizer = self.totalizers.get(key)
+        if totalizer is None:
+            totalizer = ITotalizer(lits=[-l for l in old_model], ubound=ubound, top_id=self.top_id)
+            self.oracle.append_formula(totalizer.cnf.clauses)
+            self.top_id = totalizer.top_id
+            self.totalizers[key] = totalizer
+            if len(self.totalizers) > self.max_totalizers:
+                _, evicted = self.totalizers.popitem(last=False)
+                evicted.delete()
+                self.evictions += 1
+        elif totalizer.ubound < ubound:
+            totalizer.increase(ubound=ubound, top_id=self.top_id)
+            if totalizer.nof_new:
+                self.oracle.append_formula(totalizer.cnf.clauses[-totalizer.nof_new:])
+            self.top_id = totalizer.top_id
+        self.totalizers.move_to_end(key)
+        return totalizer
+
+    def _renew(self):
+        # between two searches, with the lock held: the clauses of the evicted totalizers
+        # would otherwise make the oracle grow with every old model ever solved
+        if self.evictions < self.max_evictions:
+            return
+        for totalizer in self.totalizers.values():
+            totalizer.delete()
+        self.totalizers.clear()
+        self.oracle.delete()
+        self.oracle = Solver(name=self.solver_name, bootstrap_with=self.formula)
+        self.top_id = max(self.formula.nv, self.n_variables)
+        self.evictions = 0
+
+    def solve(self, assumptions=[]):
+        with self.lock:
+            self.nb_requests += 1
+            if self.oracle.solve(assumptions=assumptions):
+                return self.oracle.get_model()[:self.n_variables]
+            return None
+
+    def find_closest_model(self, old_model, assumptions=[], progress=None):
+        with self.lock:
+            self.nb_requests += 1
+            self._renew()
+            return minimise_distance(self.oracle, old_model, assumptions,
+                                     lambda ubound: self._totalizer(old_model, ubound), progress)
+
+    def find_preferred_model(self, old_model, soft, weights, budget=None, progress=None):
+        # weighted requests instead of assumptions, see minimise_violations
+        with self.lock:
+            self.nb_requests += 1
+            self._renew()
+            return minimise_violations(self.oracle, old_model, soft, weights, [],
+                                       lambda literals, ubound: self._totalizer(literals, ubound), progress, budget,
+                                       lambda *args: maximise_granted(self.formula, self.solver_name, *args))
+
+    def explain(self, assumptions, fixed=[]):
+        with self.lock:
+            return explain_infeasibility(self.oracle, assumptions, fixed)
+
+    def delete(self):
+        with self.lock:
+            for totalizer in self.totalizers.values():
+                totalizer.delete()
+            self.totalizers.clear()
+            self.oracle.delete()
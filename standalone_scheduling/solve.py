@@ -1,18 +1,15 @@
 # module imports
 from pysat.solvers import Solver
 from pysat.card import *
+from pysat.formula import IDPool, WCNF
+from collections import OrderedDict
+import numpy as np
+import os
 import pathlib
+import threading
 from datetime import date
 import json
 
-from fastapi import FastAPI
-# from routers.wellknown import wellknown
-from fastapi.middleware.cors import CORSMiddleware
- 
-app = FastAPI()
-# app.include_router(wellknown)
-app.add_middleware(CORSMiddleware, allow_origins=["https://chat.openai.com"])
-
 # Define the data model
 class Constraint():
     def __init__(self,
@@ -44,117 +41,206 @@ class ScheduleChange():
 
 # local imports
 import cosmos
+import schedule_log
 from utilities import binary_variable_encoding, binary_variable_decoding
 from utilities import days_between, compute_distance, date_and_time_as_string
 from utilities import write_to_excel, model_as_schedule, schedule_as_model
-from utilities import compute_binary_variable_index
+from utilities import compute_binary_variable_index, changed_variables, variables_as_schedule, model_as_literals
+from model import ScheduleModel
+from session import SolverSession, InfeasibleConstraints
+from rolling import RollingSession, worked_shifts
+from decompose import split, solve_components
+from results import fingerprint, result_cache
+from metrics import span, count, registry
+from portfolio import solve_portfolio
+from roster import Roster, get_roster
+from cardinality import encodings, card_encoding_types, default_solvers
+from cardinality import sliding_window_atmost, formula_size
+from constraints import ConstraintIndex, normalised_constraint, relative_dates, calendar_kinds, relative_kinds, constraint_id
+from constraints import constraint_weight
 
 
 parent_path = pathlib.Path(__file__).parent.resolve()
 
-n_staff = 5 # 1 <=_staff_index <= n_staff
-n_shifts = 4 # 0 <= shift_index <= n_shifts-1
-top_id = n_staff * n_shifts
-
-staff_dict = {'Alice' : 1, 'Bob' : 2, 'Charlie' : 3, 'David' : 4, 'Eve' : 5}
-staff_inverted_dict = {str(value) : key for key, value in staff_dict.items()}
+solver_sessions = {} # roster key -> SolverSession
+solver_sessions_lock = threading.Lock()
+decompositions = OrderedDict() # (roster key, encoding, fixed variables) -> components of the permanent constraints
+max_decompositions = 8
+soft_budget = float(os.environ.get("SOLVER_TIME_BUDGET", 10)) # seconds to weigh staff requests against each other
 
-def service_constraint(shift_index):
-    # use top_id to ensure that auxiliary variables are given new indices
+def service_constraint(roster, shift_index, encoding='native', vpool=None):
+    # use vpool to ensure that auxiliary variables are given new indices
     cnfplus = CNFPlus()
-    if shift_index % 2 == 0: # day shift
-        nb_staff_required = 3
-    else: # night shift
-        nb_staff_required = 1
-    literals = [binary_variable_encoding(shift_index, staff_index, n_staff) for staff_index in range(1, n_staff+1)]
-    # print("service constraints literals:", literals)
-    cnfplus.append([literals, nb_staff_required], is_atmost=True) # = CardEnc.equals(lits=literals, bound=nb_staff_required)
-    cnfplus.append([[-x for x in literals], len(literals) - nb_staff_required], is_atmost=True) # implements an at_least constraitn
-    # overall we have implemented an is_equal constraint 
+    nb_staff_required = roster.staff_required(shift_index)
+    for staff_indices in roster.teams.values():
+        literals = [binary_variable_encoding(shift_index, staff_index, roster.n_staff) for staff_index in staff_indices]
+        # print("service constraints literals:", literals)
+        if encoding != 'native':
+            cnfplus.extend(CardEnc.equals(lits=literals, bound=nb_staff_required, vpool=vpool, encoding=card_encoding_types[encoding]).clauses)
+            continue
+        cnfplus.append([literals, nb_staff_required], is_atmost=True) # = CardEnc.equals(lits=literals, bound=nb_staff_required)
+        cnfplus.append([[-x for x in literals], len(literals) - nb_staff_required], is_atmost=True) # implements an at_least constraitn
+        # overall we have implemented an is_equal constraint 
     return cnfplus
 
-def sliding_window_constraint(staff_index, sliding_window_size, bound):
+def sliding_window_constraint(roster, staff_index, sliding_window_size, bound, encoding='native', vpool=None):
     # print("new sw constraint")
     cnfplus = CNFPlus()
-    for first_shift_index in range(n_shifts-sliding_window_size+1):
+    if encoding == 'shared':
+        literals = [binary_variable_encoding(shift_index, staff_index, roster.n_staff) for shift_index in range(roster.n_shifts)]
+        cnfplus.extend(sliding_window_atmost(literals, sliding_window_size, bound, vpool))
+        return cnfplus
+    for first_shift_index in range(roster.n_shifts-sliding_window_size+1):
         # print('fsi:', first_shift_index)
-        literals = [binary_variable_encoding(first_shift_index + t, staff_index, n_staff) for t in range(sliding_window_size) if first_shift_index + t <= n_shifts-1]
+        literals = [binary_variable_encoding(first_shift_index + t, staff_index, roster.n_staff) for t in range(sliding_window_size) if first_shift_index + t <= roster.n_shifts-1]
         # print("sliding window literals:", literals)
-        cnfplus.append([literals, bound], is_atmost=True) # cnfplus.atmost(literals, bound, top_id) # cnfplus.append(CardEnc.equals(lits=literals, bound=bound))
+        if encoding == 'native':
+            cnfplus.append([literals, bound], is_atmost=True) # cnfplus.atmost(literals, bound, top_id) # cnfplus.append(CardEnc.equals(lits=literals, bound=bound))
+        else:
+            cnfplus.extend(CardEnc.atmost(lits=literals, bound=bound, vpool=vpool, encoding=card_encoding_types[encoding]).clauses)
     return cnfplus
 
-def retrieve_negotiable_constraints(container_name):
-
-    negotiable_constraints = []
+def retrieve_negotiable_constraints(container_name, roster, horizon=None, soft=True):
 
     # with open(parent_path / filename, 'r') as f:
     #     constraints_as_list_of_dict = json.load(f)
-    constraints_as_list_of_dict = cosmos.read(container_name)
+    horizon = horizon or roster.horizon()
+    index = ConstraintIndex(cosmos.read(container_name, roster.database_name))
+    if soft:
+        return negotiable_constraints_as_soft_clauses(index.in_horizon(horizon), roster, horizon)
+    return negotiable_constraints_as_clauses(index.in_horizon(horizon), roster, horizon)
 
-    for constraint_as_dict in constraints_as_list_of_dict:
-        staff_index = staff_dict[constraint_as_dict['staff_name']]
-        # print(constraint_as_dict['staff_name'])
-
-        if constraint_as_dict['calendar_or_relative'] in ['calendar', 'calendrier']:
-            today = str(date.today())
-            h24_index = days_between(today, constraint_as_dict['date'])
-            h12_index = h24_index * 2
-        elif constraint_as_dict['calendar_or_relative'] in ['relative', 'relatif']:
-            relative_date = {'demain' : 1, 'tomorrow' : 1, 'après-demain' : 2, 'day after tomorrow' : 2, 'la semaine prochaine' : 7, 'next week' : 7, 'le mois prochain' : 30, 'next month' : 30}
-            h24_index = relative_date[constraint_as_dict['date']]
-            h12_index = h24_index * 2
-        else:
-            print('Error: calendar_or_relative should be either calendar or relative')
-        # print('first_h12_index:', h12_index)
+def negotiable_constraints_as_clauses(constraints_as_list_of_dict, roster, horizon=None):
 
-        if constraint_as_dict["time"] in ['night', 'nuit']:
-            h12_index += 1
-        elif constraint_as_dict["time"] in ['day', 'jour']:
-            pass
-        else:
-            print('Error: day_or_night should be either day or night')
-        # print('second_h12_index:', h12_index)
+    horizon = horizon or roster.horizon()
+    negotiable_constraints = []
 
-        binary_variable_index = binary_variable_encoding(h12_index, staff_index, n_staff)
-        negotiable_constraints.append([-binary_variable_index])
+    for constraint_as_dict in constraints_as_list_of_dict:
+        literal = negotiable_constraint_literal(constraint_as_dict, roster, horizon)
+        if literal is not None:
+            negotiable_constraints.append([literal])
 
     return negotiable_constraints
 
-def get_permanent_constraints():
+def negotiable_constraints_as_soft_clauses(constraints_as_list_of_dict, roster, horizon=None):
+    # weighted unit clauses, see constraints.constraint_weight, a shift requested twice keeps its heaviest weight
+    horizon = horizon or roster.horizon()
+    weights = {}
+    for constraint_as_dict in constraints_as_list_of_dict:
+        literal = negotiable_constraint_literal(constraint_as_dict, roster, horizon)
+        if literal is not None:
+            weights[literal] = max(weights.get(literal, 0), constraint_weight(constraint_as_dict, roster, horizon.start))
+    formula = WCNF()
+    for literal, weight in weights.items():
+        formula.append([literal], weight=weight)
+    return formula
 
-    formula = CNFPlus()
+def negotiable_constraint_literal(constraint_as_dict, roster, horizon):
+    # the staff member is off on the shift of the constraint, None outside the horizon
+    staff_index = roster.staff_dict[constraint_as_dict['staff_name']]
+    # print(constraint_as_dict['staff_name'])
+
+    if constraint_as_dict['calendar_or_relative'] in calendar_kinds:
+        h24_index = horizon.day_index(constraint_as_dict['date'])
+        h12_index = h24_index * 2
+    elif constraint_as_dict['calendar_or_relative'] in relative_kinds:
+        h24_index = relative_dates[constraint_as_dict['date']]
+        h12_index = h24_index * 2
+    else:
+        print('Error: calendar_or_relative should be either calendar or relative')
+    # print('first_h12_index:', h12_index)
 
-    # print('retrieving permanent constraints..')
-    for shift_index in range(n_shifts):
-        formula.extend(service_constraint(shift_index))
+    if constraint_as_dict["time"] in ['night', 'nuit']:
+        h12_index += 1
+    elif constraint_as_dict["time"] in ['day', 'jour']:
+        pass
+    else:
+        print('Error: day_or_night should be either day or night')
+    # print('second_h12_index:', h12_index)
+    if not horizon.contains(h12_index):
+        return None # past shift or beyond the horizon, nothing to forbid
+
+    binary_variable_index = binary_variable_encoding(h12_index, staff_index, roster.n_staff)
+    return -binary_variable_index
 
-    for staff_index in range(1, n_staff+1):
-        formula.extend(sliding_window_constraint(staff_index, 14, 4)) # no more than 4 shifts in a week
-        formula.extend(sliding_window_constraint(staff_index, 7, 3)) # no more than 3 day-consecutive or night-consecutive shifts
-        formula.extend(sliding_window_constraint(staff_index, 2, 1)) # no 24h in a row shifts
+def get_permanent_constraints(roster, encoding='native'):
 
+    formula = CNFPlus()
+    vpool = IDPool(start_from=roster.top_id+1) # auxiliary variables of the cardinality encodings
+
+    with span('permanent_constraints', encoding=encoding):
+        # print('retrieving permanent constraints..')
+        for shift_index in range(roster.n_shifts):
+            formula.extend(service_constraint(roster, shift_index, encoding, vpool))
+
+        # by default: no more than 4 shifts in a week, no more than 3 day-consecutive or night-consecutive shifts
+        # and no 24h in a row shifts
+        for staff_index in range(1, roster.n_staff+1):
+            for sliding_window_size, bound in roster.sliding_windows:
+                formula.extend(sliding_window_constraint(roster, staff_index, sliding_window_size, bound, encoding, vpool))
+        formula.nv = max(formula.nv, vpool.top)
+
+    for name, value in formula_size(formula).items():
+        registry.set('formula_' + name, value, roster=roster.name, encoding=encoding)
     return formula
 
+def compare_encodings(roster):
+    # formula size of the permanent constraints for every encoding
+    return {encoding: formula_size(get_permanent_constraints(roster, encoding)) for encoding in encodings}
+
 def find_closest_model(solver, formula, old_model):
+    # cold search on a throw-away session, compute_new_model uses the warm one of the roster
     # print('old model:', old_model)
-    smallest_distance = n_shifts * n_staff # initialize with a large value
-    new_model = None
-    nb_models = 0
-    with Solver(name=solver, bootstrap_with=formula, warm_start=True) as oracle:
-        while oracle.solve() and smallest_distance > 2:
-            candidate_model = oracle.get_model()
-            d = compute_distance(candidate_model, old_model)
-            if d < smallest_distance:
-                # print('Old smallest distance:', smallest_distance, '. New smallest distance:', d)
-                smallest_distance = d
-                new_model = candidate_model
-                # print(new_model)
-            oracle.add_clause([-l for l in new_model])
-            nb_models += 1
-            # if nb_models%10 == 0:
-            #     print('number of satisfying models found:', nb_models)
-            #     print(candidate_model)
-    return new_model, smallest_distance
+    session = SolverSession(solver, formula, len(old_model))
+    try:
+        return session.find_closest_model(old_model)
+    finally:
+        session.delete()
+
+def get_solver_session(roster, encoding='native', solver_name=None):
+    # one warm solver per roster and encoding, loaded with the permanent constraints on first use
+    solver_name = solver_name or default_solvers[encoding]
+    with solver_sessions_lock:
+        key = (roster.key(), encoding, solver_name)
+        if key not in solver_sessions:
+            solver_sessions[key] = SolverSession(solver_name, get_permanent_constraints(roster, encoding), roster.top_id)
+        return solver_sessions[key]
+
+def get_rolling_session(roster, horizon, encoding='native', solver_name=None):
+    # one rolling session per roster and encoding, rebuilt from a new anchor when too many days have
+    # passed, or when evicted totalizers have grown its oracle
+    solver_name = solver_name or default_solvers[encoding]
+    with solver_sessions_lock:
+        key = (roster.key(), encoding, solver_name, 'rolling')
+        session = solver_sessions.get(key)
+        if session is not None and (not (session.n_frozen <= session.offset(horizon) <= 2 * session.max_past_days) or
+                                    session.evictions >= session.max_evictions):
+            session.delete()
+            session = None
+        if session is None:
+            session = solver_sessions[key] = RollingSession(solver_name, roster, encoding, horizon.start)
+        return session
+
+def get_decomposition(roster, encoding='native', assumptions=[]):
+    # the fixed variables only cut the constraint graph when a whole shift of a team is
+    # fixed, otherwise the components of the permanent constraints are reused
+    fixed = np.zeros(roster.top_id, dtype=bool)
+    fixed[[abs(l)-1 for l in assumptions]] = True
+    fixed = fixed.reshape(roster.n_shifts, roster.n_staff)
+    if not any(fixed[:, np.array(staff_indices)-1].all(axis=1).any() for staff_indices in roster.teams.values()):
+        fixed[:] = False
+    fixed_variables = frozenset((np.flatnonzero(fixed) + 1).tolist())
+    key = (roster.key(), encoding, fixed_variables)
+    with solver_sessions_lock:
+        if key in decompositions:
+            decompositions.move_to_end(key)
+            return decompositions[key]
+    decomposition = split(get_permanent_constraints(roster, encoding), roster.top_id, fixed_variables)
+    with solver_sessions_lock:
+        decompositions[key] = decomposition
+        if len(decompositions) > max_decompositions:
+            decompositions.popitem(last=False)
+    return decomposition
 
 def add_negotiable_constraints_and_solve(formula):
     negotiable_constraints = retrieve_negotiable_constraints('data/negotiable_constraints.json')
@@ -165,56 +251,175 @@ def add_negotiable_constraints_and_solve(formula):
     solver.solve()
     return solver.get_model()
 
-def write_model_to_cosmos(model):
-    schedule = model_as_schedule(model, n_staff, staff_inverted_dict)
+def write_model_to_cosmos(model, roster, old_model=None):
+    # a whole new schedule is written as a new base, a change of old_model only appends its diff to the log
+    if old_model is not None:
+        to_add, to_remove = model_diff(old_model, model, roster)
+        view = schedule_log.append_changes(to_add, to_remove, roster.database_name)
+        print('schedule changes appended:', {'to_add': len(to_add), 'to_remove': len(to_remove), 'entries': view.n_entries})
+        return
+    schedule = model_as_schedule(model, roster)
     # with open('data/schedule.json', 'w') as f:
     #     json.dump(schedule, f, indent=4)
-    cosmos.empty_container('healthplanner', 'schedule')
-    for item in schedule:
-        cosmos.write(item, 'schedule')
-
-def compute_new_model(old_model):
-
-    formula_negotiable_constraints = retrieve_negotiable_constraints('negotiable_constraints')
-    print('negotiable constraints:', formula_negotiable_constraints)
-    # formula_negotiable_constraints.extend(formula_additional_negotiable_constraints)
-    formula_to_solve = get_permanent_constraints()
-    formula_to_solve.extend(formula_negotiable_constraints)
-    new_model, distance = find_closest_model('minicard', formula_to_solve, old_model)
-    return new_model    
-
-def write_model_diff_to_cosmos(old_model):
-
-    new_model = compute_new_model(old_model)
-    to_add = []
-    to_remove = []
-    cosmos.empty_container('healthplanner', 'schedule_diff_to_add')
-    cosmos.empty_container('healthplanner', 'schedule_diff_to_remove')
-    for old_v, new_v in zip(old_model, new_model):
-        shift_index, staff_index = binary_variable_decoding(abs(old_v), n_staff)
-        calendar_date, time = date_and_time_as_string(shift_index)
-        item = {"id": str(abs(old_v)),
-                "staff_name": staff_inverted_dict[str(staff_index)],
-                "date": calendar_date,
-                "time": time,
-                "validated": False}
-        if old_v * new_v < 0: # w and w have opposite sign when they disagree
-            if new_v > 0:
-                to_add.append(item)
-                cosmos.write(item, 'schedule_diff_to_add')  
-            else:
-                to_remove.append(item)
-                cosmos.write(item, 'schedule_diff_to_remove')
+    stats = cosmos.write_generation(schedule, 'schedule', roster.database_name)
+    print('schedule written:', stats)
+
+def compute_new_model(old_model, roster, encoding='native', portfolio=False, horizon=None, worked=()):
+
+    formula_negotiable_constraints = retrieve_negotiable_constraints('negotiable_constraints', roster, horizon)
+    return solve_new_model(old_model, formula_negotiable_constraints, roster, encoding, portfolio, horizon, worked)
+
+def solve_new_model(old_model, formula_negotiable_constraints, roster, encoding='native', portfolio=False,
+                    horizon=None, worked=(), progress=None, budget=None):
+    # CPU-bound part of compute_new_model, without Cosmos round trips
+    # progress is called with the stats of the search after every model found
+    # worked: the schedule items of the shifts before horizon, frozen by rolling rosters
+    key = fingerprint(roster, encoding, old_model, formula_negotiable_constraints, worked, budget)
+    cached = cached_model(key)
+    if cached is not None:
+        if progress is not None:
+            progress({'distance': cached[1], 'cached': True})
+        return cached[0]
+    new_model = solve_model(old_model, formula_negotiable_constraints, roster, encoding, portfolio, horizon, worked, progress, budget)
+    result_cache.put(key, new_model, compute_distance(ScheduleModel.from_model(old_model, roster.n_staff), new_model))
+    return new_model
+
+def cached_model(key):
+    # the same request solved again, e.g. nothing changed between two calls, is answered from
+    # result_cache, (new model, distance) or None
+    cached = result_cache.get(key)
+    count('result_cache_lookups', hit=cached is not None)
+    if cached is not None:
+        print('cached model:', {'distance': cached[1], 'fingerprint': key})
+    return cached
+
+def solve_model(old_model, formula_negotiable_constraints, roster, encoding='native', portfolio=False,
+                horizon=None, worked=(), progress=None, budget=None):
+    # solve_new_model without the result cache, the API looks it up before queuing the solve
+    with span('solve', roster=roster.name):
+        new_model = find_new_model(model_as_literals(old_model), formula_negotiable_constraints, roster, encoding, portfolio,
+                                   horizon, worked, progress, budget)
+    # bit-packed, as the result is kept in the cache and sent back from the solve workers
+    return ScheduleModel.from_model(new_model, roster.n_staff)
+
+def count_solve(stats, roster):
+    # solver calls and models enumerated by a search, see session.minimise_distance
+    for name in ['solver_calls', 'models', 'cost_calls', 'components']:
+        if stats.get(name):
+            count(name, stats[name], roster=roster.name)
+
+def find_new_model(old_model, formula_negotiable_constraints, roster, encoding='native', portfolio=False,
+                   horizon=None, worked=(), progress=None, budget=None):
+    # solve_model on a list of literals
+    if isinstance(formula_negotiable_constraints, WCNF):
+        # granting every request is the common case, it is solved as assumptions like hard
+        # constraints, and only when some of them conflict are they weighed against each other
+        assumptions = [clause[0] for clause in formula_negotiable_constraints.soft]
+        new_model = solve_closest_model(old_model, assumptions, roster, encoding, portfolio, horizon, worked, progress)
+        if new_model is not None:
+            return new_model
+        return solve_preferred_model(old_model, formula_negotiable_constraints, roster, encoding, horizon, worked, progress, budget)
+    # negotiable constraints are unit clauses, they are passed to the warm solver as assumptions
+    assumptions = [clause[0] for clause in formula_negotiable_constraints]
+    new_model = solve_closest_model(old_model, assumptions, roster, encoding, portfolio, horizon, worked, progress)
+    if new_model is None:
+        raise infeasibility(roster, assumptions, encoding, horizon, worked)
+    return new_model
+
+def solve_closest_model(old_model, assumptions, roster, encoding='native', portfolio=False, horizon=None, worked=(), progress=None):
+    # closest model to old_model where all the assumptions hold, None if they cannot
+    if portfolio:
+        # cold solves raced in parallel processes, the winners are counted in /metrics (portfolio_wins_total)
+        formula = get_permanent_constraints(roster, encoding)
+        new_model, distance, stats = solve_portfolio(formula, old_model, assumptions)
+    elif roster.rolling:
+        horizon = horizon or roster.horizon()
+        session = get_rolling_session(roster, horizon, encoding)
+        new_model, distance, stats = session.find_closest_model(old_model, horizon, worked, assumptions, progress)
+    else:
+        components, free_variables = get_decomposition(roster, encoding, assumptions)
+        if len(components) > 1:
+            # independent teams or time blocks, each distance minimised on its own, on the warm session
+            new_model, distance, stats = solve_components(get_solver_session(roster, encoding), components, free_variables,
+                                                          old_model, assumptions, progress)
+        else:
+            new_model, distance, stats = get_solver_session(roster, encoding).find_closest_model(old_model, assumptions, progress)
+    print('closest model:', stats)
+    count_solve(stats, roster)
+    return new_model
+
+def solve_preferred_model(old_model, formula_negotiable_constraints, roster, encoding='native', horizon=None,
+                          worked=(), progress=None, budget=None):
+    # weighted staff requests: the lightest set of requests is violated, then the schedule changes
+    # the least, the best model found within budget seconds is returned
+    budget = soft_budget if budget is None else budget
+    soft = [clause[0] for clause in formula_negotiable_constraints.soft]
+    weights = formula_negotiable_constraints.wght
+    if roster.rolling:
+        horizon = horizon or roster.horizon()
+        session = get_rolling_session(roster, horizon, encoding)
+        new_model, distance, stats = session.find_preferred_model(old_model, horizon, worked, soft, weights, budget, progress)
+    else:
+        new_model, distance, stats = get_solver_session(roster, encoding).find_preferred_model(old_model, soft, weights, budget, progress)
+    print('preferred model:', stats)
+    count_solve(stats, roster)
+    if new_model is None:
+        raise infeasibility(roster, [], encoding, horizon, worked)
+    return new_model
+
+def unmet_constraints(formula_negotiable_constraints, new_model, roster, horizon=None):
+    # schedule items of the staff requests that new_model does not grant
+    horizon = horizon or roster.horizon()
+    clauses = formula_negotiable_constraints.soft if isinstance(formula_negotiable_constraints, WCNF) else formula_negotiable_constraints
+    unmet = [clause[0] for clause in clauses if new_model[abs(clause[0])-1] != clause[0]]
+    items = variables_as_schedule([abs(l) for l in unmet], roster, horizon)
+    for item in items:
+        item['id'] = constraint_id(item['staff_name'], item['date'], item['time'])
+    return items
+
+def infeasibility(roster, assumptions, encoding='native', horizon=None, worked=()):
+    # explains an unsatisfiable solve on the warm session of the roster, whatever solved it
+    horizon = horizon or roster.horizon()
+    if roster.rolling:
+        mus, mcs, stats = get_rolling_session(roster, horizon, encoding).explain(assumptions, horizon, worked)
+    else:
+        mus, mcs, stats = get_solver_session(roster, encoding).explain(assumptions)
+    print('infeasibility explained:', stats)
+    if mus is None:
+        return InfeasibleConstraints('the permanent constraints of roster {0} cannot be satisfied'.format(roster.name))
+    conflicts, relax = [variables_as_schedule([abs(l) for l in literals], roster, horizon) for literals in [mus, mcs]]
+    for item in conflicts + relax:
+        item['id'] = constraint_id(item['staff_name'], item['date'], item['time']) # id of the negotiable constraint
+    return InfeasibleConstraints('{0} staff requests conflict, {1} of them must be relaxed'.format(len(conflicts), len(relax)), conflicts, relax)
+
+def write_model_diff_to_cosmos(old_model, roster, horizon=None, worked=()):
+
+    horizon = horizon or roster.horizon()
+    new_model = compute_new_model(old_model, roster, horizon=horizon, worked=worked)
+    to_add, to_remove = model_diff(old_model, new_model, roster, horizon)
+    print('diff to add written:', cosmos.write_generation(to_add, 'schedule_diff_to_add', roster.database_name))
+    print('diff to remove written:', cosmos.write_generation(to_remove, 'schedule_diff_to_remove', roster.database_name))
     # with open('data/diff.json', 'w') as f:
     #     json.dump({'to_add': to_add, 'to_remove': to_remove}, f, indent=4)
     
     return to_add, to_remove
 
+def model_diff(old_model, new_model, roster, horizon=None):
+
+    if new_model is None:
+        raise ValueError('no new model to compare with, the constraints are unsatisfiable')
+    horizon = horizon or roster.horizon()
+    with span('diff'):
+        variables, new_values = changed_variables(old_model, new_model)
+        to_add = variables_as_schedule(variables[new_values], roster, horizon, validated=False)
+        to_remove = variables_as_schedule(variables[~new_values], roster, horizon, validated=False)
+    return to_add, to_remove
+
 
 ######## API ########
 
 # @app.get("/getScheduleChanges", summary="Propose schedule updates to satisfy constraints", operation_id="getScheduleChanges")
-def write_schedule_diffs(query: str = None):
+def write_schedule_diffs(query: str = None, ward: str = 'default'):
     """
     Constraints are read from the Cosmos DB container 'negotiable_constraints'.
     The schedule is read from the Cosmos DB container 'schedule'.
@@ -223,11 +428,14 @@ def write_schedule_diffs(query: str = None):
     The items to remove are written to the Cosmos DB container 'schedule_diff_to_remove'.
     """
 
-    old_schedule = cosmos.read('schedule')
+    roster = get_roster(ward)
+    horizon = roster.horizon()
+    old_schedule = schedule_log.read_schedule(roster.database_name).schedule()
     # print('old schedule:', old_schedule)
-    old_model = schedule_as_model(old_schedule, n_staff, n_shifts, staff_dict)
+    old_model = schedule_as_model(old_schedule, roster, horizon)
     # print('old model:', old_model)
-    to_add, to_remove = write_model_diff_to_cosmos(old_model)
+    worked = worked_shifts(old_schedule, roster, horizon) if roster.rolling else ()
+    to_add, to_remove = write_model_diff_to_cosmos(old_model, roster, horizon, worked)
 
     return to_add, to_remove
 
@@ -240,9 +448,9 @@ def update_constraints(body: Constraint):
     """
     Add a constraint to the Cosmos DB container 'negotiable_constraints'.
     """
-    constraint = {'staff_name': body.staff_name, 'calendar_or_relative': body.calendar_or_relative, 'date': body.date, 'time': body.time, 'id': cosmos.randomword(10)}    
-    cosmos.write(constraint, 'negotiable_constraints')
-    # TODO: check if constraint is already in the container and if so, do not add it again.
+    roster = get_roster()
+    constraint = normalised_constraint(body.staff_name, body.calendar_or_relative, body.date, body.time, roster, roster.horizon())
+    cosmos.write(constraint, 'negotiable_constraints', roster.database_name) # idempotent, the id is the (staff, shift)
 
 # body = Constraint(staff_name='Bob', calendar_or_relative='calendar', date='2023-11-20', time='night')
 # update_constraints(body)
@@ -266,41 +474,30 @@ def validate_change(body: ScheduleChange):
 # validate_change(body)
 
 # @app.get("/getSchedule", summary="Get the schedule", operation_id="getSchedule")
-def get_schedule(query: str = None):
+def get_schedule(query: str = None, ward: str = 'default'):
     """
     Get the schedule from the Cosmos DB container 'schedule'.
     If all diffs are validated, update the schedule first.
     """
-    to_add = cosmos.read('schedule_diff_to_add')
+    roster = get_roster(ward)
+    horizon = roster.horizon()
+    to_add = cosmos.read('schedule_diff_to_add', roster.database_name)
     # print('to_add:', to_add)
-    to_remove = cosmos.read('schedule_diff_to_remove')
+    to_remove = cosmos.read('schedule_diff_to_remove', roster.database_name)
     # print('to_remove:', to_remove)
-    old_schedule = cosmos.read('schedule')
-    # print('old_schedule:', old_schedule)
 
     if len(to_add) == 0 and len(to_remove) == 0:
-        return old_schedule
+        return schedule_log.read_schedule(roster.database_name).schedule()
     
     else:
-        model = schedule_as_model(old_schedule, n_staff, n_shifts, staff_dict)
-        # print('model:', model)
-        for change_to_add in to_add:
-            if not change_to_add["validated"]:
-                raise Exception('not all changes are validated')
-            else:
-                binary_variable_index = compute_binary_variable_index(change_to_add["staff_name"], change_to_add["date"], change_to_add["time"], staff_dict, n_staff)
-                model[binary_variable_index-1] = binary_variable_index
-        # print('model:', model)
-        for change_to_remove in to_remove:
-            if not change_to_remove["validated"]:
+        for change in to_add + to_remove:
+            if not change["validated"]:
                 raise Exception('not all changes are validated')
-            else:
-                binary_variable_index = compute_binary_variable_index(change_to_remove["staff_name"], change_to_remove["date"], change_to_remove["time"], staff_dict, n_staff)
-                model[binary_variable_index-1] = -binary_variable_index
-        # print('model:', model)
-
-        new_schedule = model_as_schedule(model, n_staff, staff_inverted_dict)
-        return new_schedule
+            compute_binary_variable_index(change["staff_name"], change["date"], change["time"], roster, horizon) # unknown staff or shift
+        view = schedule_log.append_changes(to_add, to_remove, roster.database_name)
+        cosmos.write_generation([], 'schedule_diff_to_add', roster.database_name)
+        cosmos.write_generation([], 'schedule_diff_to_remove', roster.database_name)
+        return view.schedule()
 
 # new_schedule = get_schedule()
 # for item in new_schedule:
@@ -315,9 +512,10 @@ def get_schedule(query: str = None):
 
 # if __name__=='__main__':
     
-#     formula_permanent_constraints = get_permanent_constraints()
+#     roster = get_roster()
+#     formula_permanent_constraints = get_permanent_constraints(roster)
 
-#     formula_negotiable_constraints = retrieve_negotiable_constraints('data/negotiable_constraints.json')
+#     formula_negotiable_constraints = retrieve_negotiable_constraints('negotiable_constraints', roster)
 #     formula_to_solve = formula_permanent_constraints.copy()
 #     formula_to_solve.extend(formula_negotiable_constraints)
 #     print('original negotiable constraints', formula_to_solve.clauses)
@@ -327,10 +525,10 @@ def get_schedule(query: str = None):
 #         else:
 #             raise Exception('impossible to satisfy all constraints')
 #     print('old_model:', old_model)
-#     write_model_to_cosmos(old_model)
-#     write_to_excel(old_model, formula_negotiable_constraints, 'data/schedule.xlsx', n_staff)
+#     write_model_to_cosmos(old_model, roster)
+#     write_to_excel(old_model, formula_negotiable_constraints, 'data/schedule.xlsx', roster.n_staff)
 
-#     write_model_diff_to_cosmos(old_model)
+#     write_model_diff_to_cosmos(old_model, roster)
     
 
 
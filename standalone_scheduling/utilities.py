@@ -1,13 +1,11 @@
 #module imports
 import datetime
 from datetime import date as datetime_date, datetime, timedelta
-import openpyxl
-from openpyxl.styles import PatternFill
-from openpyxl.styles import colors
+import numpy as np
 import pathlib
 
 # local imports
-import cosmos
+from model import ScheduleModel
 
 parent_path = pathlib.Path(__file__).parent.resolve()
 
@@ -30,6 +28,10 @@ def days_between(d1, d2):
     return abs((d2 - d1).days)
 
 def write_to_excel(model, constraints, suffix, n_staff):
+    # openpyxl is only needed here, the API never imports it
+    import openpyxl
+    from openpyxl.styles import PatternFill
+    from openpyxl.styles import colors
 
     # print('writing schedule to excel file')
     # suffix = "schedule.xlsx"
@@ -64,15 +66,43 @@ def write_to_excel(model, constraints, suffix, n_staff):
 
     wb.save(filename)
 
+def model_as_array(model):
+    # truth values of a model (list of signed literals or ScheduleModel) as a bool array, index i is variable i+1
+    if isinstance(model, ScheduleModel):
+        return model.values()
+    if isinstance(model, np.ndarray):
+        return model > 0
+    return np.fromiter(model, dtype=np.int64, count=len(model)) > 0
+
+def array_as_model(values):
+    variables = np.arange(1, len(values)+1)
+    return np.where(values, variables, -variables).tolist()
+
+def model_as_literals(model):
+    # what the solvers take, a list of signed literals
+    if isinstance(model, ScheduleModel):
+        return model.literals()
+    return model
+
 def compute_distance(model_A, model_B):
     assert(len(model_A)==len(model_B))
-    d = 0
-    for v, w in zip(model_A, model_B):
-        if v * w < 0: # w and w have opposite sign when they disagree
-            d += 1
-    return(d)
-
-def date_and_time_as_string(shift_index):
+    if isinstance(model_A, ScheduleModel) and isinstance(model_B, ScheduleModel):
+        return model_A.distance(model_B)
+    # number of variables with different truth values (XOR + popcount)
+    return int(np.count_nonzero(model_as_array(model_A) != model_as_array(model_B)))
+
+def changed_variables(old_model, new_model):
+    # variables whose truth value differs between both models, and their new values
+    if isinstance(old_model, ScheduleModel) and isinstance(new_model, ScheduleModel):
+        return old_model.changed(new_model)
+    old_values = model_as_array(old_model)
+    new_values = model_as_array(new_model)
+    changed = np.flatnonzero(old_values != new_values)
+    return changed + 1, new_values[changed]
+
+def date_and_time_as_string(shift_index, horizon=None):
+    if horizon is not None:
+        return horizon.date_and_time(shift_index)
     days = shift_index // 2
     today = datetime_date.today()
     calendar_date = str(today + timedelta(days=days))
@@ -82,45 +112,52 @@ def date_and_time_as_string(shift_index):
         time = 'night'
     return calendar_date, time
 
-def model_as_schedule(model, n_staff, staff_inverted_dict):
+def variables_as_schedule(variables, roster, horizon=None, **fields):
+    # decodes an array of binary variable indices into schedule items, fields are added to every item
+    horizon = horizon or roster.horizon()
+    variables = np.asarray(variables)
+    shift_indices = (variables - 1) // roster.n_staff
+    staff_indices = variables - shift_indices * roster.n_staff
     schedule = []
-    for v in model:
-        shift_index, staff_index = binary_variable_decoding(abs(v), n_staff)
-        if v > 0:
-            calendar_date, time = date_and_time_as_string(shift_index)
-            schedule.append({"id": str(abs(v)), "staff_name": staff_inverted_dict[str(staff_index)], "date": calendar_date, "time": time})
+    for v, shift_index, staff_index in zip(variables.tolist(), shift_indices.tolist(), staff_indices.tolist()):
+        calendar_date, time = horizon.date_and_time(shift_index)
+        schedule.append(dict({"id": str(v), "staff_name": roster.staff_inverted_dict[str(staff_index)], "date": calendar_date, "time": time}, **fields))
     return schedule
 
-def schedule_as_model(schedule, n_staff, n_shifts, staff_dict):
+def model_as_schedule(model, roster, horizon=None):
+    if isinstance(model, ScheduleModel):
+        return variables_as_schedule(model.true_variables(), roster, horizon)
+    return variables_as_schedule(np.flatnonzero(model_as_array(model)) + 1, roster, horizon)
+
+def schedule_as_model(schedule, roster, horizon=None):
     
     # print('schedule:', schedule)
-    model = [-i for i in range(1, n_staff*n_shifts+1)]
-    # print('model:', model)
+    horizon = horizon or roster.horizon()
+    model = ScheduleModel(roster.top_id, roster.n_staff)
     for item in schedule:
-        staff_index = staff_dict[item["staff_name"]]
-        shift_index = days_between(item["date"], str(datetime_date.today())) * 2
-        if item["time"] == "night":
-            shift_index += 1
-        binary_variable_index = binary_variable_encoding(shift_index, staff_index, n_staff)
-        # print('binary_variable_index:', binary_variable_index)
-        model[binary_variable_index-1] = binary_variable_index
+        staff_index = roster.staff_dict[item["staff_name"]]
+        shift_index = horizon.shift_index(item["date"], item["time"])
+        if not horizon.contains(shift_index):
+            continue # already worked, or beyond the horizon
+        model.set(staff_index, shift_index)
 
     return model
 
-def compute_binary_variable_index(staff_name, date, time, staff_dict, n_staff):
-    staff_index = staff_dict[staff_name]
-    shift_index = days_between(date, str(datetime_date.today())) * 2
-    if time == "night":
-        shift_index += 1
-    binary_variable_index = binary_variable_encoding(shift_index, staff_index, n_staff)
+def compute_binary_variable_index(staff_name, date, time, roster, horizon=None):
+    horizon = horizon or roster.horizon()
+    staff_index = roster.staff_dict[staff_name]
+    shift_index = horizon.shift_index(date, time)
+    if not horizon.contains(shift_index):
+        raise ValueError('{0} {1} is outside the horizon of roster {2}'.format(date, time, roster.name))
+    binary_variable_index = binary_variable_encoding(shift_index, staff_index, roster.n_staff)
     return binary_variable_index
 
 # if __name__=='__main__':
 
-    # n_staff, n_shifts = 5, 4
-    # staff_dict = {'Alice' : 1, 'Bob' : 2, 'Charlie' : 3, 'David' : 4, 'Eve' : 5}
+    # import cosmos
+    # from roster import get_roster
 
-    # schedule_as_model(cosmos.read('schedule') , n_staff, n_shifts)
+    # schedule_as_model(cosmos.read('schedule'), get_roster())
 
 
 
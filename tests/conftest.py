@@ -0,0 +1,58 @@
+import os
+import pathlib
+import sys
+
+import pytest
+
+root = pathlib.Path(__file__).parent.parent
+sys.path.insert(1, str(root))
+sys.path.insert(1, str(root / 'standalone_scheduling'))
+sys.path.insert(1, str(root / 'benchmarks'))
+import local_cosmos
+local_cosmos.install() # before the app modules bind azure.cosmos.CosmosClient
+
+containers = ['schedule', 'negotiable_constraints', 'schedule_diff_to_add', 'schedule_diff_to_remove']
+
+
+@pytest.fixture(scope='session')
+def client():
+    os.chdir(root) # main reads .env and .well-known from the working directory
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def database(request):
+    # an empty database of the local Cosmos stand-in, with the containers of a ward, named
+    # after the test since the app modules remember the databases whose containers exist
+    import cosmos
+    for container_name in containers:
+        cosmos.create_container(request.node.name, container_name)
+    yield request.node.name
+    local_cosmos.reset()
+
+
+@pytest.fixture
+def ward():
+    # registers a synthetic roster with a feasible schedule in the local Cosmos stand-in,
+    # returns it with the requests written, see benchmarks/synthetic.py
+    import cosmos
+    from roster import register_roster
+    from solve import get_permanent_constraints
+    from synthetic import synthetic_roster, synthetic_model, synthetic_requests
+    from utilities import model_as_schedule
+
+    def ward(name, n_staff=16, n_shifts=28, n_teams=1, density=0.05, infeasibility_rate=0.0, seed=0):
+        roster = register_roster(synthetic_roster(n_staff, n_shifts, n_teams, name=name))
+        for container_name in containers:
+            cosmos.create_container(roster.database_name, container_name)
+        old_model = synthetic_model(roster, get_permanent_constraints(roster), seed)
+        cosmos.write_generation(model_as_schedule(old_model, roster), 'schedule', roster.database_name)
+        requests = synthetic_requests(roster, roster.horizon(), density, infeasibility_rate, seed)
+        cosmos.write_many(requests, 'negotiable_constraints', roster.database_name)
+        return roster, requests
+
+    yield ward
+    local_cosmos.reset()
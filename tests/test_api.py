@@ -0,0 +1,72 @@
+import re
+
+
+def metric(client, name, **labels):
+    # value of a metric of /metrics, 0 if it was never recorded
+    text = client.get('/metrics').text
+    selector = ','.join('{0}="{1}"'.format(label, value) for label, value in sorted(labels.items()))
+    match = re.search(r'^healthplanner_{0}\{{{1}\}} (\S+)$'.format(name, re.escape(selector)), text, re.MULTILINE)
+    return float(match.group(1)) if match else 0
+
+
+def test_schedule_changes_solve_teams_apart(client, ward):
+    # requests that can all be granted take the assumption path, through the decomposition of the teams
+    roster, requests = ward('teams', n_teams=2, density=0.05, seed=1)
+    response = client.get('/getScheduleChanges', params={'ward': roster.name})
+    assert response.status_code == 200
+    assert metric(client, 'components_total', roster=roster.name) == 2
+
+
+def test_strict_schedule_changes_explain_conflicts(client, ward):
+    roster, requests = ward('strict', infeasibility_rate=1.0, seed=2)
+    response = client.get('/getScheduleChanges', params={'ward': roster.name, 'strict': True})
+    assert response.status_code == 409
+    detail = response.json()['detail']
+    assert detail['conflicts'] and detail['relax']
+    requested = set(request['id'] for request in requests)
+    assert set(item['id'] for item in detail['conflicts'] + detail['relax']) <= requested
+
+
+def test_repeated_schedule_changes_hit_the_result_cache(client, ward):
+    # the cache is looked up in the API process, whatever worker solved the request first
+    roster, requests = ward('cached', seed=3)
+    first = client.get('/getScheduleChanges', params={'ward': roster.name})
+    hits = metric(client, 'cache_hits', cache='result')
+    second = client.get('/getScheduleChanges', params={'ward': roster.name})
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert metric(client, 'cache_hits', cache='result') == hits + 1
+
+
+def test_portfolio_wins_reach_the_metrics(client, ward, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'solver_portfolio', True)
+    roster, requests = ward('portfolio', seed=4)
+    response = client.get('/getScheduleChanges', params={'ward': roster.name})
+    assert response.status_code == 200
+    wins = re.findall(r'^healthplanner_portfolio_wins_total\{seed="\d+",solver="minicard"\} (\S+)$', client.get('/metrics').text, re.MULTILINE)
+    assert sum(float(value) for value in wins) >= 1
+
+
+def test_unknown_ward_is_not_found(client):
+    for method, path in [('get', '/getScheduleChanges'), ('post', '/scheduleChangesJobs'), ('get', '/getSchedule')]:
+        response = client.request(method, path, params={'ward': 'nowhere'})
+        assert response.status_code == 404
+        assert 'nowhere' in response.json()['detail']
+    change = {'id': '1', 'staff_name': 'Alice', 'date': '2024-01-01', 'time': 'day', 'to_add': True}
+    assert client.post('/validateChange', params={'ward': 'nowhere'}, json=change).status_code == 404
+    constraint = {'id': '1', 'staff_name': 'Alice', 'calendar_or_relative': 'calendar', 'date': '2024-01-01', 'time': 'day'}
+    assert client.post('/addConstraint', params={'ward': 'nowhere'}, json=constraint).status_code == 404
+
+
+def test_resubmitted_request_updates_its_priority(client, ward):
+    import local_cosmos
+    roster, _ = ward('reprioritised', density=0.0)
+    constraint = {'id': '1', 'staff_name': next(iter(roster.staff_dict)), 'calendar_or_relative': 'calendar',
+                  'date': str(roster.horizon().dates[1]), 'time': 'day', 'priority': 1}
+    params = {'ward': roster.name}
+    assert client.post('/addConstraint', params=params, json=constraint).json() == "schedule updated"
+    assert client.post('/addConstraint', params=params, json=constraint).json() == "constraint already added"
+    assert client.post('/addConstraint', params=params, json=dict(constraint, priority=3)).json() == "constraint updated"
+    stored = list(local_cosmos.databases[roster.database_name]['negotiable_constraints'].values())
+    assert [item['priority'] for item in stored] == [3]
@@ -0,0 +1,27 @@
+import cosmos
+
+
+def generation_items(generation, database):
+    return [item for item in cosmos.get_client().get_database_client(database).get_container_client('schedule')
+            .query_items(cosmos.generation_query, [{'name': '@generation', 'value': generation}])]
+
+
+def test_cleanup_keeps_generations_not_yet_published(database):
+    # the writer of newer starts first, a concurrent writer of older publishes and cleans up in between
+    older, newer = cosmos.new_generation(), cosmos.new_generation()
+    cosmos.write_many([cosmos.versioned({'id': 'a'}, newer)], 'schedule', database)
+    cosmos.write_many([cosmos.versioned({'id': 'b'}, older)], 'schedule', database)
+    kept = cosmos.publish_generation('schedule', older, database)
+    cosmos.delete_old_generations('schedule', database, min(kept))
+    assert generation_items(newer, database)
+    assert cosmos.publish_generation('schedule', newer, database) == [newer, older]
+    assert cosmos.current_generation('schedule', database) == newer
+
+
+def test_pointer_never_moves_back(database):
+    # a generation written while a newer one was published is never published, so deleting it is safe
+    older, newer = cosmos.new_generation(), cosmos.new_generation()
+    assert cosmos.publish_generation('schedule', newer, database) == [newer]
+    assert cosmos.publish_generation('schedule', older, database) == [newer]
+    assert cosmos.current_generation('schedule', database) == newer
+    assert cosmos.write_generation([{'id': 'a'}], 'schedule', database)['published']
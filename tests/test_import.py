@@ -0,0 +1,6 @@
+import bench_import
+
+
+def test_import_stays_within_budget():
+    # fresh interpreters, the solver modules and the .env file must not be loaded by the import
+    assert bench_import.main(['--repeat', '3']) == 0
@@ -0,0 +1,19 @@
+from datetime import date, timedelta
+
+from rolling import RollingSession
+from roster import Roster
+from utilities import model_as_array
+
+
+def test_conflicting_requests_do_not_unfreeze_worked_shifts():
+    roster = Roster(['staff{0}'.format(i) for i in range(8)], n_shifts=8, rolling=True, name='rolling')
+    horizon = roster.horizon(date(2024, 1, 2))
+    session = RollingSession('minicard', roster, 'native', horizon.start)
+    # staff0 worked last night, and no two shifts in a row is a sliding window that crosses today
+    worked = [{'staff_name': 'staff0', 'date': str(horizon.start - timedelta(days=1)), 'time': 'night'}]
+    old_model, _, _ = session.find_closest_model([-v for v in range(1, roster.top_id+1)], horizon, worked)
+    assert old_model is not None and not model_as_array(old_model)[0]
+    new_model, _, stats = session.find_closest_model(old_model, horizon, worked, [1]) # staff0 on today's day shift
+    assert new_model is None
+    assert stats['frozen_literals'] > 0
+    assert session.explain([1], horizon, worked)[0] == [1]
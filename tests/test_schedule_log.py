@@ -0,0 +1,24 @@
+import schedule_log
+
+
+def shift(staff_name, date, time='day'):
+    return {'id': '{0}-{1}-{2}'.format(staff_name, date, time), 'staff_name': staff_name, 'date': date, 'time': time}
+
+
+def test_entry_seen_late_is_applied_and_compacted(database):
+    schedule_log.append_changes([shift('Alice', '2024-01-01')], [], database) # first base
+    view = schedule_log.append_changes([shift('Bob', '2024-01-02')], [], database)
+    # written by an instance whose clock is behind, it shows up after the entry of Bob
+    late = schedule_log.log_entry(view.base, [shift('Carol', '2024-01-03')], [])
+    late['seq'] = view.seq - 10**9
+    schedule_log.get_log_container(database).upsert_item(late)
+    names = lambda view: sorted(item['staff_name'] for item in view.schedule())
+    assert names(schedule_log.read_schedule(database)) == ['Alice', 'Bob', 'Carol']
+
+    # compacting a view that missed it still carries it over
+    stale = schedule_log.ScheduleView(view.base, view.schedule())
+    stale.apply_all(entry for entry in schedule_log.read_log(view.base, 0, database) if entry['id'] != late['id'])
+    compacted = schedule_log.compact(database, stale)
+    assert compacted.base != view.base
+    assert names(compacted) == ['Alice', 'Bob', 'Carol']
+    assert names(schedule_log.read_schedule(database)) == ['Alice', 'Bob', 'Carol']
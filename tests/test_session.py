@@ -0,0 +1,51 @@
+import random
+
+from pysat.examples.rc2 import RC2
+from pysat.formula import WCNFPlus
+
+from constraints import normalised_constraint
+from roster import Roster
+from session import SolverSession
+from solve import get_permanent_constraints, negotiable_constraints_as_soft_clauses
+
+
+def test_weighted_requests_reach_the_maxsat_optimum():
+    names = ['staff{0}'.format(i) for i in range(8)]
+    roster = Roster(names, n_shifts=28, name='weighted')
+    horizon = roster.horizon()
+    formula = get_permanent_constraints(roster)
+    rng = random.Random(0)
+    constraints = [normalised_constraint(rng.choice(names), 'calendar', rng.choice(horizon.dates[1:]), 'day', roster, horizon,
+                                         priority=rng.randint(1, 3)) for _ in range(150)]
+    wcnf = negotiable_constraints_as_soft_clauses(constraints, roster, horizon)
+    session = SolverSession('minicard', formula, roster.top_id)
+    old_model = session.solve()
+    soft = [clause[0] for clause in wcnf.soft]
+    new_model, _, stats = session.find_preferred_model(old_model, soft, wcnf.wght)
+    assert new_model is not None
+    # the strata alone are lexicographic, the priorities of several requests add up
+    expected = WCNFPlus()
+    expected.extend(formula.clauses)
+    for atmost in formula.atmosts:
+        expected.append(atmost, is_atmost=True)
+    for clause, weight in zip(wcnf.soft, wcnf.wght):
+        expected.append(clause, weight=weight)
+    with RC2(expected, solver='minicard') as rc2:
+        rc2.compute()
+        assert stats['cost'] == rc2.cost
+    assert stats['cost_optimal'] and stats['maxsat_calls'] == 1
+
+
+def test_session_is_rebuilt_after_evictions():
+    roster = Roster(['staff{0}'.format(i) for i in range(8)], n_shifts=8, name='evictions')
+    session = SolverSession('minicard', get_permanent_constraints(roster), roster.top_id)
+    session.max_evictions = 2
+    old_model = session.solve()
+    oracle = session.oracle
+    for staff_index in range(session.max_totalizers + session.max_evictions):
+        # a new old model every time, each one gets its own totalizer
+        session.find_closest_model([-l if i == staff_index else l for i, l in enumerate(old_model)], [old_model[0]])
+    assert session.evictions == session.max_evictions
+    new_model, distance, _ = session.find_closest_model(old_model, [old_model[0]])
+    assert session.oracle is not oracle and session.evictions == 0 and not session.totalizers
+    assert new_model == old_model and distance == 0